@@ -0,0 +1,313 @@
+"""
+Headless batch runner for object detection, image classification & species identification.
+
+Run it from the `onnx` folder, for example:
+    python batch.py detect /path/to/images -o detect.ndjson
+    python batch.py species /path/to/camera-trap -o species.csv --workers 4 --resume
+
+Every worker process loads its own onnx session once, runs the images in batches
+(`--batch-size` images per inference call) & streams the results to the output file
+(NDJSON or CSV) as soon as they finish. The output file doubles as the checkpoint,
+so `--resume` skips every image which is already present in it.
+
+The cores are split between the workers: each session gets `cpu count // workers` intra op
+threads, instead of one thread per core in every process (cores² threads fighting for the CPU).
+"""
+import os
+os.environ.setdefault("KIVY_NO_ARGS", "1") # do not let kivy parse our cli arguments
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+import sys
+import csv
+import json
+import time
+import argparse
+from multiprocessing import get_context
+
+from onnx_detect import detections_to_list
+from model_downloader import DownloadError
+from model_manifest import fetch_model, is_available
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+# task name: (module, class, session starter, batch runner), the model files are in the manifest
+TASKS = {
+    "detect": ("onnx_detect", "OnnxDetect", "start_detect_session", "run_detect_batch"),
+    "classify": ("onnx_classify", "OnnxClassify", "start_classify_session", "run_classify_batch"),
+    "species": ("onnx_species", "OnnxSpecies", "start_species_session", "run_species_batch"),
+}
+CSV_FIELDS = ["image", "task", "status", "top_label", "top_score", "results", "error"]
+
+# per worker process state
+_engine = None
+_runner = None
+_task = None
+_init_error = None
+
+
+def find_images(root_dir):
+    """Walk the directory tree & yield the image paths in a stable order"""
+    for dir_path, dir_names, file_names in os.walk(root_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if file_name.lower().endswith(IMAGE_EXTS):
+                yield os.path.join(dir_path, file_name)
+
+
+def load_engine(task, model_dir=None, save_dir=None, cache_path=None, threads=None):
+    module_name, class_name, starter, runner = TASKS[task]
+    module = __import__(module_name)
+    kwargs = {}
+    if threads:
+        from session_registry import SessionRegistry
+        kwargs["registry"] = SessionRegistry(max_threads=threads)
+    if model_dir:
+        kwargs["model_dir"] = model_dir
+    if save_dir:
+        kwargs["save_dir"] = save_dir
+    if cache_path:
+        # every worker process opens its own connection to the shared file
+        from result_cache import ResultCache
+        kwargs["cache"] = ResultCache(cache_path)
+    engine = getattr(module, class_name)(**kwargs)
+    if not getattr(engine, starter)():
+        raise RuntimeError(f"Could not start the {task} session from: {engine.model_dir}")
+    return engine, getattr(engine, runner)
+
+
+def init_worker(task, model_dir, save_dir, save_output, batch_size, detect_filters=None, cache_path=None, tiling=None, threads=None, input_dir=None):
+    global _engine, _runner, _task, _init_error
+    _task = task
+    try:
+        _engine, runner = load_engine(task, model_dir, save_dir, cache_path, threads)
+        if detect_filters:
+            _engine.set_filters(**detect_filters)
+        if task == "detect" and save_output:
+            # the annotated images keep the sub folders of the scanned tree
+            _engine.input_root = input_dir
+    except Exception as e:
+        # raising here makes the pool respawn the worker forever, report it per image instead
+        _init_error = str(e)
+        return
+    if task == "detect" and tiling:
+        # one image at a time, its tiles are the batch
+        _runner = lambda paths: [_engine.run_detect_tiled(path, save_output=save_output, batch_size=batch_size, **tiling) for path in paths]
+    elif task == "detect":
+        _runner = lambda paths: runner(paths, batch_size=batch_size, save_output=save_output)
+    else:
+        _runner = lambda paths: runner(paths, batch_size=batch_size)
+
+
+def process_images(image_paths):
+    """Runs one batch of images in the worker & returns one output row per image"""
+    rows = [{"image": path, "task": _task, "status": False, "results": [], "error": ""} for path in image_paths]
+    if _init_error:
+        for row in rows:
+            row["error"] = _init_error
+        return rows
+    try:
+        results = _runner(image_paths)
+    except Exception as e:
+        for row in rows:
+            row["error"] = f"{type(e).__name__}: {e}"
+        return rows
+    for row, result in zip(rows, results):
+        row["status"] = bool(result["status"])
+        if "detections" in result:
+            row["results"] = detections_to_list(result["detections"])
+        else:
+            row["results"] = result["predictions"]
+        if not row["status"]:
+            row["error"] = result["message"]
+    return rows
+
+
+def trim_partial_record(output_path):
+    """Drop a half written last record (left by a crash) so that the image gets processed again"""
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        pos = size
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            block = f.read(step)
+            newline = block.rfind(b"\n")
+            if newline != -1:
+                pos = pos - step + newline + 1
+                break
+            pos -= step
+        if pos != size:
+            f.truncate(pos)
+
+
+def read_checkpoint(output_path, out_format):
+    """Returns the set of images which already have a row in the output file"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", newline="") as f:
+        if out_format == "csv":
+            for row in csv.DictReader(f):
+                if row.get("image"):
+                    done.add(row["image"])
+        else:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["image"])
+                except (ValueError, KeyError):
+                    continue
+    return done
+
+
+class ResultWriter():
+    def __init__(self, output_path, out_format, append=False):
+        self.out_format = out_format
+        is_new = not (append and os.path.exists(output_path) and os.path.getsize(output_path) > 0)
+        self.f = open(output_path, "a" if append else "w", newline="")
+        if out_format == "csv":
+            self.csv_writer = csv.DictWriter(self.f, fieldnames=CSV_FIELDS)
+            if is_new:
+                self.csv_writer.writeheader()
+
+    def write(self, row):
+        if self.out_format == "csv":
+            top = row["results"][0] if row["results"] else {}
+            self.csv_writer.writerow({
+                "image": row["image"],
+                "task": row["task"],
+                "status": row["status"],
+                "top_label": top.get("label", ""),
+                "top_score": top.get("score", ""),
+                "results": json.dumps(row["results"]),
+                "error": row["error"],
+            })
+        else:
+            self.f.write(json.dumps(row) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def run_batch(task, input_dir, output_path, workers=1, out_format=None, resume=False,
+        model_dir=None, save_dir=None, save_output=False, batch_size=8, detect_filters=None, cache_path=None, tiling=None):
+    if out_format is None:
+        out_format = "csv" if output_path.lower().endswith(".csv") else "ndjson"
+    module = __import__(TASKS[task][0])
+    if not is_available(task, model_dir or module.models_dir):
+        # download once in the parent instead of every worker racing for it, without a session:
+        # the parent never creates onnxruntime thread pools
+        try:
+            fetch_model(task, model_dir or module.models_dir)
+        except DownloadError as e:
+            print(f"Error downloading the {task} model: {e}")
+    if save_output:
+        os.makedirs(save_dir or module.save_path, exist_ok=True)
+
+    done = set()
+    if resume:
+        trim_partial_record(output_path)
+        done = read_checkpoint(output_path, out_format)
+    pending = [path for path in find_images(input_dir) if path not in done]
+    print(f"{task}: {len(pending)} images to process, {len(done)} already done")
+    if not pending:
+        return 0
+
+    writer = ResultWriter(output_path, out_format, append=resume)
+    start = time.perf_counter()
+    processed = failed = 0
+    pool = None
+    # the thread budget of every worker process, a single worker keeps onnxruntime's default
+    threads = max(1, (os.cpu_count() or 1) // workers) if workers > 1 else None
+    init_args = (task, model_dir, save_dir, save_output, batch_size, detect_filters, cache_path, tiling, threads, input_dir)
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    try:
+        if workers <= 1:
+            init_worker(*init_args)
+            results = map(process_images, batches)
+        else:
+            # spawned, not forked: the thread pools of onnxruntime (& kivy's state) don't survive a fork
+            pool = get_context("spawn").Pool(processes=workers, initializer=init_worker, initargs=init_args)
+            results = pool.imap_unordered(process_images, batches)
+        next_report = 100
+        for rows in results:
+            for row in rows:
+                writer.write(row)
+                if not row["status"]:
+                    failed += 1
+            processed += len(rows)
+            if processed >= next_report or processed == len(pending):
+                next_report = processed + 100
+                rate = processed / (time.perf_counter() - start)
+                print(f"Processed {processed}/{len(pending)} ({failed} failed), {rate:.1f} images/sec")
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            # an error or a Ctrl-C while writing must not leave the workers running
+            pool.terminate()
+        writer.close()
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Vision AI models over a whole directory of images")
+    parser.add_argument("task", choices=sorted(TASKS.keys()))
+    parser.add_argument("input_dir", help="directory which will be scanned recursively for images")
+    parser.add_argument("-o", "--output", help="output file, `.csv` or `.ndjson` (default: <task>.ndjson)")
+    parser.add_argument("-f", "--format", choices=["ndjson", "csv"], help="output format, guessed from output file by default")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes, the cores are split between them")
+    parser.add_argument("-b", "--batch-size", type=int, default=8, help="images per inference call")
+    parser.add_argument("--resume", action="store_true", help="skip the images already present in the output file")
+    parser.add_argument("--model-dir", help="directory of the onnx model files")
+    parser.add_argument("--save-dir", help="directory for annotated detection images")
+    parser.add_argument("--save-images", action="store_true", help="write annotated images for detection")
+    parser.add_argument("--threshold", type=float, default=0.5, help="minimum detection score")
+    parser.add_argument("--nms-iou", type=float, help="suppress overlapping boxes of the same class above this IoU")
+    parser.add_argument("--classes", help="comma separated class labels to keep, e.g. `person,dog`")
+    parser.add_argument("--exclude-classes", help="comma separated class labels to drop")
+    parser.add_argument("--cache", help="SQLite result cache, unchanged images are answered from it on the next run")
+    parser.add_argument("--tile-size", type=int, help="detect on overlapping tiles of this many pixels (small objects in large photos)")
+    parser.add_argument("--tile-overlap", type=float, default=0.2, help="share of a tile overlapping its neighbours")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.input_dir):
+        parser.error(f"Input directory does not exist: {args.input_dir}")
+    detect_filters = None
+    if args.task == "detect":
+        detect_filters = {
+            "threshold": args.threshold,
+            "nms_iou": args.nms_iou,
+            "allow_classes": args.classes.split(",") if args.classes else None,
+            "deny_classes": args.exclude_classes.split(",") if args.exclude_classes else None,
+        }
+    tiling = None
+    if args.tile_size:
+        if args.task != "detect":
+            parser.error("--tile-size only applies to detect")
+        if not 0 <= args.tile_overlap < 1:
+            parser.error("--tile-overlap must be in [0, 1)")
+        tiling = {"tile_size": args.tile_size, "overlap": args.tile_overlap}
+    output_path = args.output or f"{args.task}.{args.format or 'ndjson'}"
+    failed = run_batch(
+        args.task,
+        args.input_dir,
+        output_path,
+        workers=args.workers,
+        out_format=args.format,
+        resume=args.resume,
+        model_dir=args.model_dir,
+        save_dir=args.save_dir,
+        save_output=args.save_images,
+        batch_size=args.batch_size,
+        detect_filters=detect_filters,
+        cache_path=args.cache,
+        tiling=tiling,
+    )
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Decode time per megapixel of full resolution `cv2.imread` against the reduced JPEG decode
+used by the engines for each model input size.
+
+Run it from the `onnx` folder, for example:
+    python benchmarks/decode_bench.py /path/to/photos/*.jpg
+Without images it writes synthetic 12 & 48 megapixel JPEGs to a temporary folder.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+
+from image_decode import decode_image, image_size, reduction_factor
+
+TARGETS = {
+    "detect": (300, 300),
+    "classify": (224, 224),
+    "species": (480, 480),
+}
+SYNTHETIC_SIZES = [(4000, 3000), (8000, 6000)]
+
+
+def synthetic_images(folder):
+    rng = np.random.default_rng(0)
+    paths = []
+    for width, height in SYNTHETIC_SIZES:
+        # smooth noise compresses like a photo, pure noise would make the decode look slower
+        small = rng.integers(0, 255, size=(height // 16, width // 16, 3), dtype=np.uint8)
+        img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+        path = os.path.join(folder, f"synthetic_{width}x{height}.jpg")
+        cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        paths.append(path)
+    return paths
+
+
+def median_ms(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Full vs reduced JPEG decode time")
+    parser.add_argument("images", nargs="*", help="JPEG files (default: synthetic 12 & 48 MP images)")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = args.images or synthetic_images(folder)
+        for path in paths:
+            size = image_size(path)
+            if size is None:
+                print(f"{path}: not a JPEG, skipped")
+                continue
+            megapixels = size[0] * size[1] / 1e6
+            full = median_ms(lambda: cv2.imread(path), args.runs)
+            print(f"{os.path.basename(path)} {size[0]}x{size[1]} ({megapixels:.1f} MP)")
+            print(f"  {'full':9s} 1/1  {full:8.1f} ms  {full / megapixels:6.2f} ms/MP")
+            for name, target in TARGETS.items():
+                factor = reduction_factor(*size, target)
+                reduced = median_ms(lambda: decode_image(path, target), args.runs)
+                print(f"  {name:9s} 1/{factor}  {reduced:8.1f} ms  {reduced / megapixels:6.2f} ms/MP  x{full / reduced:.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Query latency of `embedding_index.py` for a large photo library, flat scan vs IVF partitions.
+
+Run it from the `onnx` folder, for example:
+    python benchmarks/embedding_bench.py
+    python benchmarks/embedding_bench.py --count 100000 --dim 512 --lists 256 --json embedding_index.json
+
+The index is filled with `--count` synthetic L2 normalized vectors (clusters with noise, like embeddings of
+photos of similar things) in a temporary folder. Reported: the time to add them, the k-means build time &
+the median / p95 ms of a top-10 query for the flat scan & for every `nprobe`, with the recall of the IVF
+results against the exact flat results.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from embedding_index import EmbeddingIndex, l2_normalize
+
+NPROBES = [1, 4, 8, 16, 32]
+
+
+def synthetic_embeddings(count, dim, clusters=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = l2_normalize(rng.standard_normal((clusters, dim), dtype=np.float32))
+    labels = rng.integers(0, clusters, size=count)
+    return l2_normalize(centers[labels] + 0.05 * rng.standard_normal((count, dim), dtype=np.float32))
+
+
+def time_queries(index, queries, k, nprobe=None):
+    """(median ms, p95 ms, ids of the results per query)"""
+    timings = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        matches = index.search(query, k, nprobe)
+        timings.append((time.perf_counter() - start) * 1000)
+        results.append({item for item, _ in matches})
+    return round(float(np.median(timings)), 2), round(float(np.percentile(timings, 95)), 2), results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Top-k query latency of the embedding index, flat vs IVF")
+    parser.add_argument("--count", type=int, default=100000, help="vectors in the index")
+    parser.add_argument("--dim", type=int, default=512, help="embedding size (512 for resnet18)")
+    parser.add_argument("--lists", type=int, default=256, help="IVF partitions")
+    parser.add_argument("--queries", type=int, default=50, help="queries per measurement")
+    parser.add_argument("-k", type=int, default=10, help="matches per query")
+    parser.add_argument("--json", default=None, help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+    if args.count < args.lists or args.queries < 1:
+        parser.error("--count must be at least --lists & --queries at least 1")
+
+    vectors = synthetic_embeddings(args.count, args.dim)
+    ids = [f"photo_{i:07d}.jpg" for i in range(args.count)]
+    rng = np.random.default_rng(1)
+    # queries near indexed photos, as with "more like this one"
+    queries = l2_normalize(vectors[rng.choice(args.count, args.queries)] + 0.02 * rng.standard_normal((args.queries, args.dim), dtype=np.float32))
+    report = {"count": args.count, "dim": args.dim, "k": args.k}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index = EmbeddingIndex(tmp_dir, args.dim)
+        start = time.perf_counter()
+        for first in range(0, args.count, 10000):
+            index.add(ids[first:first + 10000], vectors[first:first + 10000])
+        report["add_s"] = round(time.perf_counter() - start, 2)
+        report["size_mb"] = round(os.path.getsize(os.path.join(tmp_dir, "embeddings.f16")) / (1024 * 1024), 1)
+        print(f"added {args.count} x {args.dim} vectors in {report['add_s']} s, {report['size_mb']} MB on disk")
+
+        # the first query makes the float32 copy of the rows
+        index.search(queries[0], args.k)
+        median, p95, exact = time_queries(index, queries, args.k)
+        report["flat"] = {"median_ms": median, "p95_ms": p95}
+        print(f"flat          : {median:>7.2f} ms median, {p95:>7.2f} ms p95")
+
+        start = time.perf_counter()
+        index.build_ivf(args.lists)
+        report["ivf_build_s"] = round(time.perf_counter() - start, 2)
+        print(f"ivf build     : {report['ivf_build_s']} s for {args.lists} partitions")
+        # the first query sorts the rows by partition
+        index.search(queries[0], args.k, 1)
+        report["ivf"] = {}
+        for nprobe in NPROBES:
+            median, p95, found = time_queries(index, queries, args.k, nprobe)
+            recall = float(np.mean([len(a & b) / len(a) for a, b in zip(exact, found)]))
+            report["ivf"][nprobe] = {"median_ms": median, "p95_ms": p95, "recall": round(recall, 3)}
+            print(f"ivf nprobe {nprobe:>3}: {median:>7.2f} ms median, {p95:>7.2f} ms p95, recall@{args.k} {recall:.3f}")
+        del index
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Tiny synthetic models & images for the benchmarks, no download needed.
+
+The models have the same inputs & outputs as the real ones, so the `Onnx*` engines run them unchanged:
+- detect: uint8 NHWC image -> SSD outputs (boxes (N, 100, 4), classes (N, 100), scores (N, 100), num (N,))
+- classify: float32 NCHW (N, 3, 224, 224) -> 1000 ImageNet logits
+- species: float32 NHWC (N, 480, 480, 3) -> 2498 SpeciesNet logits
+Every model really reads its input (a few reductions & a small dense layer), the outputs are fixed
+per seed, so the post-processing & the drawing have the same work on every run.
+
+Write them to a folder with:
+    python benchmarks/fixtures.py /tmp/bench_fixtures
+Needs the `onnx` package.
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+from model_manifest import MODELS
+
+OPSET = 13
+IMAGE_SIZES = [(640, 480), (1920, 1080), (4000, 3000)]
+DETECT_BOXES = 100
+CLASSIFY_LABELS = 1000
+SPECIES_LABELS = 2498
+
+
+def make_model(nodes, name, inputs, outputs, initializers):
+    graph = helper.make_graph(nodes, name, inputs, outputs, [numpy_helper.from_array(value, key) for key, value in initializers.items()])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", OPSET)])
+    # readable by older onnxruntime releases too
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    return model
+
+
+def detect_model(rng):
+    """SSD contract: boxes [y1, x1, y2, x2] normalized, classes 1-90, scores spread over [0, 1]"""
+    corners = rng.uniform(0.0, 0.7, size=(1, DETECT_BOXES, 2)).astype(np.float32)
+    sizes = rng.uniform(0.05, 0.3, size=(1, DETECT_BOXES, 2)).astype(np.float32)
+    initializers = {
+        "zero": np.zeros(1, dtype=np.float32),
+        "axes_1": np.array([1], dtype=np.int64),
+        "axes_12": np.array([1, 2], dtype=np.int64),
+        "base_boxes": np.concatenate([corners, corners + sizes], axis=2),
+        "base_classes": rng.integers(1, 91, size=(1, DETECT_BOXES)).astype(np.float32),
+        "base_scores": np.sort(rng.uniform(0.0, 1.0, size=(1, DETECT_BOXES)).astype(np.float32))[:, ::-1].copy(),
+        "base_num": np.array([DETECT_BOXES], dtype=np.float32),
+    }
+    nodes = [
+        # (mean of the image) * 0 keeps the input in the graph & the batch dimension in the outputs
+        helper.make_node("Cast", ["image_tensor:0"], ["image_float"], to=TensorProto.FLOAT),
+        helper.make_node("ReduceMean", ["image_float"], ["image_mean"], axes=[1, 2, 3], keepdims=0),
+        helper.make_node("Mul", ["image_mean", "zero"], ["offset"]),
+        helper.make_node("Unsqueeze", ["offset", "axes_1"], ["offset_2d"]),
+        helper.make_node("Unsqueeze", ["offset", "axes_12"], ["offset_3d"]),
+        helper.make_node("Add", ["base_boxes", "offset_3d"], ["detection_boxes:0"]),
+        helper.make_node("Add", ["base_classes", "offset_2d"], ["detection_classes:0"]),
+        helper.make_node("Add", ["base_scores", "offset_2d"], ["detection_scores:0"]),
+        helper.make_node("Add", ["base_num", "offset"], ["num_detections:0"]),
+    ]
+    return make_model(
+        nodes, "synthetic_ssd",
+        [helper.make_tensor_value_info("image_tensor:0", TensorProto.UINT8, ["N", "H", "W", 3])],
+        [
+            helper.make_tensor_value_info("detection_boxes:0", TensorProto.FLOAT, ["N", DETECT_BOXES, 4]),
+            helper.make_tensor_value_info("detection_classes:0", TensorProto.FLOAT, ["N", DETECT_BOXES]),
+            helper.make_tensor_value_info("detection_scores:0", TensorProto.FLOAT, ["N", DETECT_BOXES]),
+            helper.make_tensor_value_info("num_detections:0", TensorProto.FLOAT, ["N"]),
+        ],
+        initializers,
+    )
+
+
+def classifier_model(rng, name, input_name, input_shape, pool_axes, labels, output_name):
+    """Mean of every channel -> dense layer -> logits"""
+    initializers = {
+        "weights": (rng.standard_normal((3, labels)) * 4).astype(np.float32),
+        "bias": rng.standard_normal(labels).astype(np.float32),
+        "scale": np.array(1 / 255, dtype=np.float32),
+    }
+    nodes = [
+        helper.make_node("ReduceMean", [input_name], ["channel_mean"], axes=pool_axes, keepdims=0),
+        helper.make_node("Mul", ["channel_mean", "scale"], ["features"]),
+        helper.make_node("Gemm", ["features", "weights", "bias"], [output_name]),
+    ]
+    return make_model(
+        nodes, name,
+        [helper.make_tensor_value_info(input_name, TensorProto.FLOAT, input_shape)],
+        [helper.make_tensor_value_info(output_name, TensorProto.FLOAT, ["N", labels])],
+        initializers,
+    )
+
+
+def write_models(folder, seed=0):
+    """Writes the three models under their manifest file names, returns {task: path}"""
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    models = {
+        "detect": detect_model(rng),
+        "classify": classifier_model(rng, "synthetic_resnet", "data", ["N", 3, 224, 224], [2, 3], CLASSIFY_LABELS, "resnetv15_dense0_fwd"),
+        "species": classifier_model(rng, "synthetic_speciesnet", "input", ["N", 480, 480, 3], [1, 2], SPECIES_LABELS, "output"),
+    }
+    paths = {}
+    for task, model in models.items():
+        paths[task] = os.path.join(folder, MODELS[task]["file"])
+        onnx.save(model, paths[task])
+    return paths
+
+
+def write_images(folder, sizes=IMAGE_SIZES, seed=0):
+    """Photo like JPEGs, returns {"<width>x<height>": path}"""
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = {}
+    for width, height in sizes:
+        # smooth noise compresses & decodes like a photo
+        small = rng.integers(0, 255, size=(max(1, height // 16), max(1, width // 16), 3), dtype=np.uint8)
+        img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+        key = f"{width}x{height}"
+        paths[key] = os.path.join(folder, f"synthetic_{key}.jpg")
+        cv2.imwrite(paths[key], img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return paths
+
+
+def write_fixtures(folder, seed=0):
+    """Returns (model folder, {"<width>x<height>": image path})"""
+    model_dir = os.path.join(folder, "model_files")
+    write_models(model_dir, seed)
+    return model_dir, write_images(os.path.join(folder, "images"), seed=seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the synthetic benchmark models & images")
+    parser.add_argument("folder", help="output folder")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    model_dir, images = write_fixtures(args.folder, args.seed)
+    print(f"Models: {model_dir}")
+    for key, path in images.items():
+        print(f"Image {key}: {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
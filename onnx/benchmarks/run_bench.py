@@ -0,0 +1,212 @@
+"""
+Offline benchmark of the `Onnx*` engines, stage by stage, with a regression gate.
+
+Run it from the `onnx` folder, for example:
+    python benchmarks/run_bench.py --save-baseline                # once, on the machine running the checks
+    python benchmarks/run_bench.py --out bench.json --tolerance 0.25
+
+The models & images are the synthetic fixtures of `benchmarks/fixtures.py` (written to a temporary
+folder unless `--fixtures-dir` is given), so no download is needed. For every engine & image size the
+median time of each stage is measured on its own: decode, preprocess, inference (`sess.run`),
+postprocess & render (drawing the detection preview). The results are written as JSON & compared
+with the baseline (`benchmarks/baseline.json` by default): the run fails (exit code 1) when a stage is
+slower than the baseline by more than `--tolerance` (relative) and `--min-delta-ms` (absolute, so the
+sub millisecond stages don't fail on noise). The baseline only means something on the same machine.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+import onnxruntime as ort
+
+from fixtures import write_fixtures
+from session_registry import SessionRegistry
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+ENGINES = {
+    # name: (module, class, session starter)
+    "detect": ("onnx_detect", "OnnxDetect", "start_detect_session"),
+    "classify": ("onnx_classify", "OnnxClassify", "start_classify_session"),
+    "species": ("onnx_species", "OnnxSpecies", "start_species_session"),
+}
+PREVIEW_SIZE = 1280
+
+
+def median_ms(fn, runs, warmup):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(float(np.median(timings)), 3)
+
+
+def load_engine(name, model_dir):
+    module_name, class_name, starter = ENGINES[name]
+    module = __import__(module_name)
+    # own registry: no tuned session profile & no other model competing for the memory budget
+    engine = getattr(module, class_name)(save_dir=model_dir, model_dir=model_dir, registry=SessionRegistry())
+    if not getattr(engine, starter)():
+        raise RuntimeError(f"Could not start the {name} session from {model_dir}")
+    return engine
+
+
+def detect_stages(engine, image_path):
+    """Stage name: function, every stage gets the output of the previous one computed once up front"""
+    sess = engine.sess
+    img, original_size = engine.read_image(image_path, save_output=False, preview_size=PREVIEW_SIZE)
+    tensor = np.expand_dims(engine.preprocess_array(img), axis=0)
+    outputs = sess.run(engine.output_names, {engine.input_name: tensor})
+    postprocess = lambda: engine.postprocess(outputs[0][0], outputs[1][0], outputs[2][0], int(outputs[3].item()), *original_size)
+    detections = postprocess()
+    return {
+        "decode": lambda: engine.read_image(image_path, save_output=False, preview_size=PREVIEW_SIZE),
+        "preprocess": lambda: np.expand_dims(engine.preprocess_array(img), axis=0),
+        "inference": lambda: sess.run(engine.output_names, {engine.input_name: tensor}),
+        "postprocess": postprocess,
+        "render": lambda: engine.draw_preview(img, detections, original_size, PREVIEW_SIZE),
+    }
+
+
+def classify_stages(engine, image_path):
+    sess = engine.sess
+    img = engine.read_image(image_path)
+    tensor = np.expand_dims(engine.preprocess_array(img), axis=0)
+    logits = sess.run([engine.output_name], {engine.input_name: tensor})[0]
+    return {
+        "decode": lambda: engine.read_image(image_path),
+        "preprocess": lambda: np.expand_dims(engine.preprocess_array(img), axis=0),
+        "inference": lambda: sess.run([engine.output_name], {engine.input_name: tensor}),
+        "postprocess": lambda: engine.top5_result(engine.softmax(logits)[0], {"predictions": []}),
+    }
+
+
+def species_stages(engine, image_path):
+    sess = engine.sess
+    img = engine.read_image(image_path)
+    tensor = engine.preprocess_array(img)[np.newaxis]
+    logits = sess.run([engine.output_name], {engine.input_name: tensor})[0]
+
+    def postprocess():
+        probabilities = engine.softmax(logits)
+        best = engine.taxonomy.best_supported(probabilities, engine.min_confidence)
+        return engine.species_result(probabilities[0], best[0], {"predictions": []})
+
+    return {
+        "decode": lambda: engine.read_image(image_path),
+        "preprocess": lambda: engine.preprocess_array(img)[np.newaxis],
+        "inference": lambda: sess.run([engine.output_name], {engine.input_name: tensor}),
+        "postprocess": postprocess,
+    }
+
+
+STAGES = {
+    "detect": detect_stages,
+    "classify": classify_stages,
+    "species": species_stages,
+}
+
+
+def run_benchmarks(names, model_dir, images, runs, warmup):
+    """{engine: {image size: {stage: median ms}}}"""
+    results = {}
+    for name in names:
+        engine = load_engine(name, model_dir)
+        results[name] = {}
+        for size, image_path in images.items():
+            stages = STAGES[name](engine, image_path)
+            results[name][size] = {stage: median_ms(fn, runs, warmup) for stage, fn in stages.items()}
+            timings = ", ".join(f"{stage} {ms:.2f}" for stage, ms in results[name][size].items())
+            print(f"{name:<9} {size:<10} {timings} (ms)")
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Stages slower than the baseline: [(engine, size, stage, baseline ms, current ms)]"""
+    regressions = []
+    for name, sizes in results.items():
+        for size, stages in sizes.items():
+            for stage, current in stages.items():
+                base = baseline.get(name, {}).get(size, {}).get(stage)
+                if base is None:
+                    continue
+                if current > base * (1 + tolerance) and current - base > min_delta_ms:
+                    regressions.append((name, size, stage, base, current))
+    return regressions
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "onnxruntime": ort.__version__,
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "machine": f"{platform.system()}-{platform.machine()}",
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stage by stage benchmark of the Onnx* engines on synthetic fixtures")
+    parser.add_argument("engines", nargs="*", help=f"engines to run (default: all of {', '.join(ENGINES)})")
+    parser.add_argument("--runs", type=int, default=20, help="timed runs per stage")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed runs per stage")
+    parser.add_argument("--fixtures-dir", default=None, help="folder for the synthetic models & images (default: temporary)")
+    parser.add_argument("--out", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown of a stage, 0.25 = 25%%")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="slowdowns below this many ms are never a regression")
+    args = parser.parse_args(argv)
+    for name in args.engines:
+        if name not in ENGINES:
+            parser.error(f"unknown engine `{name}`, use: {', '.join(ENGINES)}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_dir, images = write_fixtures(args.fixtures_dir or tmp_dir)
+        stages = run_benchmarks(args.engines or list(ENGINES), model_dir, images, args.runs, args.warmup)
+    report = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": environment(),
+        "runs": args.runs,
+        "stages_ms": stages,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to: {args.out}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline first to enable the regression check")
+        return 0
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    if baseline.get("environment") != report["environment"]:
+        print(f"Note: the baseline was measured with {baseline.get('environment')}")
+    regressions = compare(stages, baseline.get("stages_ms", {}), args.tolerance, args.min_delta_ms)
+    for name, size, stage, base, current in regressions:
+        print(f"REGRESSION {name} {size} {stage}: {base:.2f} -> {current:.2f} ms ({(current / base - 1) * 100:+.0f}%)")
+    if regressions:
+        return 1
+    print(f"No stage is more than {args.tolerance * 100:.0f}% slower than the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
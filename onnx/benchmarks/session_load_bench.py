@@ -0,0 +1,97 @@
+"""
+Session creation time from the plain model vs from the optimized model of `model_cache.py`.
+
+Run it from the `onnx` folder, for example:
+    python benchmarks/session_load_bench.py --model-dir model_files
+    python benchmarks/session_load_bench.py --repeat 10 --json session_load.json # synthetic models
+
+For every model the median time of `InferenceSession(...)` is measured from the `.onnx` file (parse &
+graph optimization on every load, as before), the first cached load (which also writes the optimized
+file) & the later cached loads, for the ORT & the ONNX format of the optimized file. The optimized files
+are written to a temporary folder, the model folder is left untouched.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import onnxruntime as ort
+
+from model_cache import FORMATS, cached_session
+from model_manifest import MODELS, model_file_path
+from session_tuner import load_session_options
+
+
+def plain_load_ms(model_path, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ort.InferenceSession(model_path, sess_options=load_session_options(model_path), providers=["CPUExecutionProvider"])
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(float(np.median(timings)), 1)
+
+
+def cached_load_ms(model_path, fmt, repeat, cache_dir):
+    """(first load incl. writing the optimized model, median of the later loads) in ms"""
+    stats = {}
+    cached_session(model_path, load_session_options(model_path), fmt=fmt, cache_dir=cache_dir, stats=stats)
+    first = stats["load_ms"]
+    timings = []
+    for _ in range(repeat):
+        cached_session(model_path, load_session_options(model_path), fmt=fmt, cache_dir=cache_dir, stats=stats)
+        if stats["source"] != "cache":
+            raise RuntimeError(f"The optimized {fmt} model of {model_path} was not used: {stats['source']}")
+        timings.append(stats["load_ms"])
+    return first, round(float(np.median(timings)), 1)
+
+
+def bench_model(model_path, repeat):
+    result = {"file": os.path.basename(model_path), "size_mb": round(os.path.getsize(model_path) / (1024 * 1024), 2)}
+    result["plain_ms"] = plain_load_ms(model_path, repeat)
+    for fmt in FORMATS:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            result[f"{fmt}_first_ms"], result[f"{fmt}_cached_ms"] = cached_load_ms(model_path, fmt, repeat, cache_dir)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Session creation time with & without the optimized model cache")
+    parser.add_argument("--model-dir", default=None, help="folder with the onnx models (default: synthetic models)")
+    parser.add_argument("--repeat", type=int, default=5, help="loads per measurement")
+    parser.add_argument("--json", default=None, help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_dir = args.model_dir
+        if model_dir is None:
+            from fixtures import write_models
+            model_dir = tmp_dir
+            write_models(model_dir)
+        paths = [model_file_path(task, model_dir) for task in MODELS]
+        paths = [path for path in paths if os.path.exists(path)]
+        if not paths:
+            parser.error(f"no models found in {model_dir}")
+        results = [bench_model(path, args.repeat) for path in paths]
+
+    print(f"{'model':<28} {'size MB':>8} {'plain ms':>9} {'ort 1st':>8} {'ort ms':>7} {'onnx 1st':>9} {'onnx ms':>8}")
+    for item in results:
+        print(
+            f"{item['file']:<28} {item['size_mb']:>8} {item['plain_ms']:>9} {item['ort_first_ms']:>8} {item['ort_cached_ms']:>7}"
+            f" {item['onnx_first_ms']:>9} {item['onnx_cached_ms']:>8}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"onnxruntime": ort.__version__, "repeat": args.repeat, "models": results}, f, indent=2)
+        print(f"Results written to: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Measures the cold start of the app: the import time of every module & the time to the first frame.
+
+Run it from the `onnx` folder, for example:
+    python benchmarks/startup_bench.py --repeat 5 --budget-ms 3000
+
+Every measurement runs in a new python process, so nothing is imported or cached from an earlier one
+(the files are in the OS page cache after the first run, that is the usual start of an installed app).
+The import times come from `python -X importtime`, cumulative, i.e. with everything the module imports.
+The first frame is timed from the start of the process to the first `on_flip` of the window,
+it needs a display (e.g. `xvfb-run` on a headless machine). The run fails (exit code 1) when the
+median time to the first frame goes over the budget.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "kivy.core.window",
+    "kivymd.app",
+    "main",
+    "model_manifest",
+    "model_downloader",
+    "result_cache",
+    "onnx_detect",
+    "onnx_classify",
+    "onnx_species",
+    "screens.cam_obj_detect",
+    "screens.img_obj_classify",
+    "screens.img_species",
+    "screens.setting",
+    "plyer",
+]
+# modules which must not be loaded before the first frame
+HEAVY_MODULES = ["cv2", "onnxruntime", "requests", "plyer", "onnx_detect", "onnx_classify", "onnx_species", "result_cache"]
+
+FIRST_FRAME_SCRIPT = """
+import time
+started = time.perf_counter()
+import sys, json
+import main
+from kivy.clock import Clock
+from kivy.core.window import Window
+imported = time.perf_counter()
+times = {"import_main": imported - started}
+
+def on_start(app):
+    times["on_start"] = time.perf_counter() - started
+
+def on_flip(*args):
+    if "first_frame" in times:
+        return
+    times["first_frame"] = time.perf_counter() - started
+    times["loaded"] = [name for name in HEAVY if name in sys.modules]
+    # let the deferred start work (background model prepare) begin, it must not be part of the frame
+    Clock.schedule_once(lambda dt: app.stop(), 0)
+
+app = main.VisionAiApp()
+app.bind(on_start=on_start)
+Window.bind(on_flip=on_flip)
+app.run()
+print("STARTUP " + json.dumps(times))
+"""
+
+
+def child_env():
+    env = dict(os.environ)
+    env.setdefault("KIVY_NO_ARGS", "1")
+    env.setdefault("KIVY_NO_CONSOLELOG", "1")
+    return env
+
+
+def import_time(module):
+    """Cumulative import time (ms) of a module in a new process, None when it can't be imported"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=app_dir, env=child_env(), capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        return None
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1000
+    return None
+
+
+def first_frame_time(timeout=120):
+    """Times (s) of one start of the app up to the first frame, None when the app couldn't start"""
+    script = f"HEAVY = {HEAVY_MODULES!r}\n" + FIRST_FRAME_SCRIPT
+    try:
+        proc = subprocess.run([sys.executable, "-c", script], cwd=app_dir, env=child_env(), capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None
+    for line in proc.stdout.splitlines():
+        if line.startswith("STARTUP "):
+            return json.loads(line[len("STARTUP "):])
+    print(proc.stderr[-2000:])
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold start time of the app")
+    parser.add_argument("--repeat", type=int, default=3, help="measurements per value, the median is reported")
+    parser.add_argument("--budget-ms", type=float, default=None, help="allowed median time to the first frame")
+    parser.add_argument("--skip-frame", action="store_true", help="only measure the imports (no display needed)")
+    parser.add_argument("--json", dest="json_path", default=None, help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = {"imports_ms": {}, "first_frame": None}
+    print(f"{'module':<28} {'import (ms)':>12}")
+    for module in MODULES:
+        times = [import_time(module) for _ in range(args.repeat)]
+        times = [value for value in times if value is not None]
+        median = statistics.median(times) if times else None
+        results["imports_ms"][module] = median
+        print(f"{module:<28} {'failed' if median is None else f'{median:.1f}':>12}")
+
+    failed = False
+    if not args.skip_frame:
+        runs = [first_frame_time() for _ in range(args.repeat)]
+        runs = [run for run in runs if run]
+        if not runs:
+            print("The app could not be started, is a display available?")
+            return 1
+        frame = {name: statistics.median(run[name] for run in runs) * 1000 for name in ("import_main", "on_start", "first_frame")}
+        frame["loaded"] = sorted(set().union(*(run["loaded"] for run in runs)))
+        results["first_frame"] = frame
+        print(f"\nimport main: {frame['import_main']:.0f} ms, on_start: {frame['on_start']:.0f} ms, first frame: {frame['first_frame']:.0f} ms")
+        if frame["loaded"]:
+            print(f"Heavy modules loaded before the first frame: {', '.join(frame['loaded'])}")
+        if args.budget_ms is not None and frame["first_frame"] > args.budget_ms:
+            print(f"FAIL: first frame after {frame['first_frame']:.0f} ms, budget {args.budget_ms:.0f} ms")
+            failed = True
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Cost of the tracker & the frame rate it buys.
+
+Run it from the `onnx` folder, for example:
+    python benchmarks/tracker_bench.py
+    python benchmarks/tracker_bench.py --model-dir model_files --frames 300 --json tracker.json
+
+1. Tracker alone: median ms of one `Tracker.step` (predict, match & Kalman update of all tracks) for a
+   growing number of objects moving across the frame, the detections are synthetic.
+2. Detector + tracker: frames per second of the whole loop (frame in, boxes out) with the detector
+   running on every frame or only on every N-th one, next to the detector runs per second. Uses the
+   synthetic SSD of `benchmarks/fixtures.py` unless `--model-dir` has the real model.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from fixtures import write_models
+from onnx_detect import DETECTION_DTYPE, OnnxDetect
+from session_registry import SessionRegistry
+from tracker import Tracker
+
+TRACK_COUNTS = [1, 10, 50, 200]
+DETECT_EVERY = [1, 3, 5, 10]
+FRAME_SIZE = (1280, 720)
+
+
+def moving_detections(count, frame, rng_seed=0):
+    """`count` boxes moving on straight lines, the same ones on every call for the same seed"""
+    rng = np.random.default_rng(rng_seed)
+    start = rng.uniform(0, 1000, size=(count, 2))
+    velocity = rng.uniform(-3, 3, size=(count, 2))
+    size = rng.uniform(20, 80, size=(count, 2))
+    corner = start + velocity * frame
+    detections = np.empty(count, dtype=DETECTION_DTYPE)
+    detections["box"] = np.concatenate([corner, corner + size], axis=1)
+    detections["score"] = 0.9
+    detections["class_id"] = 1 + np.arange(count) % 5
+    return detections
+
+
+def bench_tracker(counts, frames, detect_every):
+    """{objects: median ms per step}"""
+    results = {}
+    for count in counts:
+        tracker = Tracker(detect_every=detect_every)
+        timings = []
+        for frame in range(frames):
+            detections = moving_detections(count, frame)
+            start = time.perf_counter()
+            tracker.step(lambda: detections)
+            timings.append((time.perf_counter() - start) * 1000)
+        results[count] = round(float(np.median(timings)), 4)
+        print(f"tracker   {count:>4} objects: {results[count]:.3f} ms per frame (detections every {detect_every} frames)")
+    return results
+
+
+def bench_pipeline(detector, schedules, frames):
+    """{detect every: {"fps": frames per second, "detect_fps": detector runs per second}}"""
+    width, height = FRAME_SIZE
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8) for _ in range(8)]
+    detect = lambda img: detector.run_detect_array(img, save_output=False)["detections"]
+    # warm up the session & its buffers
+    for img in images[:3]:
+        detect(img)
+    results = {}
+    for every in schedules:
+        tracker = Tracker(detect_every=every)
+        runs = 0
+        start = time.perf_counter()
+        for frame in range(frames):
+            img = images[frame % len(images)]
+            _, detected = tracker.step(lambda: detect(img))
+            runs += detected
+        seconds = time.perf_counter() - start
+        results[every] = {"fps": round(frames / seconds, 1), "detect_fps": round(runs / seconds, 1)}
+        print(f"pipeline  detect every {every:>2}: {results[every]['fps']:>7.1f} FPS, {results[every]['detect_fps']:>6.1f} detections per second")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tracker cost & effective FPS vs detection FPS")
+    parser.add_argument("--frames", type=int, default=200, help="frames per measurement")
+    parser.add_argument("--model-dir", default=None, help="folder with the detection model (default: synthetic model)")
+    parser.add_argument("--skip-pipeline", action="store_true", help="only measure the tracker itself")
+    parser.add_argument("--json", default=None, help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+    if args.frames < 1:
+        parser.error("--frames must be at least 1")
+
+    report = {"frames": args.frames, "tracker_ms": bench_tracker(TRACK_COUNTS, args.frames, detect_every=1)}
+    if not args.skip_pipeline:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model_dir = args.model_dir
+            if model_dir is None:
+                model_dir = tmp_dir
+                write_models(model_dir)
+            detector = OnnxDetect(save_dir=model_dir, model_dir=model_dir, registry=SessionRegistry())
+            if not detector.start_detect_session():
+                print(f"Could not start the detection session from: {model_dir}")
+                return 1
+            report["pipeline"] = bench_pipeline(detector, DETECT_EVERY, args.frames)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,7 +22,7 @@ source.include_exts = py,png,jpg,kv,atlas,txtset
 #source.exclude_exts = spec
 
 # (list) List of directory to exclude (let empty to not exclude anything)
-source.exclude_dirs = tests, logs, bin, dist, patches, .venv, venv, env, .env, p4a_local_recipes
+source.exclude_dirs = tests, benchmarks, logs, bin, dist, patches, .venv, venv, env, .env, p4a_local_recipes
 
 # (list) List of exclusions using pattern matching
 # Do not prefix with './'
@@ -0,0 +1,226 @@
+"""
+Detect-then-classify: the boxes of `OnnxDetect` get a fine grained label from `OnnxClassify` (ImageNet)
+or `OnnxSpecies` (SpeciesNet), all boxes of an image in one batched inference call.
+
+Run it from the `onnx` folder, for example:
+    python cascade.py species /path/to/camera-trap -o species_boxes.ndjson --classes bird,cat,dog,horse,sheep,cow,bear
+    python cascade.py classify /path/to/photos -o boxes.ndjson --threshold 0.6
+
+For a camera trap frame with several animals this is one detection plus one batched crop pass instead of
+one full image species run per animal, and every animal gets its own label. The crops are views of the
+decoded image, the only copy is the resize into the classifier batch.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import cv2
+import numpy as np
+from kivy.clock import Clock
+
+from image_decode import decode_image
+from onnx_detect import OnnxDetect, class_id_of, coco_labels, detections_to_list, models_dir
+from tracing import StageTimer, stage
+
+# fine grained task: (module, class, session starter, batched crop probabilities)
+FINE_TASKS = {
+    "classify": ("onnx_classify", "OnnxClassify", "start_classify_session", "classify_crops"),
+    "species": ("onnx_species", "OnnxSpecies", "start_species_session", "species_crops"),
+}
+
+
+def crop_views(img, boxes, padding=0.1, min_size=8):
+    """
+    Views (no copies) of the [x1, y1, x2, y2] boxes in the image, grown by `padding` of their size for some
+    context & clipped to the image. Returns (views, indices of the boxes), boxes smaller than `min_size` are skipped.
+    """
+    height, width = img.shape[:2]
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    grow = np.stack([boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]], axis=1) * padding
+    grown = np.concatenate([boxes[:, :2] - grow, boxes[:, 2:] + grow], axis=1)
+    grown = np.clip(np.round(grown), 0, [width, height, width, height]).astype(np.int32)
+    views = []
+    kept = []
+    for i, (x1, y1, x2, y2) in enumerate(grown.tolist()):
+        if x2 - x1 < min_size or y2 - y1 < min_size:
+            continue
+        views.append(img[y1:y2, x1:x2])
+        kept.append(i)
+    return views, kept
+
+
+class DetectCascade():
+    """
+    `detector` (a started OnnxDetect) finds the boxes, `classifier` (a started OnnxClassify or OnnxSpecies,
+    named by `task`) labels the crops of the boxes above `min_score` & of the `classes` (labels or ids, None for all).
+    At most `max_crops` boxes per image are labelled, the highest scores first.
+    """
+    def __init__(self, detector, classifier, task, min_score=0.5, classes=None, padding=0.1, max_crops=32):
+        if task not in FINE_TASKS:
+            raise ValueError(f"Unknown task: {task}, use one of: {', '.join(FINE_TASKS)}")
+        self.detector = detector
+        self.classifier = classifier
+        self.task = task
+        self.min_score = min_score
+        self.class_ids = {class_id_of(cls) for cls in classes} if classes else None
+        self.padding = padding
+        self.max_crops = max_crops
+
+    def select(self, detections):
+        """Indices of the detections to label, highest score first"""
+        keep = detections["score"] >= self.min_score
+        if self.class_ids is not None:
+            keep &= np.isin(detections["class_id"], list(self.class_ids))
+        indices = np.nonzero(keep)[0]
+        order = np.argsort(-detections["score"][indices], kind="stable")
+        return indices[order][:self.max_crops]
+
+    def fine_result(self, probabilities, best=None):
+        """The predictions of one crop, same format as the full image results of the classifier"""
+        result = {"predictions": []}
+        if self.task == "species":
+            self.classifier.species_result(probabilities, best, result)
+        else:
+            self.classifier.top5_result(probabilities, result)
+        return result["predictions"]
+
+    def label_boxes(self, img, detections, timer=None):
+        """One dict per selected detection: the detection (as in `detections_to_list`) & the `predictions` of its crop"""
+        selected = self.select(detections)
+        views, kept = crop_views(img, detections["box"][selected], self.padding)
+        if not views:
+            return []
+        selected = selected[kept]
+        sess = self.classifier.sess
+        if sess is None:
+            raise RuntimeError(f"The {self.task} session was not initialized! Check if model has been downloaded.")
+        crop_probabilities = getattr(self.classifier, FINE_TASKS[self.task][3])
+        probabilities = crop_probabilities(sess, views, timer)
+        with stage(timer, "postprocess"):
+            best = self.classifier.taxonomy.best_supported(probabilities, self.classifier.min_confidence) if self.task == "species" else None
+            rows = detections_to_list(detections[selected])
+            for row_index, row in enumerate(rows):
+                row["predictions"] = self.fine_result(probabilities[row_index], best[row_index] if best is not None else None)
+        return rows
+
+    def draw_labels(self, img, rows, preview_size=None):
+        """Copy of the image (longer side at most `preview_size`) with every box & its fine label"""
+        height, width = img.shape[:2]
+        scale = min(1.0, preview_size / max(width, height)) if preview_size else 1.0
+        if scale < 1.0:
+            preview = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+        else:
+            preview = img.copy()
+        text_size = max(0.5, preview.shape[1] / 1600)
+        thickness = max(1, int(text_size * 2))
+        for row in rows:
+            x1, y1, x2, y2 = [int(v * scale) for v in row["box"]]
+            fine = row["predictions"][0] if row["predictions"] else {"label": row["label"], "score": row["score"]}
+            cv2.rectangle(preview, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            cv2.putText(preview, f"{fine['label']}: {int(fine['score'] * 100)}%", (x1, max(0, y1 - 7)), cv2.FONT_HERSHEY_SIMPLEX, text_size, (0, 255, 0), thickness)
+        return preview
+
+    def run_cascade(self, image_path, callback=None, caller=None, preview_size=None):
+        """
+        Same shape of result as `OnnxDetect.run_detect`, plus `boxes`: the labelled detections.
+        With `preview_size` the result also carries the annotated `image`.
+        """
+        timer = StageTimer("cascade")
+        final_result = {"status": False, "message": "Initial load", "caller": caller, "boxes": []}
+        with stage(timer, "decode"):
+            # full resolution, the crops of small boxes need every pixel
+            img, _ = decode_image(image_path)
+        if img is None:
+            final_result["message"] = f"Error: Could not load image at {image_path}"
+            final_result["timings"] = timer.result()
+            return final_result
+        try:
+            with stage(timer, "detect"):
+                detected = self.detector.run_detect_array(img, image_path, save_output=False)
+            if not detected["status"]:
+                raise RuntimeError(detected["message"])
+            final_result["detections"] = detected["detections"]
+            final_result["boxes"] = self.label_boxes(img, detected["detections"], timer)
+        except Exception as e:
+            print(f"Cascade error: {e}")
+            final_result["message"] = f"Cascade error: {e}"
+            final_result["timings"] = timer.result()
+            return final_result
+
+        lines = []
+        for i, row in enumerate(final_result["boxes"]):
+            fine = row["predictions"][0] if row["predictions"] else {"label": "-", "score": 0.0}
+            lines.append(f"{i+1}. {row['label']} {row['score']*100:.0f}% -> [b][color=#2574f5]{fine['label']}[/color][/b] {fine['score']*100:.1f}%")
+        final_result["message"] = "\n".join(lines) or "No object to label was detected"
+        final_result["status"] = True
+        if preview_size:
+            with stage(timer, "render"):
+                final_result["image"] = self.draw_labels(img, final_result["boxes"], preview_size)
+            final_result["source"] = image_path
+            final_result["filename"] = f"op-{os.path.basename(image_path)}"
+        final_result["timings"] = timer.result()
+
+        if callback:
+            Clock.schedule_once(lambda dt: callback(final_result))
+        else:
+            return final_result
+
+
+def load_cascade(task, model_dir=None, threshold=0.5, classes=None, padding=0.1, max_crops=32):
+    model_dir = model_dir or models_dir
+    detector = OnnxDetect(model_dir=model_dir, save_dir=model_dir, threshold=threshold)
+    if not detector.start_detect_session():
+        raise RuntimeError(f"Could not start the detect session from: {model_dir}")
+    module_name, class_name, starter, _ = FINE_TASKS[task]
+    classifier = getattr(__import__(module_name), class_name)(model_dir=model_dir, save_dir=model_dir)
+    if not getattr(classifier, starter)():
+        raise RuntimeError(f"Could not start the {task} session from: {model_dir}")
+    return DetectCascade(detector, classifier, task, threshold, classes, padding, max_crops)
+
+
+def main(argv=None):
+    from batch import find_images
+
+    parser = argparse.ArgumentParser(description="Detect objects & label every box with the classification or species model")
+    parser.add_argument("task", choices=sorted(FINE_TASKS))
+    parser.add_argument("input_dir", help="directory which will be scanned recursively for images")
+    parser.add_argument("-o", "--output", help="output file (default: cascade-<task>.ndjson)")
+    parser.add_argument("--model-dir", help="directory of the onnx model files")
+    parser.add_argument("--threshold", type=float, default=0.5, help="minimum detection score of a box to label")
+    parser.add_argument("--classes", help="comma separated detection labels to label, e.g. `bird,dog,horse`")
+    parser.add_argument("--padding", type=float, default=0.1, help="context around a box, as a share of its size")
+    parser.add_argument("--max-crops", type=int, default=32, help="boxes labelled per image at most")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.input_dir):
+        parser.error(f"Input directory does not exist: {args.input_dir}")
+    classes = args.classes.split(",") if args.classes else None
+    try:
+        cascade = load_cascade(args.task, args.model_dir, args.threshold, classes, args.padding, args.max_crops)
+    except (RuntimeError, ValueError) as e:
+        print(e)
+        return 1
+    output_path = args.output or f"cascade-{args.task}.ndjson"
+    processed = failed = boxes = 0
+    start = time.perf_counter()
+    with open(output_path, "w") as f:
+        for image_path in find_images(args.input_dir):
+            result = cascade.run_cascade(image_path)
+            row = {"image": image_path, "task": args.task, "status": result["status"], "boxes": result["boxes"], "error": ""}
+            if not result["status"]:
+                row["error"] = result["message"]
+                failed += 1
+            row["timings"] = result["timings"]
+            f.write(json.dumps(row) + "\n")
+            processed += 1
+            boxes += len(result["boxes"])
+    seconds = time.perf_counter() - start
+    print(f"{processed} images ({failed} failed), {boxes} boxes labelled in {seconds:.1f} s, {processed / max(seconds, 1e-9):.1f} images/sec")
+    print(f"Results written to: {output_path}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
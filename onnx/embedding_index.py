@@ -0,0 +1,400 @@
+"""
+"Find similar images" over a local photo library with the backbone of the classification model.
+
+Run it from the `onnx` folder, for example:
+    python embedding_index.py add /path/to/photos --index photo_index --model-dir model_files
+    python embedding_index.py build-ivf --index photo_index --lists 256
+    python embedding_index.py query /path/to/photo.jpg --index photo_index -k 10
+
+The embedding of an image is the input of the last (dense) layer of `resnet18-v1-7.onnx`, exposed as an extra
+output of a copy of the model (`<model>.embed.onnx`, written once, needs `pip install onnx`). The L2 normalized
+embeddings are stored as a float16 memory mapped matrix (`embeddings.f16`) with the image paths in `ids.txt`,
+new images are appended. A query is a cosine top-k through blocked matrix products, with `build-ivf` the rows
+are also partitioned by k-means & a query only scans the `nprobe` closest partitions.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+from inference_utils import chunks, run_batched
+from model_manifest import model_file_path
+
+META_FILE = "index.json"
+EMBEDDINGS_FILE = "embeddings.f16"
+IDS_FILE = "ids.txt"
+CENTROIDS_FILE = "centroids.npy"
+ASSIGNMENTS_FILE = "assignments.npy"
+EMBED_SUFFIX = ".embed.onnx"
+
+
+def embedding_output(model):
+    """Name of the input of the final dense layer (Gemm, or MatMul + Add) of an onnx graph"""
+    producers = {output: node for node in model.graph.node for output in node.output}
+    node = producers.get(model.graph.output[0].name)
+    if node is not None and node.op_type == "Add":
+        # MatMul + bias
+        node = next((producers[name] for name in node.input if name in producers and producers[name].op_type == "MatMul"), None)
+    if node is None or node.op_type not in ("Gemm", "MatMul"):
+        raise ValueError("The model does not end with a dense layer, no embedding to expose")
+    return node.input[0]
+
+
+def embedding_model(model_path):
+    """Path of the model copy with the embedding as second output, written on the first call"""
+    embed_path = os.path.splitext(model_path)[0] + EMBED_SUFFIX
+    if os.path.exists(embed_path) and os.path.getmtime(embed_path) >= os.path.getmtime(model_path):
+        return embed_path
+    import onnx
+    from onnx import TensorProto, helper
+
+    model = onnx.load(model_path)
+    name = embedding_output(model)
+    model.graph.output.append(helper.make_tensor_value_info(name, TensorProto.FLOAT, None))
+    tmp_path = embed_path + ".tmp"
+    onnx.save(model, tmp_path)
+    os.replace(tmp_path, embed_path)
+    return embed_path
+
+
+def l2_normalize(vectors):
+    vectors = vectors.reshape(len(vectors), -1).astype(np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def top_k(scores, ids, k):
+    """(best scores, their ids) of a 1d score array, highest first"""
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        scores, ids = scores[best], ids[best]
+    order = np.argsort(-scores, kind="stable")
+    return scores[order], ids[order]
+
+
+def kmeans(vectors, clusters, iterations=20, seed=0):
+    """Spherical k-means of L2 normalized vectors, returns the normalized centroids (clusters, dim)"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        # sum of the vectors of every cluster, sorted by cluster
+        order = np.argsort(labels, kind="stable")
+        sizes = np.bincount(labels, minlength=clusters)
+        empty = sizes == 0
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(vectors[order], (np.cumsum(sizes) - sizes)[~empty], axis=0)
+        # an empty cluster restarts from a random vector
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = l2_normalize(sums)
+    return centroids
+
+
+class Embedder():
+    """
+    L2 normalized embeddings of images with the pre-processing of an `OnnxClassify` & its float model.
+    Only the session of the embedding model is loaded, the classifier session is not needed.
+    """
+    def __init__(self, classifier):
+        self.classifier = classifier
+        # the float model, an INT8 variant has no plain dense layer to cut at
+        self.model_path = embedding_model(model_file_path("classify", classifier.model_dir))
+        sess = classifier.registry.get(self.model_path)
+        self.input_name = sess.get_inputs()[0].name
+        self.output_name = sess.get_outputs()[1].name
+
+    def embed_images(self, images):
+        """(N, dim) float32 of BGR images, one batched run"""
+        classifier = self.classifier
+        batch = np.empty((len(images), 3, 224, 224), dtype=np.float32)
+        with classifier.buffer_lock:
+            for row, img in enumerate(images):
+                classifier.preprocess_into(img, batch[row])
+        sess = classifier.registry.get(self.model_path)
+        return l2_normalize(run_batched(sess, [self.output_name], self.input_name, batch)[0])
+
+    def embed_paths(self, image_paths, batch_size=32):
+        """Yields (paths, embeddings) per batch, images which can't be read are skipped"""
+        for chunk in chunks(list(image_paths), batch_size):
+            paths, images = [], []
+            for path in chunk:
+                try:
+                    images.append(self.classifier.read_image(path))
+                    paths.append(path)
+                except Exception as e:
+                    print(f"Skipping {path}: {e}")
+            if images:
+                yield paths, self.embed_images(images)
+
+
+class EmbeddingIndex():
+    """
+    Embeddings in a folder: a float16 (capacity, dim) memory map of which the first `count` rows are used,
+    the ids (image paths) one per line & optionally the IVF centroids with the partition of every row.
+    Converting float16 rows costs more than the matrix product, so the queries use a float32 copy of the
+    rows while it fits in `resident_mb` (400 MB are 200k resnet18 embeddings), else convert block by block.
+    """
+    def __init__(self, folder, dim=None, model=None, block_rows=16384, resident_mb=400):
+        self.folder = folder
+        self.block_rows = block_rows
+        self.resident_mb = resident_mb
+        self.resident = None
+        meta_path = os.path.join(folder, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                self.meta = json.load(f)
+        elif dim is None:
+            raise ValueError(f"No index in {folder}, the embedding size is needed to create one")
+        else:
+            os.makedirs(folder, exist_ok=True)
+            self.meta = {"dim": int(dim), "count": 0, "capacity": 0, "model": model}
+        self.ids = self.read_ids()
+        self.known = set(self.ids)
+        self.matrix = self.open_matrix()
+        self.centroids = self.assignments = self.partitions = None
+        if os.path.exists(os.path.join(folder, CENTROIDS_FILE)):
+            self.centroids = np.load(os.path.join(folder, CENTROIDS_FILE))
+            self.assignments = np.load(os.path.join(folder, ASSIGNMENTS_FILE))[:self.meta["count"]]
+
+    def read_ids(self):
+        """
+        The first `count` ids. An interrupted `add` can leave ids past the count, those are cut off the file
+        before anything is appended to it again, so the line of an id stays its row.
+        """
+        path = os.path.join(self.folder, IDS_FILE)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        count = self.meta["count"]
+        if len(lines) < count:
+            raise ValueError(f"The index in {self.folder} is damaged: {len(lines)} ids for {count} embeddings")
+        if len(lines) > count:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(item + "\n" for item in lines[:count])
+            os.replace(tmp_path, path)
+        return lines[:count]
+
+    @property
+    def dim(self):
+        return self.meta["dim"]
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def open_matrix(self):
+        if not self.meta["capacity"]:
+            return None
+        return np.memmap(os.path.join(self.folder, EMBEDDINGS_FILE), dtype=np.float16, mode="r+", shape=(self.meta["capacity"], self.dim))
+
+    def grow(self, needed):
+        """Doubles the capacity of the memory map until `needed` rows fit, the used rows are copied over"""
+        capacity = max(1024, self.meta["capacity"])
+        while capacity < needed:
+            capacity *= 2
+        path = os.path.join(self.folder, EMBEDDINGS_FILE)
+        tmp_path = path + ".tmp"
+        grown = np.memmap(tmp_path, dtype=np.float16, mode="w+", shape=(capacity, self.dim))
+        count = len(self)
+        for start in range(0, count, self.block_rows):
+            grown[start:min(start + self.block_rows, count)] = self.matrix[start:min(start + self.block_rows, count)]
+        grown.flush()
+        del grown
+        self.matrix = self.resident = None
+        os.replace(tmp_path, path)
+        self.meta["capacity"] = capacity
+        self.matrix = self.open_matrix()
+
+    def save_meta(self):
+        path = os.path.join(self.folder, META_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def add(self, ids, embeddings):
+        """Appends the L2 normalized embeddings of new ids (known & repeated ids are skipped), returns the number added"""
+        new = []
+        seen = set()
+        for row, item in enumerate(ids):
+            if item not in self.known and item not in seen:
+                seen.add(item)
+                new.append(row)
+        if not new:
+            return 0
+        ids = [ids[row] for row in new]
+        embeddings = np.asarray(embeddings, dtype=np.float32)[new]
+        count = len(self)
+        if count + len(ids) > self.meta["capacity"]:
+            self.grow(count + len(ids))
+        self.matrix[count:count + len(ids)] = embeddings.astype(np.float16)
+        self.matrix.flush()
+        with open(os.path.join(self.folder, IDS_FILE), "a", encoding="utf-8") as f:
+            f.writelines(item + "\n" for item in ids)
+        self.ids.extend(ids)
+        self.known.update(ids)
+        if self.centroids is not None:
+            # new rows go into the partition of their closest centroid
+            self.assignments = np.concatenate([self.assignments, np.argmax(embeddings @ self.centroids.T, axis=1).astype(np.int32)])
+            np.save(os.path.join(self.folder, ASSIGNMENTS_FILE), self.assignments)
+            self.partitions = None
+        self.resident = None
+        # the count is saved last, the rows & ids past it are dropped when a crash interrupted the add
+        self.meta["count"] = count + len(ids)
+        self.save_meta()
+        return len(ids)
+
+    def build_ivf(self, lists=256, sample_per_list=64, iterations=20):
+        """
+        Partitions the rows into `lists` by k-means over a sample of `sample_per_list` rows per partition,
+        the queries can then use `nprobe`. Run it again once the library grew a lot.
+        """
+        count = len(self)
+        lists = min(lists, count)
+        if lists < 1:
+            raise ValueError("The index is empty")
+        rng = np.random.default_rng(0)
+        rows = np.sort(rng.choice(count, min(lists * sample_per_list, count), replace=False))
+        self.centroids = kmeans(self.matrix[rows].astype(np.float32), lists, iterations)
+        assignments = np.empty(count, dtype=np.int32)
+        for start in range(0, count, self.block_rows):
+            block = self.matrix[start:min(start + self.block_rows, count)].astype(np.float32)
+            assignments[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        self.assignments = assignments
+        self.partitions = None
+        np.save(os.path.join(self.folder, CENTROIDS_FILE), self.centroids)
+        np.save(os.path.join(self.folder, ASSIGNMENTS_FILE), self.assignments)
+        return lists
+
+    def partition_rows(self):
+        """(rows sorted by partition, start offset of every partition), built once per change"""
+        if self.partitions is None:
+            order = np.argsort(self.assignments, kind="stable").astype(np.int64)
+            offsets = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+            self.partitions = (order, offsets)
+        return self.partitions
+
+    def rows_f32(self, rows):
+        """Rows (a slice or indices) as float32, from the resident copy (made on the first query after a change) when it fits"""
+        count = len(self)
+        if self.resident is None and count * self.dim * 4 <= self.resident_mb * 1024 * 1024:
+            self.resident = np.empty((count, self.dim), dtype=np.float32)
+            for start in range(0, count, self.block_rows):
+                self.resident[start:start + self.block_rows] = self.matrix[start:min(start + self.block_rows, count)]
+        if self.resident is not None:
+            return self.resident[rows]
+        return self.matrix[rows].astype(np.float32)
+
+    def search(self, query, k=10, nprobe=None):
+        """
+        Top-k cosine matches of one embedding: [(id, score)], best first. With IVF partitions & `nprobe`
+        only the rows of the `nprobe` closest partitions are scanned, else every row in blocks.
+        """
+        query = l2_normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        count = len(self)
+        if not count:
+            return []
+        if nprobe and self.centroids is not None:
+            order, offsets = self.partition_rows()
+            probes = np.argsort(-(self.centroids @ query))[:nprobe]
+            rows = np.sort(np.concatenate([order[offsets[probe]:offsets[probe + 1]] for probe in probes]))
+            scores = self.rows_f32(rows) @ query
+            scores, rows = top_k(scores, rows, k)
+        else:
+            best_scores = np.empty(0, dtype=np.float32)
+            best_rows = np.empty(0, dtype=np.int64)
+            for start in range(0, count, self.block_rows):
+                block = self.rows_f32(slice(start, min(start + self.block_rows, count)))
+                scores = block @ query
+                # keep the best k of the block, merged with the best so far
+                block_scores, block_rows = top_k(scores, np.arange(start, start + len(block)), k)
+                best_scores, best_rows = top_k(np.concatenate([best_scores, block_scores]), np.concatenate([best_rows, block_rows]), k)
+            scores, rows = best_scores, best_rows
+        return [(self.ids[row], round(float(score), 4)) for row, score in zip(rows.tolist(), scores.tolist())]
+
+
+def load_embedder(model_dir=None):
+    from model_downloader import DownloadError
+    from model_manifest import fetch_model, is_available
+    from onnx_classify import OnnxClassify, models_dir
+
+    model_dir = model_dir or models_dir
+    if not is_available("classify", model_dir):
+        try:
+            fetch_model("classify", model_dir)
+        except DownloadError as e:
+            raise RuntimeError(f"Could not download the classify model to {model_dir}: {e}")
+    return Embedder(OnnxClassify(model_dir=model_dir, save_dir=model_dir))
+
+
+def add_images(index_dir, input_dir, model_dir=None, batch_size=32):
+    from batch import find_images
+
+    embedder = load_embedder(model_dir)
+    model = os.path.basename(embedder.model_path)
+    index = None
+    image_paths = find_images(input_dir)
+    if os.path.exists(os.path.join(index_dir, META_FILE)):
+        # only the images not indexed yet are read & embedded
+        index = EmbeddingIndex(index_dir)
+        if index.meta.get("model") != model:
+            raise ValueError(f"The index in {index_dir} holds embeddings of {index.meta.get('model')}, not of {model}")
+        image_paths = (path for path in image_paths if path not in index.known)
+    added = 0
+    start = time.perf_counter()
+    for paths, embeddings in embedder.embed_paths(image_paths, batch_size):
+        if index is None:
+            index = EmbeddingIndex(index_dir, embeddings.shape[1], model)
+        if index.dim != embeddings.shape[1]:
+            raise ValueError(f"The index in {index_dir} holds {index.dim} wide embeddings, not {embeddings.shape[1]} wide ones")
+        added += index.add(paths, embeddings)
+        print(f"Indexed {len(index)} images ({added} new), {added / (time.perf_counter() - start):.1f} images/sec")
+    if not added:
+        print(f"No new images in {input_dir}")
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Embedding index of a photo library, query it for similar images")
+    parser.add_argument("command", choices=["add", "build-ivf", "query"])
+    parser.add_argument("path", nargs="?", help="add: folder of images, query: the image to find similar ones of")
+    parser.add_argument("--index", default="photo_index", help="index folder")
+    parser.add_argument("--model-dir", help="directory of the onnx model files")
+    parser.add_argument("-b", "--batch-size", type=int, default=32, help="images per inference call")
+    parser.add_argument("--lists", type=int, default=256, help="build-ivf: number of partitions")
+    parser.add_argument("-k", type=int, default=10, help="query: number of matches")
+    parser.add_argument("--nprobe", type=int, default=8, help="query: partitions scanned when the index has IVF partitions, 0 for all rows")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "add":
+            if not args.path or not os.path.isdir(args.path):
+                parser.error("add needs an existing image folder")
+            add_images(args.index, args.path, args.model_dir, args.batch_size)
+        elif args.command == "build-ivf":
+            index = EmbeddingIndex(args.index)
+            start = time.perf_counter()
+            lists = index.build_ivf(args.lists)
+            print(f"{len(index)} images in {lists} partitions, built in {time.perf_counter() - start:.1f} s")
+        else:
+            if not args.path or not os.path.isfile(args.path):
+                parser.error("query needs an existing image")
+            index = EmbeddingIndex(args.index)
+            embedder = load_embedder(args.model_dir)
+            query = embedder.embed_images([embedder.classifier.read_image(args.path)])[0]
+            start = time.perf_counter()
+            matches = index.search(query, args.k, args.nprobe)
+            print(f"{len(matches)} matches of {len(index)} images in {(time.perf_counter() - start) * 1000:.1f} ms")
+            for path, score in matches:
+                print(f"  {score:.4f}  {path}")
+    except (RuntimeError, ValueError) as e:
+        print(e)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,29 @@
+import cv2
+import numpy as np
+
+
+def frame_from_pixels(pixels, size, flip=True):
+    """
+    Converts the RGBA bytes of a kivy texture (`texture.pixels`, `texture.size`) to a BGR image.
+    The bytes are wrapped without a copy, the only copy is the color conversion.
+    OpenGL rows start at the bottom, so the frame is flipped to the usual top down order.
+    """
+    width, height = size
+    rgba = np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 4)
+    frame = cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGR)
+    if flip:
+        cv2.flip(frame, 0, dst=frame)
+    return frame
+
+
+def texture_from_image(img):
+    """
+    Uploads a BGR image straight into a new kivy texture, must be called on the main thread.
+    The texture is flipped instead of the image, so the pixels are not copied before the upload.
+    """
+    from kivy.graphics.texture import Texture
+    height, width = img.shape[:2]
+    texture = Texture.create(size=(width, height), colorfmt="bgr")
+    texture.flip_vertical()
+    texture.blit_buffer(np.ascontiguousarray(img).reshape(-1), colorfmt="bgr", bufferfmt="ubyte")
+    return texture
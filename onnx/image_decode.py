@@ -0,0 +1,110 @@
+import struct
+
+import cv2
+
+# decode scale: imread flag, libjpeg scales the DCT down instead of decoding every pixel
+REDUCED_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+# start of frame markers holding the image size (C4, C8 & CC are tables / reserved)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# markers without a length field
+STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7}
+ORIENTATION_TAG = 0x0112
+
+
+def exif_orientation(tiff):
+    """Orientation (1-8) from the TIFF block of an Exif segment, 1 when it is missing"""
+    if tiff[:2] == b"II":
+        endian = "<"
+    elif tiff[:2] == b"MM":
+        endian = ">"
+    else:
+        return 1
+    try:
+        ifd_offset = struct.unpack(endian + "I", tiff[4:8])[0]
+        count = struct.unpack(endian + "H", tiff[ifd_offset:ifd_offset + 2])[0]
+        for i in range(count):
+            entry = ifd_offset + 2 + i * 12
+            tag = struct.unpack(endian + "H", tiff[entry:entry + 2])[0]
+            if tag == ORIENTATION_TAG:
+                orientation = struct.unpack(endian + "H", tiff[entry + 8:entry + 10])[0]
+                return orientation if 1 <= orientation <= 8 else 1
+    except struct.error:
+        pass
+    return 1
+
+
+def jpeg_header(image_path):
+    """
+    Reads only the JPEG markers up to the frame header.
+    Returns (width, height, exif orientation) as stored in the file, None when it is not a JPEG.
+    """
+    try:
+        with open(image_path, "rb") as f:
+            if f.read(2) != b"\xff\xd8":
+                return None
+            orientation = 1
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                code = marker[1]
+                while code == 0xFF:
+                    # fill bytes before the marker code
+                    code = f.read(1)[0]
+                if code in STANDALONE_MARKERS:
+                    continue
+                if code in (0xD9, 0xDA):
+                    # end of image / start of scan before any frame header
+                    return None
+                length = struct.unpack(">H", f.read(2))[0]
+                if code in SOF_MARKERS:
+                    _, height, width = struct.unpack(">BHH", f.read(5))
+                    return width, height, orientation
+                segment = f.read(length - 2)
+                if code == 0xE1 and segment.startswith(b"Exif\x00\x00"):
+                    orientation = exif_orientation(segment[6:])
+    except (OSError, IndexError, struct.error):
+        return None
+
+
+def image_size(image_path):
+    """(width, height) of a JPEG as it is shown, i.e. after the EXIF rotation, None for other files"""
+    header = jpeg_header(image_path)
+    if header is None:
+        return None
+    width, height, orientation = header
+    if orientation in (5, 6, 7, 8):
+        # rotated by 90 / 270 degrees
+        return height, width
+    return width, height
+
+
+def reduction_factor(width, height, target_size):
+    """Largest DCT scale (8, 4, 2 or 1) which still decodes at least `target_size` (width, height)"""
+    needed = max(target_size)
+    for factor in REDUCED_FLAGS:
+        # libjpeg rounds the scaled size up
+        if -(-width // factor) >= needed and -(-height // factor) >= needed:
+            return factor
+    return 1
+
+
+def decode_image(image_path, target_size=None):
+    """
+    Decodes a BGR image like `cv2.imread`, JPEGs larger than needed for a model input of
+    `target_size` (width, height) are decoded at 1/2, 1/4 or 1/8 of their size.
+    Returns (image, (original width, original height)), the image is None when it can't be read.
+    Boxes found on the image map back to the original by scaling with original size / image size.
+    """
+    size = image_size(image_path) if target_size else None
+    factor = reduction_factor(*size, target_size) if size else 1
+    img = cv2.imread(image_path, REDUCED_FLAGS.get(factor, cv2.IMREAD_COLOR))
+    if img is None:
+        return None, None
+    if size is None:
+        size = (img.shape[1], img.shape[0])
+    return img, size
@@ -0,0 +1,83 @@
+import numpy as np
+from onnxruntime import OrtValue
+
+
+def fixed_batch_size(sess):
+    """Returns the batch size if the model input has a fixed (integer) batch dimension, else None"""
+    batch_dim = sess.get_inputs()[0].shape[0]
+    if isinstance(batch_dim, int) and batch_dim > 0:
+        return batch_dim
+    return None
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def run_batched(sess, output_names, input_name, batch):
+    """
+    Run a stacked (N, ...) input through the session in as few `sess.run` calls as possible.
+    Models with a fixed batch size get the input split into chunks of that size & the last
+    chunk is padded with zeros, the padded rows are removed from the outputs again.
+    Returns the list of outputs, each with N rows.
+    """
+    fixed = fixed_batch_size(sess)
+    count = batch.shape[0]
+    if fixed is None or fixed == count:
+        return sess.run(output_names, {input_name: batch})
+
+    outputs = None
+    for start in range(0, count, fixed):
+        part = batch[start:start + fixed]
+        valid = part.shape[0]
+        if valid < fixed:
+            pad = np.zeros((fixed - valid,) + part.shape[1:], dtype=part.dtype)
+            part = np.concatenate([part, pad], axis=0)
+        results = sess.run(output_names, {input_name: part})
+        if outputs is None:
+            outputs = [[] for _ in results]
+        for i, result in enumerate(results):
+            outputs[i].append(result[:valid])
+    return [np.concatenate(parts, axis=0) for parts in outputs]
+
+
+def static_shape(shape, batch_size=1):
+    """Model input / output shape with the symbolic dims replaced, batch by `batch_size` & the others by 1"""
+    return tuple(
+        dim if isinstance(dim, int) and dim > 0 else (batch_size if i == 0 else 1)
+        for i, dim in enumerate(shape)
+    )
+
+
+class IOBuffers():
+    """
+    Preallocated input & output arrays for single image runs, bound to the session with IOBinding,
+    so a steady state run does not allocate the tensors again. Outputs given as None (e.g. a
+    variable number of detections) are allocated by onnxruntime & returned as new arrays.
+
+    The binding itself is made on every run: holding on to it would also hold on to a session the
+    registry has unloaded. The arrays are shared, callers running from several threads need a lock.
+    """
+    def __init__(self, inputs, outputs):
+        self.inputs = inputs # name: array
+        self.outputs = outputs # name: array or None
+        self.input_values = {name: OrtValue.ortvalue_from_numpy(array) for name, array in inputs.items()}
+        self.output_values = {name: OrtValue.ortvalue_from_numpy(array) for name, array in outputs.items() if array is not None}
+
+    def run(self, sess):
+        """Runs the session on the bound inputs, returns the outputs in the order they were given"""
+        binding = sess.io_binding()
+        for name, value in self.input_values.items():
+            binding.bind_ortvalue_input(name, value)
+        for name, array in self.outputs.items():
+            if array is None:
+                binding.bind_output(name, "cpu")
+            else:
+                binding.bind_ortvalue_output(name, self.output_values[name])
+        sess.run_with_iobinding(binding)
+        values = binding.get_outputs()
+        return [
+            value.numpy() if array is None else array
+            for value, array in zip(values, self.outputs.values())
+        ]
@@ -0,0 +1,154 @@
+import time
+import heapq
+import itertools
+from threading import Thread, Event, Lock
+from queue import PriorityQueue, Full, Empty
+
+
+class InferenceJob():
+    def __init__(self, fn, args, kwargs, priority=10, tag=None, on_cancel=None):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.tag = tag
+        # called once, on the thread that drops the job, when a cancelled job is never run
+        self.on_cancel = on_cancel
+        self.cancelled = False
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self.submitted_at = time.perf_counter()
+
+    def cancel(self):
+        """A cancelled job is skipped when it reaches the worker, a running job finishes anyway"""
+        self.cancelled = True
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.result
+
+    def dropped(self):
+        """Marks a cancelled job as finished without running it"""
+        if self.on_cancel:
+            try:
+                self.on_cancel()
+            except Exception as e:
+                print(f"on_cancel error: {e}")
+        self.done.set()
+
+
+class InferenceWorker():
+    """
+    Long lived worker thread(s) for one model with a bounded priority queue of jobs.
+    Lower `priority` runs first, jobs of the same priority run in submission order.
+    """
+    def __init__(self, name, num_threads=1, max_queue=8):
+        self.name = name
+        self.num_threads = num_threads
+        self.queue = PriorityQueue(maxsize=max_queue)
+        self.counter = itertools.count()
+        self.threads = []
+        self.lock = Lock()
+        self.running = True
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "rejected": 0}
+
+    def start(self):
+        with self.lock:
+            self.threads = [thread for thread in self.threads if thread.is_alive()]
+            while len(self.threads) < self.num_threads:
+                thread = Thread(target=self.run, name=f"{self.name}-worker-{len(self.threads)}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, fn, *args, priority=10, tag=None, on_cancel=None, **kwargs):
+        """
+        Queue `fn(*args, **kwargs)`, returns the job or None when the queue is full.
+        `on_cancel()` is called instead when the job is cancelled before it runs.
+        """
+        job = InferenceJob(fn, args, kwargs, priority, tag, on_cancel)
+        if self.queue.full():
+            # jobs cancelled with `job.cancel()` hold their slot until they are removed
+            self.purge_cancelled()
+        try:
+            self.queue.put_nowait((priority, next(self.counter), job))
+        except Full:
+            with self.lock:
+                self.counters["rejected"] += 1
+            return None
+        with self.lock:
+            self.counters["submitted"] += 1
+        self.start()
+        return job
+
+    def pending_jobs(self):
+        with self.queue.mutex:
+            return [job for _, _, job in self.queue.queue if not job.cancelled]
+
+    def queue_depth(self):
+        return len(self.pending_jobs())
+
+    def cancel(self, tag=None):
+        """Cancel the waiting jobs with the tag (all of them when tag is None), returns how many"""
+        cancelled = 0
+        for job in self.pending_jobs():
+            if tag is None or job.tag == tag:
+                job.cancel()
+                cancelled += 1
+        if cancelled:
+            self.purge_cancelled()
+        return cancelled
+
+    def purge_cancelled(self):
+        """Removes the cancelled jobs from the queue so they don't count against `max_queue`, returns how many"""
+        with self.queue.mutex:
+            removed = [job for _, _, job in self.queue.queue if job.cancelled]
+            if removed:
+                self.queue.queue[:] = [entry for entry in self.queue.queue if not entry[2].cancelled]
+                heapq.heapify(self.queue.queue)
+                # the removed jobs never reach `get()`, this is their `task_done()`
+                self.queue.unfinished_tasks -= len(removed)
+                if not self.queue.unfinished_tasks:
+                    self.queue.all_tasks_done.notify_all()
+                self.queue.not_full.notify(len(removed))
+        for job in removed:
+            job.dropped()
+        if removed:
+            with self.lock:
+                self.counters["cancelled"] += len(removed)
+        return len(removed)
+
+    def run(self):
+        while self.running:
+            try:
+                _, _, job = self.queue.get(timeout=1)
+            except Empty:
+                continue
+            if job.cancelled:
+                with self.lock:
+                    self.counters["cancelled"] += 1
+                job.dropped()
+                self.queue.task_done()
+                continue
+            try:
+                job.result = job.fn(*job.args, **job.kwargs)
+                with self.lock:
+                    self.counters["completed"] += 1
+            except Exception as e:
+                print(f"{self.name} job error: {e}")
+                job.error = e
+                with self.lock:
+                    self.counters["failed"] += 1
+            finally:
+                job.done.set()
+                self.queue.task_done()
+
+    def shutdown(self):
+        self.running = False
+        self.cancel()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats["queue_depth"] = self.queue_depth()
+        return stats
@@ -0,0 +1,159 @@
+import time
+from collections import deque
+from threading import Thread, Condition
+
+from kivy.clock import Clock
+from kivy.core.text import Label as CoreLabel
+from kivy.graphics import Color, Line, Rectangle, InstructionGroup
+
+from frame_utils import frame_from_pixels
+from onnx_detect import coco_labels
+
+
+class LatestFrameSlot():
+    """
+    A buffer of a single frame: a new frame replaces the one still waiting,
+    so the consumer always gets the latest frame & never builds up a backlog.
+    """
+    def __init__(self):
+        self.cond = Condition()
+        self.item = None
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self.cond:
+            if self.item is not None:
+                self.dropped += 1
+            self.item = item
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        """Waits for the next frame, returns None when the slot was closed or on timeout"""
+        with self.cond:
+            if self.item is None and not self.closed:
+                self.cond.wait(timeout)
+            item = self.item
+            self.item = None
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.item = None
+            self.cond.notify_all()
+
+
+class LiveDetector():
+    """
+    Runs object detection continuously on camera frames.
+    The main thread only copies the texture pixels into the slot, the frame conversion & the
+    inference run on a worker thread & the results come back through the kivy clock.
+    With a `tracker.Tracker` the detector only runs when the tracker asks for it, the boxes of the
+    other frames are moved forward by the tracker.
+    """
+    def __init__(self, detector, on_result, stats_window=30, tracker=None):
+        self.detector = detector
+        self.on_result = on_result
+        self.tracker = tracker
+        self.slot = LatestFrameSlot()
+        self.frame_times = deque(maxlen=stats_window)
+        self.detect_times = deque(maxlen=stats_window)
+        self.latencies = deque(maxlen=stats_window)
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.slot = LatestFrameSlot()
+        if self.tracker is not None:
+            self.tracker.reset()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.slot.close()
+
+    def submit(self, pixels, size):
+        # main thread: the pixels are the only thing copied here
+        if self.running:
+            self.slot.put((pixels, size, time.perf_counter()))
+
+    def stats(self):
+        fps = 0.0
+        if len(self.frame_times) > 1:
+            fps = (len(self.frame_times) - 1) / max(self.frame_times[-1] - self.frame_times[0], 1e-6)
+        latency = sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+        # detector runs per second over the same frames
+        detect_fps = fps
+        if self.tracker is not None and len(self.frame_times) > 1:
+            window_start = self.frame_times[0]
+            runs = sum(1 for t in self.detect_times if t > window_start)
+            detect_fps = runs / max(self.frame_times[-1] - window_start, 1e-6)
+        return {"fps": fps, "detect_fps": detect_fps, "latency_ms": latency, "dropped": self.slot.dropped}
+
+    def run(self):
+        slot = self.slot
+        while self.running:
+            item = slot.get(timeout=0.5)
+            if item is None:
+                continue
+            pixels, size, captured_at = item
+            try:
+                frame = frame_from_pixels(pixels, size)
+                if self.tracker is not None:
+                    detections, detected = self.tracker.step(lambda: self.detect(frame))
+                else:
+                    detections, detected = self.detect(frame), True
+            except Exception as e:
+                print(f"Live detection error: {e}")
+                continue
+            done = time.perf_counter()
+            self.frame_times.append(done)
+            if detected:
+                self.detect_times.append(done)
+            self.latencies.append((done - captured_at) * 1000)
+            if not self.running:
+                continue
+            stats = self.stats()
+            Clock.schedule_once(lambda dt: self.on_result(detections, size, stats))
+
+    def detect(self, frame):
+        result = self.detector.run_detect_array(frame, save_output=False)
+        if not result["status"]:
+            raise RuntimeError(result["message"])
+        return result["detections"]
+
+
+def draw_overlay(image_widget, detections, frame_size, group=None):
+    """
+    Draws the detection boxes over an Image / Camera widget (fit_mode contain).
+    Returns the instruction group, pass it back on the next call to replace the previous boxes.
+    """
+    if group is None:
+        group = InstructionGroup()
+        image_widget.canvas.after.add(group)
+    group.clear()
+    frame_width, frame_height = frame_size
+    shown_width, shown_height = image_widget.norm_image_size
+    if not frame_width or not frame_height or not shown_width:
+        return group
+    scale = shown_width / frame_width
+    left = image_widget.center_x - shown_width / 2
+    top = image_widget.center_y + shown_height / 2
+
+    group.add(Color(0, 1, 0, 1))
+    for (x1, y1, x2, y2), score, class_id in zip(detections["box"].tolist(), detections["score"].tolist(), detections["class_id"].tolist()):
+        # frame rows go down, kivy y goes up
+        x = left + x1 * scale
+        y = top - y2 * scale
+        width = (x2 - x1) * scale
+        height = (y2 - y1) * scale
+        group.add(Line(rectangle=(x, y, width, height), width=1.5))
+        text = CoreLabel(text=f"{coco_labels.get(class_id, 'unknown')}: {int(score*100)}%", font_size=14)
+        text.refresh()
+        group.add(Rectangle(texture=text.texture, size=text.texture.size, pos=(x, y + height)))
+    return group
@@ -2,8 +2,8 @@
 import os
 os.environ['KIVY_GL_BACKEND'] = 'sdl2'
 import sys
-from threading import Thread
-import requests
+import importlib
+from threading import Thread, Lock
 
 from kivy.lang import Builder
 from kivy.properties import StringProperty, NumericProperty, ObjectProperty
@@ -11,14 +11,10 @@ from kivy.core.window import Window
 from kivy.metrics import dp, sp
 from kivy.utils import platform
 from kivy.uix.image import Image
-from kivy.uix.camera import Camera
 from kivy.clock import Clock
 
-from plyer import filechooser
-
 from kivymd.app import MDApp
 from kivymd.uix.navigationdrawer import MDNavigationDrawerMenu
-from kivymd.uix.filemanager import MDFileManager
 from kivymd.uix.label import MDLabel
 from kivymd.uix.dialog import MDDialog
 from kivymd.uix.button import MDFlatButton, MDFloatingActionButton
@@ -27,21 +23,15 @@ from kivymd.uix.button import MDFlatButton, MDFloatingActionButton
 Window.softinput_mode = "below_target"
 
 # Import your local screen classes & modules
+# the other screens, the onnx engines (cv2, numpy, onnxruntime) & the downloader (requests) are imported on first use
 from screens.img_obj_detect import ImgObjDetBox, TempSpinWait
-from screens.cam_obj_detect import CamObjDetBox
-from screens.img_obj_classify import ImgClassifytBox
-from screens.img_species import ImgSpeciesBox
-from screens.setting import SettingsBox
-from onnx_detect import OnnxDetect
-from onnx_classify import OnnxClassify
-from onnx_species import OnnxSpecies
+from inference_worker import InferenceWorker
+from tracing import default_tracer
+from model_manifest import MODELS, fetch_model, is_available, missing_models, model_file_path
 
 ## Global definitions
 __version__ = "0.3.1" # The APP version
 
-detect_model_url = "https://github.com/onnx/models/raw/main/validated/vision/object_detection_segmentation/ssd-mobilenetv1/model/ssd_mobilenet_v1_10.onnx"
-classify_model_url = "https://github.com/onnx/models/raw/main/validated/vision/classification/resnet/model/resnet18-v1-7.onnx"
-species_model_url = "https://github.com/daslearning-org/vision-ai/releases/download/vOnnxModels/spicesNet_v401a.onnx"
 # Determine the base path for your application's resources
 if getattr(sys, 'frozen', False):
     # Running as a PyInstaller bundle
@@ -50,6 +40,19 @@ else:
     # Running in a normal Python environment
     base_path = os.path.dirname(os.path.abspath(__file__))
 kv_file_path = os.path.join(base_path, 'main_layout.kv')
+# screen name: (module, box class, id of the box), built when the screen is entered the first time
+lazy_screens = {
+    "camObjDetect": ("screens.cam_obj_detect", "CamObjDetBox", "cam_detect_box"),
+    "imgClassify": ("screens.img_obj_classify", "ImgClassifytBox", "img_classify_box"),
+    "imgSpecies": ("screens.img_species", "ImgSpeciesBox", "img_species_box"),
+    "settings": ("screens.setting", "SettingsBox", "settings_box"),
+}
+# task: (module, engine class)
+engine_classes = {
+    "detect": ("onnx_detect", "OnnxDetect"),
+    "classify": ("onnx_classify", "OnnxClassify"),
+    "species": ("onnx_species", "OnnxSpecies"),
+}
 
 
 ## define custom kivymd classes
@@ -64,7 +67,7 @@ class VisionAiApp(MDApp):
     is_classify_running = ObjectProperty(None)
     is_species_running = ObjectProperty(None)
     image_path = StringProperty("")
-    op_img_path = StringProperty("")
+    op_result = ObjectProperty(None) # last detection result, saved only when downloaded
     onnx_detect = ObjectProperty(None)
     onnx_detect_sess = ObjectProperty(None)
     onnx_classify = ObjectProperty(None)
@@ -75,9 +78,18 @@ class VisionAiApp(MDApp):
     camera = ObjectProperty(None)
     detect_model_path = StringProperty("")
     last_upload_path = ObjectProperty(None)
+    live_detector = ObjectProperty(None)
+    live_frame_event = ObjectProperty(None)
+    live_overlay = ObjectProperty(None)
+    detect_worker = ObjectProperty(None)
+    classify_worker = ObjectProperty(None)
+    species_worker = ObjectProperty(None)
+    result_cache = ObjectProperty(None)
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.engine_lock = Lock()
+        self.op_file_manager = None
         Window.bind(on_keyboard=self.events)
 
     def build(self):
@@ -86,6 +98,12 @@ class VisionAiApp(MDApp):
         return Builder.load_file(kv_file_path)
 
     def on_start(self):
+        # VISIONAI_TRACE=/path/trace.json records the requests as a Chrome trace, written when the app stops
+        trace_path = os.environ.get("VISIONAI_TRACE")
+        if trace_path:
+            default_tracer.start(trace_path)
+            print(f"Tracing the requests to: {trace_path}")
+
         # paths setup
         if platform == "android":
             from android.permissions import request_permissions, Permission
@@ -125,12 +143,14 @@ class VisionAiApp(MDApp):
             self.op_dir = os.path.join(self.user_data_dir, 'outputs')
         os.makedirs(self.model_dir, exist_ok=True)
         os.makedirs(self.op_dir, exist_ok=True)
-        self.detect_model_path = os.path.join(self.model_dir, "ssd_mobilenet_v1_10.onnx")
-        self.classify_model_path = os.path.join(self.model_dir, "resnet18-v1-7.onnx")
-        self.species_model_path = os.path.join(self.model_dir, "spicesNet_v401a.onnx")
+        self.detect_model_path = model_file_path("detect", self.model_dir)
+        self.classify_model_path = model_file_path("classify", self.model_dir)
+        self.species_model_path = model_file_path("species", self.model_dir)
 
         # file managers
         self.img_preview = False
+        self.save_cam_capture = False
+        self.tiled_detect = False
         self.is_img_manager_open = False
 
         #self.img_file_manager = MDFileManager(
@@ -143,23 +163,36 @@ class VisionAiApp(MDApp):
         #)
 
         self.is_op_file_mgr_open = False
-        self.op_file_manager = MDFileManager(
-            exit_manager=self.op_file_exit_manager,
-            select_path=self.select_op_path,
-            selector="folder",  # Restrict to selecting directories only
-        )
 
         if not os.path.exists(self.detect_model_path):
-            self.popup_detect_model()
+            self.popup_model("detect")
 
-        # create onnx objects
-        self.onnx_detect = OnnxDetect(
-            save_dir=self.op_dir,
-            model_dir=self.model_dir,
-        )
+        # one long lived worker per model, requests wait in its queue
+        self.detect_worker = InferenceWorker("detect")
+        self.classify_worker = InferenceWorker("classify")
+        self.species_worker = InferenceWorker("species")
+
+        # the onnx engines are created on first use, the downloaded models are built & warmed up in the background once the UI is shown
+        Clock.schedule_once(lambda dt: self.prepare_models(), 1)
 
         print("Initialisation is successfull")
 
+    def on_stop(self):
+        for worker in (self.detect_worker, self.classify_worker, self.species_worker):
+            if worker:
+                print(f"Inference worker `{worker.name}` stats: {worker.stats()}")
+                worker.shutdown()
+        if "session_registry" in sys.modules:
+            # only when a model was loaded, no need to import onnxruntime just to stop
+            from session_registry import default_registry
+            print(f"Onnx session stats: {default_registry.stats()}")
+            default_registry.clear()
+        if self.result_cache:
+            print(f"Result cache stats: {self.result_cache.stats()}")
+            self.result_cache.close()
+        if default_tracer.enabled:
+            print(f"Trace written to: {default_tracer.stop()}")
+
     def update_download_progress(self, downloaded, total_size):
         if total_size > 0:
             percentage = (downloaded / total_size) * 100
@@ -167,34 +200,28 @@ class VisionAiApp(MDApp):
         else:
             self.download_progress.text = f"Progress: {downloaded} bytes"
 
-    def download_file(self, download_url, download_path):
-        filename = download_url.split("/")[-1]
+    def download_file(self, task):
+        from model_downloader import DownloadError
+        download_path = self.model_path_of(task)
         try:
-            self.is_downloading = filename
-            with requests.get(download_url, stream=True) as req:
-                req.raise_for_status()
-                total_size = int(req.headers.get('content-length', 0))
-                downloaded = 0
-                with open(download_path, 'wb') as f:
-                    for chunk in req.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded += len(chunk)
-                            Clock.schedule_once(lambda dt: self.update_download_progress(downloaded, total_size))
-            if os.path.exists(download_path):
-                Clock.schedule_once(lambda dt: self.show_toast_msg(f"Download complete: {download_path}"))
-            else:
-                Clock.schedule_once(lambda dt: self.show_toast_msg(f"Download failed for: {download_path}", is_error=True))
+            self.is_downloading = MODELS[task]["file"]
+            # the downloader throttles the progress, so the main thread gets a few updates per second
+            fetch_model(
+                task,
+                self.model_dir,
+                progress=lambda downloaded, total_size: Clock.schedule_once(lambda dt: self.update_download_progress(downloaded, total_size)),
+            )
+            Clock.schedule_once(lambda dt: self.show_toast_msg(f"Download complete: {download_path}"))
             self.is_downloading = False
-        except requests.exceptions.RequestException as e:
+            Clock.schedule_once(lambda dt: self.prepare_models([task]))
+        except DownloadError as e:
             print(f"Error downloading the onnx file: {e} 😞")
             Clock.schedule_once(lambda dt: self.show_toast_msg(f"Download failed for: {download_path}", is_error=True))
             self.is_downloading = False
 
-    def download_model_file(self, model_url, download_path, instance=None):
+    def download_model_file(self, task, instance=None):
         self.txt_dialog_closer(instance)
-        filename = download_path.split("/")[-1]
-        print(f"Starting the download for: {filename}")
+        print(f"Starting the download for: {MODELS[task]['file']}")
         if self.root.ids.screen_manager.current == "imgObjDetect":
             result_box = self.root.ids.img_detect_box.ids.result_image
         elif self.root.ids.screen_manager.current == "imgClassify":
@@ -209,18 +236,9 @@ class VisionAiApp(MDApp):
             halign="center"
         )
         result_box.add_widget(self.download_progress)
-        Thread(target=self.download_file, args=(model_url, download_path), daemon=True).start()
-
-    def download_detect_model(self, instance):
-        self.download_model_file(detect_model_url, self.detect_model_path, instance)
-
-    def download_classify_model(self, instance):
-        self.download_model_file(classify_model_url, self.classify_model_path, instance)
+        Thread(target=self.download_file, args=(task,), daemon=True).start()
 
-    def download_species_model(self, instance):
-        self.download_model_file(species_model_url, self.species_model_path, instance)
-
-    def popup_detect_model(self):
+    def popup_model(self, task):
         buttons = [
             MDFlatButton(
                 text="Cancel",
@@ -232,56 +250,108 @@ class VisionAiApp(MDApp):
                 text="Ok",
                 theme_text_color="Custom",
                 text_color="green",
-                on_release=self.download_detect_model
+                on_release=lambda instance: self.download_model_file(task, instance)
             ),
         ]
         self.show_text_dialog(
             "Downlaod the model file",
-            f"You need to downlaod the file for the first time (~30MB)",
+            f"You need to downlaod the {MODELS[task]['name']} file for the first time (~{MODELS[task]['size_mb']}MB)",
             buttons
         )
 
-    def popup_classify_model(self):
-        buttons = [
-            MDFlatButton(
-                text="Cancel",
-                theme_text_color="Custom",
-                text_color=self.theme_cls.primary_color,
-                on_release=self.txt_dialog_closer
-            ),
-            MDFlatButton(
-                text="Ok",
-                theme_text_color="Custom",
-                text_color="green",
-                on_release=self.download_classify_model
-            ),
-        ]
-        self.show_text_dialog(
-            "Downlaod the model file",
-            f"You need to downlaod the file for the first time (~45MB)",
-            buttons
-        )
+    def model_path_of(self, task):
+        return getattr(self, f"{task}_model_path")
 
-    def popup_species_model(self):
-        buttons = [
-            MDFlatButton(
-                text="Cancel",
-                theme_text_color="Custom",
-                text_color=self.theme_cls.primary_color,
-                on_release=self.txt_dialog_closer
-            ),
-            MDFlatButton(
-                text="Ok",
-                theme_text_color="Custom",
-                text_color="green",
-                on_release=self.download_species_model
-            ),
-        ]
-        self.show_text_dialog(
-            "Downlaod the model file",
-            f"You need to downlaod the file for the first time (~215MB)",
-            buttons
-        )
+    def open_result_cache(self):
+        # results of images which were already run are answered from here, also after a restart
+        if self.result_cache is None:
+            try:
+                from result_cache import ResultCache
+                self.result_cache = ResultCache(os.path.join(os.path.dirname(self.model_dir), "results_cache.sqlite"))
+            except Exception as e:
+                print(f"Could not open the result cache: {e}")
+                self.result_cache = False
+        return self.result_cache or None
+
+    def engine(self, task):
+        """The onnx engine of the task, imported & created on the first call (also from the worker threads)"""
+        with self.engine_lock:
+            engine = getattr(self, f"onnx_{task}")
+            if not engine:
+                module_name, class_name = engine_classes[task]
+                module = __import__(module_name)
+                engine = getattr(module, class_name)(
+                    save_dir=self.op_dir,
+                    model_dir=self.model_dir,
+                    cache=self.open_result_cache(),
+                )
+                setattr(self, f"onnx_{task}", engine)
+            return engine
+
+    def prepare_models(self, tasks=None):
+        """
+        Builds the onnx sessions of the downloaded models & runs a warm up inference, on the worker of each model.
+        The prepare jobs have the lowest priority, requests of the user run before them.
+        """
+        for task in tasks or MODELS:
+            if not is_available(task, self.model_dir) or getattr(self, f"onnx_{task}_sess"):
+                continue
+            worker = getattr(self, f"{task}_worker")
+            worker.submit(self.prepare_model, task, priority=20, tag="prepare")
+
+    def prepare_model(self, task, warm_up=True, on_ready=None):
+        # runs on the model worker, so even the imports of the engine stay off the main thread
+        engine = self.engine(task)
+        started = getattr(engine, f"start_{task}_session")()
+        if started:
+            if warm_up:
+                engine.warm_up()
+            print(f"Onnx session is ready: {MODELS[task]['file']}")
+            Clock.schedule_once(lambda dt: self.session_ready(task, on_ready))
+        elif on_ready:
+            Clock.schedule_once(lambda dt: self.show_toast_msg(f"Could not load the {MODELS[task]['name']} model!", is_error=True))
+
+    def session_ready(self, task, on_ready=None):
+        setattr(self, f"onnx_{task}_sess", True)
+        if on_ready:
+            on_ready()
+
+    def start_session(self, task, on_ready=None):
+        """
+        Loads the session of the model on its worker ahead of the queued requests, the main thread never waits
+        for a model load (or download). A request submitted right after it runs once the session is ready.
+        """
+        if getattr(self, f"onnx_{task}_sess"):
+            return
+        worker = getattr(self, f"{task}_worker")
+        worker.submit(self.prepare_model, task, priority=-1, tag="session", warm_up=False, on_ready=on_ready)
+
+    def prefetch_models(self):
+        """Downloads the missing models one after the other, then prepares all of them"""
+        if self.is_downloading:
+            self.show_toast_msg("Please wait for the model download to finish!", is_error=True)
+            return
+        missing = missing_models(self.model_dir)
+        if missing:
+            total_mb = sum(MODELS[task]["size_mb"] for task in missing)
+            self.show_toast_msg(f"Downloading {len(missing)} model(s) (~{total_mb}MB) in the background")
+            Thread(target=self.fetch_missing_models, args=(missing,), daemon=True).start()
+        else:
+            self.show_toast_msg("All models are downloaded, preparing them")
+            self.prepare_models()
+
+    def fetch_missing_models(self, tasks):
+        from model_downloader import DownloadError
+        for task in tasks:
+            self.is_downloading = MODELS[task]["file"]
+            try:
+                fetch_model(task, self.model_dir)
+            except DownloadError as e:
+                print(f"Error downloading the onnx file: {e} 😞")
+                Clock.schedule_once(lambda dt, task=task: self.show_toast_msg(f"Download failed for: {MODELS[task]['file']}", is_error=True))
+        self.is_downloading = False
+        Clock.schedule_once(lambda dt: self.show_toast_msg("Model downloads finished"))
+        Clock.schedule_once(lambda dt: self.prepare_models())
 
     def show_toast_msg(self, message, is_error=False, duration=3):
         from kivymd.uix.snackbar import MDSnackbar
@@ -309,12 +379,22 @@ class VisionAiApp(MDApp):
         if self.txt_dialog:
             self.txt_dialog.dismiss()
 
+    def build_screen(self, screen):
+        """Adds the box of a screen the first time it is entered, it gets its usual id in `root.ids`"""
+        module_name, class_name, box_id = lazy_screens[screen.name]
+        if box_id in self.root.ids:
+            return
+        module = importlib.import_module(module_name)
+        box = getattr(module, class_name)()
+        screen.add_widget(box)
+        self.root.ids[box_id] = box
+
     def on_img_obj_detect(self):
         self.show_toast_msg("You can detect objects on your image!")
 
     def on_cam_obj_detect(self):
-        if not os.path.exists(self.detect_model_path) and self.is_downloading != "ssd_mobilenet_v1_10.onnx":
-            self.popup_detect_model()
+        if not os.path.exists(self.detect_model_path) and self.is_downloading != MODELS["detect"]["file"]:
+            self.popup_model("detect")
         self.show_toast_msg("Capture an image & detect objects!")
         self.cam_uix = self.root.ids.cam_detect_box.ids.capture_image
         self.cam_uix.clear_widgets()
@@ -337,6 +417,7 @@ class VisionAiApp(MDApp):
                 self.show_toast_msg(f"No camera found on {platform}!", is_error=True)
                 return
         try:
+            from kivy.uix.camera import Camera
             self.camera = Camera(
                 index = cam_indx,
                 resolution = resolution,
@@ -350,48 +431,37 @@ class VisionAiApp(MDApp):
             self.show_toast_msg(f"Error setting up the camera: {e}", is_error=True)
 
     def on_img_classify(self):
-        if not os.path.exists(self.classify_model_path) and self.is_downloading != "resnet18-v1-7.onnx":
-            self.popup_classify_model()
+        if not os.path.exists(self.classify_model_path) and self.is_downloading != MODELS["classify"]["file"]:
+            self.popup_model("classify")
         self.show_toast_msg("Select an image & get top 5 predictions")
-        if not self.onnx_classify:
-            self.onnx_classify = OnnxClassify(
-                save_dir=self.op_dir,
-                model_dir=self.model_dir,
-            )
 
     def on_img_species(self):
-        if not os.path.exists(self.species_model_path) and self.is_downloading != "spicesNet_v401a.onnx":
-            self.popup_species_model()
+        if not os.path.exists(self.species_model_path) and self.is_downloading != MODELS["species"]["file"]:
+            self.popup_model("species")
         self.show_toast_msg("Select an image & identify the Species from more than 2000 species list")
-        if not self.onnx_species:
-            self.onnx_species = OnnxSpecies(
-                save_dir=self.op_dir,
-                model_dir=self.model_dir,
-            )
 
     def on_cam_obj_dt_leave(self):
+        self.stop_live_detect()
+        self.cancel_screen_jobs("camObjDetect")
         if self.cam_found:
             self.camera.play = False
             self.cam_uix.clear_widgets()
 
     def open_img_file_manager(self):
         """Open the file manager to select an image file. On android use Downloads or Pictures folders only"""
-        if self.is_downloading == "ssd_mobilenet_v1_10.onnx":
+        if self.is_downloading == MODELS["detect"]["file"]:
             self.show_toast_msg("Please wait for the model download to finish!", is_error=True)
             return
-        if not os.path.exists(self.detect_model_path) and self.is_downloading != "ssd_mobilenet_v1_10.onnx":
+        if not os.path.exists(self.detect_model_path) and self.is_downloading != MODELS["detect"]["file"]:
             self.onnx_detect_sess = False
-            self.popup_detect_model()
-            return
-        if not self.onnx_detect_sess:
-            self.onnx_detect_sess = self.onnx_detect.start_detect_session()
-        if self.is_detect_running:
-            self.show_toast_msg("Please wait for the current operation to finish", is_error=True)
+            self.popup_model("detect")
             return
+        self.start_session("detect")
         try:
             #self.img_file_manager.show(self.external_storage)  # native app specific path
             if not self.last_upload_path:
                 self.last_upload_path = self.external_storage
+            from plyer import filechooser
             filechooser.open_file(
                 on_selection = self.handle_img_selection,
                 path = self.last_upload_path,
@@ -415,22 +485,19 @@ class VisionAiApp(MDApp):
 
     def open_clsfy_img_file(self):
         """Open the file manager to select an image file. On android use Downloads or Pictures folders only"""
-        if self.is_downloading == "resnet18-v1-7.onnx":
+        if self.is_downloading == MODELS["classify"]["file"]:
             self.show_toast_msg("Please wait for the model download to finish!", is_error=True)
             return
-        if not os.path.exists(self.classify_model_path) and self.is_downloading != "resnet18-v1-7.onnx":
+        if not os.path.exists(self.classify_model_path) and self.is_downloading != MODELS["classify"]["file"]:
             self.onnx_classify_sess = False
-            self.popup_classify_model()
-            return
-        if not self.onnx_classify_sess: # update it
-            self.onnx_classify_sess = self.onnx_classify.start_classify_session()
-        if self.is_classify_running:
-            self.show_toast_msg("Please wait for the current operation to finish", is_error=True)
+            self.popup_model("classify")
             return
+        self.start_session("classify")
         try:
             #self.img_file_manager.show(self.external_storage)
             if not self.last_upload_path:
                 self.last_upload_path = self.external_storage
+            from plyer import filechooser
             filechooser.open_file(
                 on_selection = self.handle_img_selection,
                 path = self.last_upload_path,
@@ -444,22 +511,19 @@ class VisionAiApp(MDApp):
 
     def open_spcnt_img_file(self):
         """Open the file manager to select an image file. On android use Downloads or Pictures folders only"""
-        if self.is_downloading == "spicesNet_v401a.onnx":
+        if self.is_downloading == MODELS["species"]["file"]:
             self.show_toast_msg("Please wait for the model download to finish!", is_error=True)
             return
-        if not os.path.exists(self.species_model_path) and self.is_downloading != "spicesNet_v401a.onnx":
+        if not os.path.exists(self.species_model_path) and self.is_downloading != MODELS["species"]["file"]:
             self.onnx_species_sess = False
-            self.popup_species_model()
-            return
-        if not self.onnx_species_sess: # update it
-            self.onnx_species_sess = self.onnx_species.start_species_session()
-        if self.is_species_running:
-            self.show_toast_msg("Please wait for the current operation to finish", is_error=True)
+            self.popup_model("species")
             return
+        self.start_session("species")
         try:
             #self.img_file_manager.show(self.external_storage)
             if not self.last_upload_path:
                 self.last_upload_path = self.external_storage
+            from plyer import filechooser
             filechooser.open_file(
                 on_selection = self.handle_img_selection,
                 path = self.last_upload_path,
@@ -514,33 +578,41 @@ class VisionAiApp(MDApp):
     def open_op_file_manager(self, instance):
         """Open the file manager to select destination folder. On android use Downloads or Pictures folders only"""
         try:
+            if self.op_file_manager is None:
+                from kivymd.uix.filemanager import MDFileManager
+                self.op_file_manager = MDFileManager(
+                    exit_manager=self.op_file_exit_manager,
+                    select_path=self.select_op_path,
+                    selector="folder",  # Restrict to selecting directories only
+                )
             self.op_file_manager.show(self.external_storage)
             self.is_op_file_mgr_open = True
         except Exception as e:
             self.show_toast_msg(f"Error: {e}", is_error=True)
 
-    def download_n_remove_file(self, source, dest):
-        import shutil
+    def save_detect_output(self, result, dest):
+        """Runs on the detect worker: draws the full resolution output of the result & writes it"""
         try:
-            shutil.copyfile(source, dest)
+            self.engine("detect").save_detections(result["source"], result["detections"], dest)
             print(f"File successfully download to: {dest}")
-            self.show_toast_msg(f"File download to: {dest}")
-            os.remove(source)
-            return True
+            Clock.schedule_once(lambda dt: self.show_toast_msg(f"File download to: {dest}"))
         except Exception as e:
             print(f"Error saving file: {e}")
-            self.show_toast_msg(f"Error saving file: {e}", is_error=True)
-            return False
+            Clock.schedule_once(lambda dt: self.show_toast_msg(f"Error saving file: {e}", is_error=True))
 
     def select_op_path(self, path: str):
         """
         Called when a directory is selected. Save the Output file.
         """
-        filename = os.path.basename(self.op_img_path)
-        chosen_path = os.path.join(path, filename) # destination path
-        download_stat = self.download_n_remove_file(self.op_img_path, chosen_path)
-        if download_stat:
-            self.op_img_path = ""
+        result = self.op_result
+        if result is None:
+            self.show_toast_msg("There is no output to download!", is_error=True)
+            self.op_file_exit_manager()
+            return
+        chosen_path = os.path.join(path, result["filename"]) # destination path
+        job = self.detect_worker.submit(self.save_detect_output, result, chosen_path, priority=0, tag="download")
+        if self.is_job_queued(job, self.detect_worker):
+            self.op_result = None
             if self.root.ids.screen_manager.current == "imgObjDetect":
                 result_box = self.root.ids.img_detect_box.ids.result_image
             else:
@@ -557,14 +629,15 @@ class VisionAiApp(MDApp):
         if self.image_path == "":
             self.show_toast_msg("No image is selected!", is_error=True)
             return
-        if not self.onnx_detect_sess:
-            self.onnx_detect_sess = self.onnx_detect.start_detect_session()
-            self.submit_onnx_detect()
-        if self.is_detect_running:
-            self.show_toast_msg("Please wait for the previous request to finish", is_error=True)
+        # a model which failed to load answers the request with an error
+        self.start_session("detect")
+        # tiles keep the small objects of a large photo, at the cost of one inference per tile
+        run_fn = self.engine("detect").run_detect_tiled if self.tiled_detect else self.engine("detect").run_detect
+        job = self.submit_traced(self.detect_worker, self.run_onnx_job, run_fn, self.image_path, self.onnx_detect_callback, "imgObjDetect",
+            priority=1, tag="imgObjDetect", on_cancel=self.cancelled_job(self.onnx_detect_callback, "imgObjDetect"),
+            save_output=False, preview_size=self.preview_size())
+        if not self.is_job_queued(job, self.detect_worker):
             return
-        onnx_thread = Thread(target=self.onnx_detect.run_detect, args=(self.image_path, self.onnx_detect_callback, "imgObjDetect"), daemon=True)
-        onnx_thread.start()
         self.is_detect_running = True
         tmp_spin = TempSpinWait()
         result_box = self.root.ids.img_detect_box.ids.result_image
@@ -575,47 +648,174 @@ class VisionAiApp(MDApp):
         if not self.cam_found:
             self.show_toast_msg("Camera could not be loaded!", is_error=True)
             return
-        if self.is_downloading == "ssd_mobilenet_v1_10.onnx":
+        if self.is_downloading == MODELS["detect"]["file"]:
             self.show_toast_msg("Please wait for the model download to finish!", is_error=True)
             return
-        if not os.path.exists(self.detect_model_path) and self.is_downloading != "ssd_mobilenet_v1_10.onnx":
+        if not os.path.exists(self.detect_model_path) and self.is_downloading != MODELS["detect"]["file"]:
             self.onnx_detect_sess = False
-            self.popup_detect_model()
-            return
-        if not self.onnx_detect_sess:
-            self.onnx_detect_sess = self.onnx_detect.start_detect_session()
-            self.capture_n_onnx_detect()
-        if self.is_detect_running:
-            self.show_toast_msg("Please wait for the previous request to finish", is_error=True)
+            self.popup_model("detect")
             return
+        self.start_session("detect")
         self.image_path = ""
         import datetime
         now = datetime.datetime.now()
         current_time = str(now.strftime("%H%M%S"))
         current_date = str(now.strftime("%Y%m%d"))
         capture_file = f"cam-{current_date}-{current_time}.png"
-        self.image_path = os.path.join(self.op_dir, capture_file)
-        self.camera.export_to_png(self.image_path)
-        onnx_thread = Thread(target=self.onnx_detect.run_detect, args=(self.image_path, self.onnx_detect_callback, "camObjDetect"), daemon=True)
-        onnx_thread.start()
+        capture_path = os.path.join(self.op_dir, capture_file)
+        # read the camera texture straight into memory (GL calls must stay on the main thread)
+        texture = self.camera.texture
+        if texture is None:
+            self.show_toast_msg("Camera has no frame yet!", is_error=True)
+            return
+        pixels = texture.pixels
+        # a fresh capture goes ahead of the queued image requests
+        job = self.submit_traced(self.detect_worker, self.detect_cam_frame, pixels, texture.size, capture_path, priority=0, tag="camObjDetect",
+            on_cancel=self.cancelled_job(self.onnx_detect_callback, "camObjDetect"))
+        if not self.is_job_queued(job, self.detect_worker):
+            return
         self.is_detect_running = True
         tmp_spin = TempSpinWait()
         result_box = self.root.ids.cam_detect_box.ids.cam_result_image
         result_box.clear_widgets()
         result_box.add_widget(tmp_spin)
 
+    def toggle_live_detect(self):
+        if self.live_detector and self.live_detector.running:
+            self.stop_live_detect()
+        else:
+            self.start_live_detect()
+
+    def start_live_detect(self):
+        if not self.cam_found:
+            self.show_toast_msg("Camera could not be loaded!", is_error=True)
+            return
+        if self.is_downloading == MODELS["detect"]["file"]:
+            self.show_toast_msg("Please wait for the model download to finish!", is_error=True)
+            return
+        if not os.path.exists(self.detect_model_path):
+            self.onnx_detect_sess = False
+            self.popup_model("detect")
+            return
+        if not self.onnx_detect_sess:
+            def on_ready():
+                # unless the user left the camera meanwhile
+                if self.root.ids.screen_manager.current == "camObjDetect" and not self.live_detector:
+                    self.start_live_detect()
+            self.show_toast_msg("Loading the detection model...")
+            self.start_session("detect", on_ready)
+            return
+        from live_detect import LiveDetector
+        from tracker import Tracker
+        # the tracker moves the boxes between two detections, SSD runs on every 3rd frame only
+        self.live_detector = LiveDetector(self.engine("detect"), self.live_detect_callback, tracker=Tracker(detect_every=3))
+        self.live_detector.start()
+        self.live_overlay = None
+        self.live_frame_event = Clock.schedule_interval(self.live_frame_tick, 1 / 15)
+        btn_live = self.root.ids.cam_detect_box.ids.btn_live
+        btn_live.text = "Stop"
+        btn_live.icon = "stop"
+
+    def stop_live_detect(self):
+        if self.live_frame_event:
+            self.live_frame_event.cancel()
+            self.live_frame_event = None
+        if self.live_detector:
+            self.live_detector.stop()
+            self.live_detector = None
+        if self.live_overlay is not None and self.camera:
+            self.camera.canvas.after.remove(self.live_overlay)
+        self.live_overlay = None
+        cam_box = self.root.ids.cam_detect_box
+        cam_box.ids.btn_live.text = "Live"
+        cam_box.ids.btn_live.icon = "play"
+        cam_box.ids.live_stats.text = ""
+
+    def live_frame_tick(self, dt):
+        # main thread: only the texture read back happens here, the worker converts the frame
+        texture = self.camera.texture if self.camera else None
+        if texture is None or not self.live_detector:
+            return
+        self.live_detector.submit(texture.pixels, texture.size)
+
+    def live_detect_callback(self, detections, frame_size, stats):
+        if not self.live_detector or not self.camera:
+            return
+        from live_detect import draw_overlay
+        self.live_overlay = draw_overlay(self.camera, detections, frame_size, self.live_overlay)
+        self.root.ids.cam_detect_box.ids.live_stats.text = (
+            f"{stats['fps']:.1f} FPS ({stats['detect_fps']:.1f} detected) | {stats['latency_ms']:.0f} ms latency | {len(detections)} objects | {stats['dropped']} frames skipped"
+        )
+
+    def detect_cam_frame(self, pixels, size, capture_path, trace_id=None):
+        """Runs on a worker thread: converts the captured texture pixels & detects the objects without a disk round trip"""
+        from frame_utils import frame_from_pixels
+        callback = default_tracer.wrap_callback(self.onnx_detect_callback, trace_id)
+        with default_tracer.span("camObjDetect job", "worker", flow=trace_id, flow_phase="t"):
+            frame = frame_from_pixels(pixels, size)
+            if self.save_cam_capture:
+                import cv2
+                cv2.imwrite(capture_path, frame)
+            result = self.engine("detect").run_detect_array(frame, capture_path, callback, "camObjDetect",
+                save_output=False, preview_size=self.preview_size())
+        if result is not None:
+            # early errors are returned instead of being sent to the callback
+            Clock.schedule_once(lambda dt: callback(result))
+
+    def preview_size(self):
+        # results are shown in memory at most as large as the window
+        return int(max(Window.size))
+
+    def submit_traced(self, worker, fn, *args, **kwargs):
+        """`worker.submit` as the first span of a traced request, `fn` gets the flow id as `trace_id`"""
+        flow = default_tracer.new_flow()
+        with default_tracer.span("submit", "ui", flow=flow, flow_phase="s", tag=kwargs.get("tag")):
+            return worker.submit(fn, *args, trace_id=flow, **kwargs)
+
+    def run_onnx_job(self, run_fn, image_path, callback, caller, trace_id=None, **kwargs):
+        """Runs on the model worker thread"""
+        callback = default_tracer.wrap_callback(callback, trace_id)
+        with default_tracer.span(f"{caller} job", "worker", flow=trace_id, flow_phase="t"):
+            result = run_fn(image_path, callback, caller, **kwargs)
+        if result is not None:
+            # early errors are returned instead of being sent to the callback
+            Clock.schedule_once(lambda dt: callback(result))
+
+    def is_job_queued(self, job, worker):
+        if job is None:
+            self.show_toast_msg("Too many requests are waiting, please try again shortly", is_error=True)
+            return False
+        ahead = worker.queue_depth() - 1
+        if ahead > 0:
+            self.show_toast_msg(f"Request queued, {ahead} ahead of it")
+        return True
+
+    def cancelled_job(self, callback, caller):
+        """`on_cancel` of a queued request: its callback clears the spinner & the running flag on the main thread"""
+        result = {"status": False, "message": "Cancelled", "caller": caller}
+        return lambda: Clock.schedule_once(lambda dt: callback(result))
+
+    def cancel_screen_jobs(self, caller):
+        """Drop the requests of a screen the user has left, a request already running still finishes"""
+        workers = {
+            "imgObjDetect": self.detect_worker,
+            "camObjDetect": self.detect_worker,
+            "imgClassify": self.classify_worker,
+            "imgSpecies": self.species_worker,
+        }
+        worker = workers.get(caller)
+        if worker and worker.cancel(tag=caller):
+            print(f"Cancelled the waiting requests of: {caller}")
+
     def submit_onnx_classify(self):
         if self.image_path == "":
             self.show_toast_msg("No image is selected!", is_error=True)
             return
-        if not self.onnx_classify_sess:
-            self.onnx_classify_sess = self.onnx_classify.start_classify_session()
-            self.submit_onnx_classify()
-        if self.is_classify_running:
-            self.show_toast_msg("Please wait for the previous request to finish", is_error=True)
+        self.start_session("classify")
+        job = self.submit_traced(self.classify_worker, self.run_onnx_job, self.engine("classify").run_classify, self.image_path, self.onnx_classify_callback, "imgClassify", priority=1, tag="imgClassify",
+            on_cancel=self.cancelled_job(self.onnx_classify_callback, "imgClassify"))
+        if not self.is_job_queued(job, self.classify_worker):
             return
-        onnx_thread = Thread(target=self.onnx_classify.run_classify, args=(self.image_path, self.onnx_classify_callback, "imgClassify"), daemon=True)
-        onnx_thread.start()
         self.is_classify_running = True
         tmp_spin = TempSpinWait()
         result_box = self.root.ids.img_classify_box.ids.result_label
@@ -626,14 +826,11 @@ class VisionAiApp(MDApp):
         if self.image_path == "":
             self.show_toast_msg("No image is selected!", is_error=True)
             return
-        if not self.onnx_species_sess:
-            self.onnx_species_sess = self.onnx_species.start_species_session()
-            self.submit_onnx_species()
-        if self.is_species_running:
-            self.show_toast_msg("Please wait for the previous request to finish", is_error=True)
+        self.start_session("species")
+        job = self.submit_traced(self.species_worker, self.run_onnx_job, self.engine("species").run_species, self.image_path, self.onnx_species_callback, "imgSpecies", priority=1, tag="imgSpecies",
+            on_cancel=self.cancelled_job(self.onnx_species_callback, "imgSpecies"))
+        if not self.is_job_queued(job, self.species_worker):
             return
-        onnx_thread = Thread(target=self.onnx_species.run_species, args=(self.image_path, self.onnx_species_callback, "imgSpecies"), daemon=True)
-        onnx_thread.start()
         self.is_species_running = True
         tmp_spin = TempSpinWait()
         result_box = self.root.ids.img_species_box.ids.result_label
@@ -644,17 +841,20 @@ class VisionAiApp(MDApp):
         status = onnx_resp["status"]
         message = onnx_resp["message"]
         caller = onnx_resp["caller"]
-        self.is_detect_running = False
+        if onnx_resp.get("timings"):
+            print(f"{caller} timings (ms): {onnx_resp['timings']}")
+        self.is_detect_running = self.detect_worker.queue_depth() > 0
         if caller == "camObjDetect":
             result_box = self.root.ids.cam_detect_box.ids.cam_result_image
         else:
             result_box = self.root.ids.img_detect_box.ids.result_image
+        result_box.clear_widgets()
         if status is True:
-            self.show_toast_msg(f"Output generated at: {message}")
-            self.op_img_path = message
-            result_box.clear_widgets()
+            from frame_utils import texture_from_image
+            self.show_toast_msg(message)
+            self.op_result = onnx_resp
             fitImage = Image(
-                source = message,
+                texture = texture_from_image(onnx_resp["image"]),
                 fit_mode = "contain"
             )
             result_box.add_widget(fitImage)
@@ -674,7 +874,9 @@ class VisionAiApp(MDApp):
         status = onnx_resp["status"]
         message = onnx_resp["message"]
         caller = onnx_resp["caller"]
-        self.is_classify_running = False
+        if onnx_resp.get("timings"):
+            print(f"{caller} timings (ms): {onnx_resp['timings']}")
+        self.is_classify_running = self.classify_worker.queue_depth() > 0
         result_box = self.root.ids.img_classify_box.ids.result_label
         result_box.clear_widgets()
         if status is True:
@@ -692,7 +894,9 @@ class VisionAiApp(MDApp):
         status = onnx_resp["status"]
         message = onnx_resp["message"]
         caller = onnx_resp["caller"]
-        self.is_species_running = False
+        if onnx_resp.get("timings"):
+            print(f"{caller} timings (ms): {onnx_resp['timings']}")
+        self.is_species_running = self.species_worker.queue_depth() > 0
         result_box = self.root.ids.img_species_box.ids.result_label
         result_box.clear_widgets()
         if status is True:
@@ -812,6 +1016,35 @@ class VisionAiApp(MDApp):
             #self.img_file_manager.preview = True
             self.img_preview = True
 
+    def cam_save_on(self):
+        cam_save_sw = self.root.ids.settings_box.ids.cam_save_switch
+        if self.save_cam_capture:
+            cam_save_sw.icon = "toggle-switch-off"
+            cam_save_sw.text_color = "gray"
+            self.save_cam_capture = False
+        else:
+            cam_save_sw.icon = "toggle-switch"
+            cam_save_sw.text_color = "green"
+            self.save_cam_capture = True
+
+    def tiled_detect_on(self):
+        tiled_detect_sw = self.root.ids.settings_box.ids.tiled_detect_switch
+        if self.tiled_detect:
+            tiled_detect_sw.icon = "toggle-switch-off"
+            tiled_detect_sw.text_color = "gray"
+            self.tiled_detect = False
+        else:
+            tiled_detect_sw.icon = "toggle-switch"
+            tiled_detect_sw.text_color = "green"
+            self.tiled_detect = True
+
+    def clear_result_cache(self):
+        if not self.open_result_cache():
+            self.show_toast_msg("The result cache is not available!", is_error=True)
+            return
+        self.result_cache.clear()
+        self.show_toast_msg("Cleared the cached results")
+
     def events(self, instance, keyboard, keycode, text, modifiers):
         """Handle mobile device button presses (e.g., Android back button)."""
         #if keyboard in (1001, 27):  # Android back button or equivalent
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import hashlib
+import platform
+
+import onnxruntime as ort
+
+# optimized models are kept in this folder next to the model files
+CACHE_DIR = "optimized"
+FINGERPRINTS_FILE = "fingerprints.json"
+FORMATS = {"ort": ".ort", "onnx": ".onnx"}
+
+
+def cache_dir_of(model_path):
+    return os.path.join(os.path.dirname(os.path.abspath(model_path)), CACHE_DIR)
+
+
+def read_fingerprints(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, FINGERPRINTS_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_fingerprints(cache_dir, fingerprints):
+    path = os.path.join(cache_dir, FINGERPRINTS_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(fingerprints, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def model_hash(model_path, cache_dir=None):
+    """
+    sha256 of the model file. Hashing a large model takes longer than the load it should speed up,
+    so the hash is kept in `fingerprints.json` & only computed again when the size or mtime changed.
+    """
+    cache_dir = cache_dir or cache_dir_of(model_path)
+    stat = os.stat(model_path)
+    name = os.path.basename(model_path)
+    fingerprints = read_fingerprints(cache_dir)
+    known = fingerprints.get(name)
+    if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+        return known["sha256"]
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    fingerprints[name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+    os.makedirs(cache_dir, exist_ok=True)
+    write_fingerprints(cache_dir, fingerprints)
+    return fingerprints[name]["sha256"]
+
+
+# plain settings copied into the options of every attempt, the config entries of the caller can't be listed
+COPIED_OPTIONS = [
+    "intra_op_num_threads", "inter_op_num_threads", "execution_mode", "graph_optimization_level",
+    "enable_cpu_mem_arena", "enable_mem_pattern", "enable_mem_reuse", "log_severity_level",
+]
+
+
+def copy_options(sess_options=None):
+    """New SessionOptions with the settings of `sess_options`, which is never changed"""
+    options = ort.SessionOptions()
+    if sess_options is not None:
+        for name in COPIED_OPTIONS:
+            setattr(options, name, getattr(sess_options, name))
+    return options
+
+
+def saved_level(optimization_level):
+    """
+    Level of the graph in the artifact: at most `extended`. The `all` level adds layout changes for the CPU
+    it runs on (e.g. the NCHWc block size of AVX2 vs AVX-512) which must not be loaded on another host,
+    and the model folder can be shared by several. Those are applied again when the artifact is loaded.
+    """
+    if optimization_level == ort.GraphOptimizationLevel.ORT_ENABLE_ALL:
+        return ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    return optimization_level
+
+
+def artifact_options(sess_options, level):
+    """Options to run the saved graph with: only the host specific layout passes of the `all` level are left"""
+    options = copy_options(sess_options)
+    if level != ort.GraphOptimizationLevel.ORT_ENABLE_ALL:
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+    return options
+
+
+def artifact_key(model_sha256, optimization_level, fmt, providers):
+    """
+    The optimized graph depends on the model, the onnxruntime release, the saved optimization level & the
+    execution providers. The threads don't change the graph, and the saved graph has no host specific parts.
+    """
+    parts = [model_sha256, ort.__version__, str(saved_level(optimization_level)), fmt, ",".join(providers), platform.machine()]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def artifact_path(model_path, key, fmt, cache_dir=None):
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_dir or cache_dir_of(model_path), f"{stem}.{key}{FORMATS[fmt]}")
+
+
+def remove_stale(model_path, keep, cache_dir):
+    """Deletes the other optimized files of the model (an older release, model or setting)"""
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if path != keep and name.startswith(f"{stem}.") and name.endswith(tuple(FORMATS.values())):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def cached_session(model_path, sess_options=None, providers=None, fmt="ort", cache_dir=None, stats=None):
+    """
+    InferenceSession of the model from its optimized artifact, which is written on the first load:
+    the graph is parsed & optimized once, later loads skip the optimization (and with the ORT format the
+    protobuf parsing). Falls back to the plain model when the artifact can't be written or read.
+    Every attempt gets its own copy of `sess_options`, a failed one leaves nothing behind for the next.
+    `stats` (a dict) gets the load time in ms & whether the artifact was used.
+    """
+    start = time.perf_counter()
+    level = (sess_options or ort.SessionOptions()).graph_optimization_level
+    providers = providers or ["CPUExecutionProvider"]
+    cache_dir = cache_dir or cache_dir_of(model_path)
+    source = "model"
+    try:
+        key = artifact_key(model_hash(model_path, cache_dir), level, fmt, providers)
+        path = artifact_path(model_path, key, fmt, cache_dir)
+    except OSError as e:
+        print(f"Optimized model cache unavailable for {model_path}: {e}")
+        path = None
+
+    sess = None
+    if path and os.path.exists(path):
+        try:
+            sess = ort.InferenceSession(path, sess_options=artifact_options(sess_options, level), providers=providers)
+            source = "cache"
+        except Exception as e:
+            print(f"Discarding the optimized model {path}: {e}")
+            os.remove(path)
+    if sess is None and path:
+        tmp_path = path + ".tmp"
+        try:
+            options = copy_options(sess_options)
+            options.graph_optimization_level = saved_level(level)
+            options.optimized_model_filepath = tmp_path
+            options.add_session_config_entry("session.save_model_format", fmt.upper())
+            sess = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+            os.replace(tmp_path, path)
+            remove_stale(model_path, path, cache_dir)
+            if level == ort.GraphOptimizationLevel.ORT_ENABLE_ALL:
+                # the layout passes of the `all` level for this host, on top of the saved graph
+                sess = ort.InferenceSession(path, sess_options=artifact_options(sess_options, level), providers=providers)
+            source = "written"
+        except Exception as e:
+            print(f"Could not write the optimized model of {model_path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            sess = None
+    if sess is None:
+        sess = ort.InferenceSession(model_path, sess_options=copy_options(sess_options), providers=providers)
+    if stats is not None:
+        stats["load_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        stats["source"] = source
+    return sess
+
+
+def clear_cache(model_dir):
+    """Deletes the optimized models of a model folder, returns the number of files removed"""
+    cache_dir = os.path.join(model_dir, CACHE_DIR)
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(cache_dir):
+        os.remove(os.path.join(cache_dir, name))
+        removed += 1
+    return removed
@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import hashlib
+from threading import Thread, Lock, Event, get_ident
+
+import requests
+
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ModelDownloader():
+    """
+    Downloads one file to `dest_path`:
+    - the data goes to `<dest>.part`, renamed to `dest_path` only once it is complete & verified,
+      so an existing `dest_path` is always a whole file
+    - servers supporting HTTP ranges get the file split in `segments` parallel range requests,
+      the progress of every segment is kept in the `<dest>.part.json` sidecar & a later run resumes from it
+    - the SHA-256 (& size) are checked against the expected values when they are known
+    - `progress(downloaded, total)` is called from the download threads at most every `progress_interval` seconds
+    """
+    def __init__(self, url, dest_path, sha256=None, size=None, segments=4, min_segment_size=4 * 1024 * 1024,
+            chunk_size=256 * 1024, progress=None, progress_interval=0.25, timeout=30):
+        self.url = url
+        self.dest_path = dest_path
+        self.part_path = dest_path + PART_SUFFIX
+        self.state_path = dest_path + STATE_SUFFIX
+        self.sha256 = sha256.lower() if sha256 else None
+        self.size = size
+        self.segments = max(1, segments)
+        self.min_segment_size = min_segment_size
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.timeout = timeout
+        self.lock = Lock()
+        self.cancelled = Event()
+        self.state = None
+        self.last_report = 0.0
+        self.last_saved = 0.0
+        self.errors = []
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def probe(self):
+        """Returns (final url, size or None, range support, etag) of the file"""
+        with requests.get(self.url, headers={"Range": "bytes=0-0"}, stream=True, timeout=self.timeout) as req:
+            req.raise_for_status()
+            etag = req.headers.get("ETag", "")
+            if req.status_code == 206:
+                # Content-Range: bytes 0-0/<size>
+                total = req.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+                return req.url, int(total) if total.isdigit() else None, True, etag
+            length = req.headers.get("Content-Length")
+            return req.url, int(length) if length and length.isdigit() else None, False, etag
+
+    def load_state(self, url, size, etag):
+        """The sidecar of an earlier run when it belongs to the same file, else None"""
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        same = state.get("url") == self.url and state.get("size") == size and state.get("etag") == etag
+        if not same or not os.path.exists(self.part_path):
+            return None
+        state["final_url"] = url
+        return state
+
+    def save_state(self, force=False):
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.last_saved < 1.0:
+                return
+            self.last_saved = now
+            data = json.dumps(self.state)
+        tmp_path = f"{self.state_path}.{get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.state_path)
+
+    def new_state(self, url, size, ranges, etag):
+        if ranges and size:
+            count = max(1, min(self.segments, size // self.min_segment_size))
+        else:
+            count = 1
+        step = -(-size // count) if size else 0
+        segments = []
+        for i in range(count):
+            start = i * step
+            end = min(size, start + step) - 1 if size else None
+            segments.append({"start": start, "end": end, "done": 0})
+        # reserve the whole file, every segment writes at its own offset
+        with open(self.part_path, "wb") as f:
+            if size:
+                f.truncate(size)
+        return {"url": self.url, "final_url": url, "size": size, "etag": etag, "ranges": ranges, "segments": segments}
+
+    def downloaded(self):
+        with self.lock:
+            return sum(segment["done"] for segment in self.state["segments"])
+
+    def report(self, force=False):
+        if not self.progress:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.last_report < self.progress_interval:
+                return
+            self.last_report = now
+        self.progress(self.downloaded(), self.state["size"] or 0)
+
+    def fetch_segment(self, segment):
+        try:
+            headers = {}
+            if self.state["ranges"]:
+                start = segment["start"] + segment["done"]
+                if segment["end"] is not None and start > segment["end"]:
+                    return
+                headers["Range"] = f"bytes={start}-{'' if segment['end'] is None else segment['end']}"
+            else:
+                # without range support a single stream starts over
+                segment["done"] = 0
+            with requests.get(self.state["final_url"], headers=headers, stream=True, timeout=self.timeout) as req:
+                req.raise_for_status()
+                if headers and req.status_code != 206:
+                    raise DownloadError(f"Server ignored the range request ({req.status_code})")
+                with open(self.part_path, "r+b") as f:
+                    f.seek(segment["start"] + segment["done"])
+                    for chunk in req.iter_content(chunk_size=self.chunk_size):
+                        if self.cancelled.is_set():
+                            return
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+                        with self.lock:
+                            segment["done"] += len(chunk)
+                        self.report()
+                        self.save_state()
+        except Exception as e:
+            with self.lock:
+                self.errors.append(e)
+            # stop the other segments too, the progress is kept for the next run
+            self.cancelled.set()
+
+    def verify(self):
+        size = os.path.getsize(self.part_path)
+        expected_size = self.size or self.state["size"]
+        if expected_size and size != expected_size:
+            raise DownloadError(f"Size mismatch: got {size} bytes, expected {expected_size}")
+        if self.sha256:
+            digest = hashlib.sha256()
+            with open(self.part_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            if digest.hexdigest() != self.sha256:
+                raise DownloadError(f"SHA-256 mismatch: got {digest.hexdigest()}, expected {self.sha256}")
+        else:
+            checked = f"only the size ({expected_size} bytes) was checked" if expected_size else "the file was not verified"
+            print(f"No SHA-256 available for {os.path.basename(self.dest_path)}, {checked}")
+
+    def discard(self):
+        for path in (self.part_path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def run(self):
+        """Downloads (or resumes) the file, returns `dest_path` or raises DownloadError"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.dest_path)), exist_ok=True)
+        try:
+            url, size, ranges, etag = self.probe()
+        except requests.exceptions.RequestException as e:
+            raise DownloadError(f"Could not reach {self.url}: {e}") from e
+        if self.size and size and size != self.size:
+            raise DownloadError(f"The server has {size} bytes, expected {self.size}")
+
+        self.state = self.load_state(url, size, etag) if ranges else None
+        if self.state is None:
+            self.state = self.new_state(url, size, ranges, etag)
+        else:
+            print(f"Resuming the download of {os.path.basename(self.dest_path)} at {self.downloaded()} bytes")
+        self.save_state(force=True)
+
+        threads = [Thread(target=self.fetch_segment, args=(segment,), daemon=True) for segment in self.state["segments"]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.save_state(force=True)
+        self.report(force=True)
+        if self.errors:
+            raise DownloadError(f"Download interrupted, it resumes on the next try: {self.errors[0]}")
+        if self.cancelled.is_set():
+            raise DownloadError("Download cancelled, it resumes on the next try")
+        if self.state["size"] and self.downloaded() != self.state["size"]:
+            raise DownloadError(f"Connection closed early at {self.downloaded()} of {self.state['size']} bytes, it resumes on the next try")
+
+        try:
+            self.verify()
+        except DownloadError:
+            # a corrupt file can't be resumed
+            self.discard()
+            raise
+        os.replace(self.part_path, self.dest_path)
+        os.remove(self.state_path)
+        return self.dest_path
+
+
+def download_model(url, dest_path, sha256=None, size=None, progress=None, **kwargs):
+    """Downloads a model file, see `ModelDownloader`, raises DownloadError on failure"""
+    return ModelDownloader(url, dest_path, sha256=sha256, size=size, progress=progress, **kwargs).run()
@@ -0,0 +1,117 @@
+import os
+import json
+
+# registered variants of the models (e.g. INT8 from `quantize_models.py`), kept next to the model files
+VARIANTS_FILE = "model_variants.json"
+
+# Every model the app uses, by task:
+#   file: name in the model folder, url: where it is downloaded from
+#   sha256 / size: checked after the download. None: no published value yet, the download is then only
+#   checked against the size the server reports (the INT8 variants are made locally & never downloaded)
+#   size_mb: approximate size shown to the user
+#   input: what the engine feeds the model, used for the warm up
+MODELS = {
+    "detect": {
+        "name": "SSD MobileNet v1 (COCO)",
+        "file": "ssd_mobilenet_v1_10.onnx",
+        "url": "https://github.com/onnx/models/raw/main/validated/vision/object_detection_segmentation/ssd-mobilenetv1/model/ssd_mobilenet_v1_10.onnx",
+        "sha256": None,
+        "size": None,
+        "size_mb": 30,
+        "input": {"shape": [1, 300, 300, 3], "dtype": "uint8", "layout": "NHWC"},
+    },
+    "classify": {
+        "name": "ResNet18 v1 (ImageNet)",
+        "file": "resnet18-v1-7.onnx",
+        "url": "https://github.com/onnx/models/raw/main/validated/vision/classification/resnet/model/resnet18-v1-7.onnx",
+        "sha256": None,
+        "size": None,
+        "size_mb": 45,
+        "input": {"shape": [1, 3, 224, 224], "dtype": "float32", "layout": "NCHW"},
+    },
+    "species": {
+        "name": "SpeciesNet v4.0.1a",
+        "file": "spicesNet_v401a.onnx",
+        "url": "https://github.com/daslearning-org/vision-ai/releases/download/vOnnxModels/spicesNet_v401a.onnx",
+        "sha256": None,
+        "size": None,
+        "size_mb": 215,
+        "input": {"shape": [1, 480, 480, 3], "dtype": "float32", "layout": "NHWC"},
+    },
+}
+
+
+def model_file_path(task, model_dir):
+    return os.path.join(model_dir, MODELS[task]["file"])
+
+
+def is_available(task, model_dir):
+    # the downloader only renames complete & verified files into place
+    return os.path.exists(model_file_path(task, model_dir))
+
+
+def missing_models(model_dir):
+    return [task for task in MODELS if not is_available(task, model_dir)]
+
+
+def input_image_size(task):
+    """(width, height) of the model input"""
+    spec = MODELS[task]["input"]
+    if spec["layout"] == "NCHW":
+        height, width = spec["shape"][2:4]
+    else:
+        height, width = spec["shape"][1:3]
+    return width, height
+
+
+def fetch_model(task, model_dir, progress=None):
+    """Downloads the model of the task into `model_dir`, returns its path or raises DownloadError"""
+    # imported here, the app reads the manifest at start without loading `requests`
+    from model_downloader import download_model
+    spec = MODELS[task]
+    return download_model(spec["url"], model_file_path(task, model_dir), sha256=spec["sha256"], size=spec["size"], progress=progress)
+
+
+def variants_path(model_path):
+    return os.path.join(os.path.dirname(os.path.abspath(model_path)), VARIANTS_FILE)
+
+
+def read_variants(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_variants(path, variants):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(variants, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def register_variant(model_path, variant_path, info=None):
+    """The engines load `variant_path` (in the same folder) instead of `model_path` from now on"""
+    path = variants_path(model_path)
+    variants = read_variants(path)
+    variants[os.path.basename(model_path)] = dict(info or {}, file=os.path.basename(variant_path))
+    write_variants(path, variants)
+
+
+def unregister_variant(model_path):
+    path = variants_path(model_path)
+    variants = read_variants(path)
+    if variants.pop(os.path.basename(model_path), None) is not None:
+        write_variants(path, variants)
+
+
+def selected_variant(model_path):
+    """Path of the registered variant of a model, the model itself when there is none (or its file is gone)"""
+    entry = read_variants(variants_path(model_path)).get(os.path.basename(model_path))
+    if entry:
+        variant = os.path.join(os.path.dirname(os.path.abspath(model_path)), entry["file"])
+        if os.path.exists(variant):
+            return variant
+        print(f"The registered variant {entry['file']} is missing, using {os.path.basename(model_path)}")
+    return model_path
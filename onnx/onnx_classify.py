@@ -1,9 +1,16 @@
 import cv2
 import numpy as np
-from onnxruntime import InferenceSession
 from kivy.clock import Clock
 
+from image_decode import decode_image
+from inference_utils import IOBuffers, chunks, fixed_batch_size, run_batched, static_shape
+from model_downloader import DownloadError
+from model_manifest import fetch_model, input_image_size, model_file_path, selected_variant
+from session_registry import default_registry
+from tracing import StageTimer, stage
+
 import os, sys
+from threading import Lock
 
 # Determine the base path for your application's resources
 if getattr(sys, 'frozen', False):
@@ -15,18 +22,46 @@ else:
 models_dir = os.path.join(base_path, "model_files")
 save_path = os.path.join(base_path, 'outputs')
 synset_path = os.path.join(base_path, 'synset_words.txtset')
+# Standard ImageNet normalization (float32)
+imagenet_mean = np.array([0.485, 0.456, 0.406], dtype=np.float32) * 255
+imagenet_std = np.array([0.229, 0.224, 0.225], dtype=np.float32) * 255
 
 
 class OnnxClassify():
-    def __init__(self, save_dir=save_path, model_dir=models_dir):
+    def __init__(self, save_dir=save_path, model_dir=models_dir, registry=None, cache=None, reuse_buffers=True, reduced_decode=True):
         self.model_flag = False
-        self.sess = None
+        self.model_path = None
+        # single image runs go through preallocated, IOBinding bound buffers
+        self.reuse_buffers = reuse_buffers
+        # large JPEGs are decoded at 1/2, 1/4 or 1/8 of their size when that still covers the input
+        self.reduced_decode = reduced_decode
+        self.buffers = None
+        self.buffer_lock = Lock()
+        self.resized_buf = np.empty((224, 224, 3), dtype=np.uint8)
+        self.rgb_buf = np.empty((224, 224, 3), dtype=np.uint8)
+        self.registry = registry or default_registry
+        # optional ResultCache, a hit skips the decode & the inference
+        self.cache = cache
         self.save_dir = save_dir
         self.model_dir = model_dir
+        # use the labels from synset
+        with open(synset_path, 'r') as f:
+            self.labels = [line.split(' ', 1)[1].strip() for line in f.readlines()]
+
+    @property
+    def sess(self):
+        # fetched from the registry on every use, so an unloaded session gets loaded again
+        if self.model_path is None:
+            return None
+        try:
+            return self.registry.get(self.model_path)
+        except Exception as e:
+            print(f"Error loading model: {e}")
+            return None
 
     def start_classify_session(self, model_name="resnet18-v1-7.onnx"):
         model_path = os.path.join(self.model_dir, model_name)
-        download_path = os.path.join(self.model_dir, "resnet18-v1-7.onnx")
+        download_path = model_file_path("classify", self.model_dir)
         if os.path.exists(download_path):
             model_path = download_path
             self.model_flag = True
@@ -36,25 +71,22 @@ class OnnxClassify():
             model_path = download_path
             print(f"The onnx model: {model_path} does not exist! Downloading it now...")
             # try to download the file from github as a backup
-            downlaod_url = "https://github.com/onnx/models/raw/main/validated/vision/classification/resnet/model/resnet18-v1-7.onnx"
-            import requests
             try:
-                with requests.get(downlaod_url, stream=True) as req:
-                    req.raise_for_status()
-                    with open(download_path, 'wb') as f:
-                        for chunk in req.iter_content(chunk_size=8192):
-                            f.write(chunk)
+                fetch_model("classify", self.model_dir)
                 print(f"Onnx file downloaded successfully to: {download_path} 🎉")
                 self.model_flag = True
-            except requests.exceptions.RequestException as e:
+            except DownloadError as e:
                 print(f"Error downloading the onnx file: {e} 😞")
 
         if self.model_flag:
             try:
-                self.sess = InferenceSession(model_path)
+                # e.g. the INT8 model registered by `quantize_models.py`
+                self.model_path = selected_variant(model_path)
+                sess = self.registry.get(self.model_path)
                 # Get input and output names
-                self.input_name = self.sess.get_inputs()[0].name
-                self.output_name = self.sess.get_outputs()[0].name
+                self.input_name = sess.get_inputs()[0].name
+                self.output_name = sess.get_outputs()[0].name
+                self.buffers = None
                 return True
             except Exception as e:
                 print(f"Error loading model: {e}")
@@ -65,53 +97,194 @@ class OnnxClassify():
         exp_x = np.exp(x - np.max(x, axis=1, keepdims=True))
         return exp_x / np.sum(exp_x, axis=1, keepdims=True)
 
+    def preprocess_array(self, img):
+        # Convert BGR to RGB
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        # Resize to 224x224 (standard for ImageNet models like MobileNetV2)
+        img = cv2.resize(img, (224, 224))
+        # Convert to float32 and normalize
+        img = img.astype(np.float32)
+        img = (img - imagenet_mean) / imagenet_std
+        # Transpose to [C, H, W]
+        img = img.transpose(2, 0, 1)
+        # Ensure the final input is float32
+        return img.astype(np.float32)
+
+    def preprocess_into(self, img, out):
+        """Same as `preprocess_array`, written into `out` (3, 224, 224) without temporary arrays"""
+        # resizing first & converting the color after gives the same pixels
+        cv2.resize(img, (224, 224), dst=self.resized_buf)
+        cv2.cvtColor(self.resized_buf, cv2.COLOR_BGR2RGB, dst=self.rgb_buf)
+        # normalize channel by channel straight into the [C, H, W] input
+        for channel in range(3):
+            np.subtract(self.rgb_buf[:, :, channel], imagenet_mean[channel], out=out[channel])
+            np.divide(out[channel], imagenet_std[channel], out=out[channel])
+        return out
+
+    def make_buffers(self, sess):
+        batch_size = fixed_batch_size(sess) or 1
+        return IOBuffers(
+            {self.input_name: np.zeros((batch_size, 3, 224, 224), dtype=np.float32)},
+            {self.output_name: np.zeros(static_shape(sess.get_outputs()[0].shape, batch_size), dtype=np.float32)},
+        )
+
+    def read_image(self, image_path):
+        img, _ = decode_image(image_path, (224, 224) if self.reduced_decode else None)
+        if img is None:
+            raise ValueError(f"Could not load image at {image_path}")
+        return img
+
+    def preprocess_image(self, image_path):
+        return self.preprocess_array(self.read_image(image_path))
+
+    def classify_probabilities(self, sess, img, timer=None):
+        """Softmax probabilities (1, 1000) of a single BGR image"""
+        if not self.reuse_buffers:
+            with stage(timer, "preprocess"):
+                # add batch dimension [1, C, H, W]
+                img_data = np.expand_dims(self.preprocess_array(img), axis=0)
+            with stage(timer, "inference"):
+                outputs = sess.run([self.output_name], {self.input_name: img_data})
+            with stage(timer, "postprocess"):
+                return self.softmax(outputs[0])
+        with self.buffer_lock:
+            if self.buffers is None:
+                self.buffers = self.make_buffers(sess)
+            with stage(timer, "preprocess"):
+                # only the first row is used, the others are padding of a fixed batch model
+                self.preprocess_into(img, self.buffers.inputs[self.input_name][0])
+            with stage(timer, "inference"):
+                outputs = self.buffers.run(sess)
+            with stage(timer, "postprocess"):
+                return self.softmax(outputs[0][:1])
+
+    def classify_crops(self, sess, crops, timer=None):
+        """Softmax probabilities (N, 1000) of many BGR images (e.g. views of detected boxes) with one batched run"""
+        batch = np.empty((len(crops), 3, 224, 224), dtype=np.float32)
+        with stage(timer, "preprocess"):
+            # the crops are only copied by the resize into their row of the batch
+            with self.buffer_lock:
+                for row, crop in enumerate(crops):
+                    self.preprocess_into(crop, batch[row])
+        with stage(timer, "inference"):
+            outputs = run_batched(sess, [self.output_name], self.input_name, batch)
+        with stage(timer, "postprocess"):
+            return self.softmax(outputs[0])
+
+    def warm_up(self):
+        """Classifies a blank image once, so the first real request runs at the usual speed"""
+        sess = self.sess
+        if sess is None:
+            return False
+        width, height = input_image_size("classify")
+        self.classify_probabilities(sess, np.zeros((height, width, 3), dtype=np.uint8))
+        return True
+
+    def top5_result(self, probabilities, final_result):
+        # probabilities of a single image, shape (1000,)
+        top5_indices = np.argsort(probabilities)[::-1][:5]
+        top5_probs = probabilities[top5_indices]
+        # create the return label
+        label = "Top-5 predictions: \n"
+        for i, idx in enumerate(top5_indices):
+            percent = top5_probs[i] * 100
+            final_result["predictions"].append({
+                "label": self.labels[idx],
+                "index": int(idx),
+                "score": round(float(top5_probs[i]), 4),
+            })
+            label = label + f"{i+1}. {self.labels[idx]}: [b][color=#2574f5]{percent:.2f}%[/color][/b] \n"
+        final_result["message"] = label
+        final_result["status"] = True
+        return final_result
+
+    def cache_key(self, image_path):
+        if self.cache is None or self.model_path is None:
+            return None
+        params = {"task": "classify", "input_size": 224, "reduced_decode": self.reduced_decode}
+        return self.cache.key(image_path, self.model_path, params)
+
+    def cache_result(self, cache_key, final_result):
+        if self.cache is not None and final_result["status"]:
+            self.cache.put(cache_key, {name: final_result[name] for name in ("status", "message", "predictions")})
+
     def run_classify(self, image_path, callback=None, caller=None):
-        final_result = {"status": False, "message": "Initial load", "caller": caller}
-        if self.sess is None:
+        timer = StageTimer("classify")
+        final_result = {"status": False, "message": "Initial load", "caller": caller, "predictions": []}
+        with stage(timer, "cache"):
+            cache_key = self.cache_key(image_path)
+            cached = self.cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            # same image, model & parameters as before
+            final_result.update(cached)
+            final_result["timings"] = timer.result()
+            if callback:
+                Clock.schedule_once(lambda dt: callback(final_result))
+                return
+            return final_result
+
+        sess = self.sess
+        if sess is None:
             final_result['message'] = "Onnx session was not initialized! Check if model has been downloaded."
+            final_result['timings'] = timer.result()
             return final_result
-        # Load and preprocess the image
-        image_filename = image_path.split("/")[-1]
 
         try:
-            img = cv2.imread(image_path)
-            # Convert BGR to RGB
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            # Resize to 224x224 (standard for ImageNet models like MobileNetV2)
-            img = cv2.resize(img, (224, 224))
-            # Convert to float32 and normalize
-            img = img.astype(np.float32)
-            # Standard ImageNet normalization, ensure mean and std are float32
-            mean = np.array([0.485, 0.456, 0.406], dtype=np.float32) * 255
-            std = np.array([0.229, 0.224, 0.225], dtype=np.float32) * 255
-            img = (img - mean) / std
-            # Transpose to [C, H, W] and add batch dimension [1, C, H, W]
-            img = img.transpose(2, 0, 1)
-            img = np.expand_dims(img, axis=0)
-            # Ensure the final input is float32
-            img = img.astype(np.float32)
-
-            # use the labels from synset
-            with open(synset_path, 'r') as f:
-                labels = [line.split(' ', 1)[1].strip() for line in f.readlines()]
-
             # run the classification
-            outputs = self.sess.run([self.output_name], {self.input_name: img})
-            probabilities = self.softmax(outputs[0])
-            top5_indices = np.argsort(probabilities[0])[::-1][:5]
-            top5_probs = probabilities[0][top5_indices]
-            # create the return label
-            label = "Top-5 predictions: \n"
-            for i, idx in enumerate(top5_indices):
-                percent = top5_probs[i] * 100
-                label = label + f"{i+1}. {labels[idx]}: [b][color=#2574f5]{percent:.2f}%[/color][/b] \n"
-            final_result["message"] = label
-            final_result["status"] = True
+            with stage(timer, "decode"):
+                img = self.read_image(image_path)
+            probabilities = self.classify_probabilities(sess, img, timer)
+            with stage(timer, "postprocess"):
+                self.top5_result(probabilities[0], final_result)
+            with stage(timer, "cache"):
+                self.cache_result(cache_key, final_result)
         except Exception as e:
             print(f"Classification error: {e}")
             final_result["message"] = f"Classification error: {e}"
 
+        final_result["timings"] = timer.result()
         if callback:
             Clock.schedule_once(lambda dt: callback(final_result))
         else:
             return final_result
+
+    def run_classify_batch(self, image_paths, batch_size=16, caller=None):
+        """
+        Classify many images with one `sess.run` per `batch_size` images.
+        Returns one result dict (same as `run_classify`) per image path, in the same order.
+        """
+        final_results = [{"status": False, "message": "Initial load", "caller": caller, "predictions": []} for _ in image_paths]
+        sess = self.sess
+        if sess is None:
+            for final_result in final_results:
+                final_result['message'] = "Onnx session was not initialized! Check if model has been downloaded."
+            return final_results
+
+        cache_keys = {}
+        for chunk in chunks(list(range(len(image_paths))), batch_size):
+            tensors = []
+            loaded = []
+            for i in chunk:
+                cache_keys[i] = self.cache_key(image_paths[i])
+                cached = self.cache.get(cache_keys[i]) if cache_keys[i] else None
+                if cached is not None:
+                    final_results[i].update(cached)
+                    continue
+                try:
+                    tensors.append(self.preprocess_image(image_paths[i]))
+                    loaded.append(i)
+                except Exception as e:
+                    final_results[i]["message"] = f"Classification error: {e}"
+            if not loaded:
+                continue
+            try:
+                outputs = run_batched(sess, [self.output_name], self.input_name, np.stack(tensors))
+                probabilities = self.softmax(outputs[0])
+                for row, i in enumerate(loaded):
+                    self.top5_result(probabilities[row], final_results[i])
+                    self.cache_result(cache_keys[i], final_results[i])
+            except Exception as e:
+                print(f"Classification error: {e}")
+                for i in loaded:
+                    final_results[i]["message"] = f"Classification error: {e}"
+        return final_results
@@ -1,9 +1,17 @@
 import cv2
 import numpy as np
-from onnxruntime import InferenceSession
 from kivy.clock import Clock
 
-import os, sys
+from image_decode import decode_image
+from inference_utils import IOBuffers, chunks, fixed_batch_size, run_batched
+from model_downloader import DownloadError
+from model_manifest import fetch_model, input_image_size, model_file_path, selected_variant
+from session_registry import default_registry
+from tracing import StageTimer, stage
+
+import os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 
 # Determine the base path for your application's resources
 if getattr(sys, 'frozen', False):
@@ -29,17 +37,159 @@ coco_labels = {
     85: 'clock', 86: 'vase', 87: 'scissors', 88: 'teddy bear', 89: 'hair drier', 90: 'toothbrush'
 }
 
+coco_ids = {label: class_id for class_id, label in coco_labels.items()}
+
+# one row per detection, boxes as [x1, y1, x2, y2] in pixels of the original image
+DETECTION_DTYPE = np.dtype([("box", np.float32, (4,)), ("score", np.float32), ("class_id", np.int32)])
+
+
+def class_id_of(cls):
+    if isinstance(cls, str):
+        if cls not in coco_ids:
+            raise ValueError(f"Unknown class label: {cls}")
+        return coco_ids[cls]
+    return int(cls)
+
+
+def detections_to_list(detections):
+    """Structured detections as a list of plain dicts (e.g. for json), tracked ones keep their `track_id`"""
+    rows = [
+        {
+            "label": coco_labels.get(class_id, 'unknown'),
+            "class_id": class_id,
+            "score": round(score, 4),
+            "box": [int(v) for v in box],
+        }
+        for box, score, class_id in zip(detections["box"].tolist(), detections["score"].tolist(), detections["class_id"].tolist())
+    ]
+    if "track_id" in detections.dtype.names:
+        for row, track_id in zip(rows, detections["track_id"].tolist()):
+            row["track_id"] = track_id
+    return rows
+
+
+def box_iou(box, boxes):
+    """IoU of one [x1, y1, x2, y2] box against an (N, 4) array of boxes"""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / np.maximum(area + areas - intersection, 1e-9)
+
+
+def box_ios(box, boxes):
+    """Intersection over the smaller area of one box against an (N, 4) array of boxes, 1.0 when one holds the other"""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / np.maximum(np.minimum(area, areas), 1e-9)
+
+
+def nms(boxes, scores, class_ids=None, iou_threshold=0.5, match="iou"):
+    """
+    Greedy non maximum suppression, returns the indices to keep (highest score first).
+    With class ids the boxes are shifted apart per class, so only boxes of the same class suppress each other.
+    match "ios" compares the intersection with the smaller box: a part of an object cut by a tile border is
+    suppressed by the whole object, even though their IoU is low.
+    """
+    overlap = box_ios if match == "ios" else box_iou
+    boxes = np.asarray(boxes, dtype=np.float32)
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    if class_ids is not None:
+        offset = float(boxes.max()) + 1
+        boxes = boxes + (np.asarray(class_ids, dtype=np.float32) * offset)[:, None]
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    keep = []
+    while order.size:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        order = rest[overlap(boxes[best], boxes[rest]) <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def tile_grid(width, height, tile_size=600, overlap=0.2):
+    """
+    [x1, y1, x2, y2] pixel boxes (N, 4) of the tiles covering a `width` x `height` image, row by row.
+    Neighbouring tiles share `overlap` of the tile size, the last tile of a row / column ends on the image border,
+    so every tile has the full size (a side shorter than `tile_size` is covered by one tile of that length).
+    """
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        step = max(1, int(tile_size * (1 - overlap)))
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)
+        return positions
+
+    tile_width, tile_height = min(tile_size, width), min(tile_size, height)
+    xs, ys = np.meshgrid(starts(width), starts(height))
+    xs, ys = xs.reshape(-1), ys.reshape(-1)
+    return np.stack([xs, ys, xs + tile_width, ys + tile_height], axis=1).astype(np.int32)
+
 
 class OnnxDetect():
-    def __init__(self, save_dir=save_path, model_dir=models_dir):
+    def __init__(self, save_dir=save_path, model_dir=models_dir, registry=None, cache=None,
+            threshold=0.5, class_thresholds=None, allow_classes=None, deny_classes=None, nms_iou=None, reuse_buffers=True, reduced_decode=True):
         self.model_flag = False
-        self.sess = None
+        self.model_path = None
+        # single image runs go through a preallocated, IOBinding bound input
+        self.reuse_buffers = reuse_buffers
+        # large JPEGs are decoded at 1/2, 1/4 or 1/8 of their size when no annotated image is saved
+        self.reduced_decode = reduced_decode
+        self.buffers = None
+        self.buffer_lock = Lock()
+        self.resized_buf = np.empty((300, 300, 3), dtype=np.uint8)
+        self.registry = registry or default_registry
+        # optional ResultCache, a hit skips the inference (& the decode when nothing is drawn)
+        self.cache = cache
         self.save_dir = save_dir
+        # with a folder of inputs the annotated images mirror its sub folders in save_dir (same file names don't clash)
+        self.input_root = None
         self.model_dir = model_dir
+        self.set_filters(threshold, class_thresholds, allow_classes, deny_classes, nms_iou)
+
+    def set_filters(self, threshold=0.5, class_thresholds=None, allow_classes=None, deny_classes=None, nms_iou=None):
+        """
+        threshold: minimum score of a detection
+        class_thresholds: {class id or label: minimum score} overriding the threshold per class
+        allow_classes / deny_classes: class ids or labels to keep only / to drop
+        nms_iou: IoU above which overlapping boxes of the same class are suppressed, None to skip NMS
+        """
+        thresholds = np.full(max(coco_labels) + 1, threshold, dtype=np.float32)
+        for cls, cls_threshold in (class_thresholds or {}).items():
+            thresholds[class_id_of(cls)] = cls_threshold
+        if allow_classes:
+            allowed = np.zeros(len(thresholds), dtype=bool)
+            allowed[[class_id_of(cls) for cls in allow_classes]] = True
+            thresholds[~allowed] = np.inf
+        if deny_classes:
+            thresholds[[class_id_of(cls) for cls in deny_classes]] = np.inf
+        self.score_thresholds = thresholds
+        self.nms_iou = nms_iou
+
+    @property
+    def sess(self):
+        # fetched from the registry on every use, so an unloaded session gets loaded again
+        if self.model_path is None:
+            return None
+        try:
+            return self.registry.get(self.model_path)
+        except Exception as e:
+            print(f"Error loading model: {e}")
+            return None
 
     def start_detect_session(self, model_name="ssd_mobilenet_v1.onnx"):
         model_path = os.path.join(self.model_dir, model_name)
-        download_path = os.path.join(self.model_dir, "ssd_mobilenet_v1_10.onnx")
+        download_path = model_file_path("detect", self.model_dir)
         if os.path.exists(download_path):
             model_path = download_path
             self.model_flag = True
@@ -49,45 +199,102 @@ class OnnxDetect():
             model_path = download_path
             print(f"The onnx model: {model_path} does not exist! Downloading it now...")
             # try to download the file from github as a backup
-            downlaod_url = "https://github.com/onnx/models/raw/main/validated/vision/object_detection_segmentation/ssd-mobilenetv1/model/ssd_mobilenet_v1_10.onnx"
-            import requests
             try:
-                with requests.get(downlaod_url, stream=True) as req:
-                    req.raise_for_status()
-                    with open(download_path, 'wb') as f:
-                        for chunk in req.iter_content(chunk_size=8192):
-                            f.write(chunk)
+                fetch_model("detect", self.model_dir)
                 print(f"Onnx file downloaded successfully to: {download_path} 🎉")
                 self.model_flag = True
-            except requests.exceptions.RequestException as e:
+            except DownloadError as e:
                 print(f"Error downloading the onnx file: {e} 😞")
 
         if self.model_flag:
             try:
-                self.sess = InferenceSession(model_path)
+                # e.g. the INT8 model registered by `quantize_models.py`
+                self.model_path = selected_variant(model_path)
+                sess = self.registry.get(self.model_path)
                 # Get input and output names
-                self.input_name = self.sess.get_inputs()[0].name
-                self.output_names = [o.name for o in self.sess.get_outputs()]
+                self.input_name = sess.get_inputs()[0].name
+                self.output_names = [o.name for o in sess.get_outputs()]
+                self.buffers = None
                 return True
             except Exception as e:
                 print(f"Error loading model: {e}")
         return False
 
-    def run_detect(self, image_path, callback=None, caller=None):
-        final_result = {"status": False, "message": "Initial load", "caller": caller}
-        if self.sess is None:
-            final_result['message'] = "Onnx session was not initialized! Check if model has been downloaded."
-            return final_result
-        # Load and preprocess the image
-        image_filename = image_path.split("/")[-1]
-        op_img_path = os.path.join(self.save_dir, f"op-{image_filename}")
-        img = cv2.imread(image_path)
-        if img is None:
-            print(f"Error: Could not load image at {image_path}")
-            final_result['message'] = f"Error: Could not load image at {image_path}"
-            return final_result
-        original_height, original_width = img.shape[:2]
+    def preprocess_array(self, img):
+        # Resize to 300x300 for model input, keep as RGB uint8
+        img_resized = cv2.resize(img, (300, 300))
+        img_resized = cv2.cvtColor(img_resized, cv2.COLOR_BGR2RGB)  # Convert BGR to RGB
+        return img_resized
+
+    def make_buffers(self, sess):
+        # the number of detections varies, so onnxruntime allocates the outputs
+        batch_size = fixed_batch_size(sess) or 1
+        return IOBuffers(
+            {self.input_name: np.zeros((batch_size, 300, 300, 3), dtype=np.uint8)},
+            {name: None for name in self.output_names},
+        )
+
+    def detect_outputs(self, sess, img, timer=None):
+        """Raw model outputs (boxes, classes, scores, num_detections) of a single BGR image"""
+        if not self.reuse_buffers:
+            with stage(timer, "preprocess"):
+                # Add batch dimension: shape (1, 300, 300, 3), keep uint8
+                img_data = np.expand_dims(self.preprocess_array(img), axis=0).astype(np.uint8)
+            print(f"Input data shape: {img_data.shape}, type: {img_data.dtype}")
+            with stage(timer, "inference"):
+                return sess.run(self.output_names, {self.input_name: img_data})
+        with self.buffer_lock:
+            if self.buffers is None:
+                self.buffers = self.make_buffers(sess)
+            with stage(timer, "preprocess"):
+                # resize & convert straight into the first row of the bound input
+                cv2.resize(img, (300, 300), dst=self.resized_buf)
+                cv2.cvtColor(self.resized_buf, cv2.COLOR_BGR2RGB, dst=self.buffers.inputs[self.input_name][0])
+            with stage(timer, "inference"):
+                return self.buffers.run(sess)
+
+    def warm_up(self):
+        """Detects on a blank frame once: the session, its memory arena & the bound buffers are ready before the first real image"""
+        sess = self.sess
+        if sess is None:
+            return False
+        width, height = input_image_size("detect")
+        self.detect_outputs(sess, np.zeros((height, width, 3), dtype=np.uint8))
+        return True
 
+    def postprocess(self, detection_boxes, detection_classes, detection_scores, num_detections, original_width, original_height):
+        """
+        Outputs of a single image: boxes (100, 4) as [y1, x1, y2, x2] normalized [0,1],
+        classes (100,), scores (100,) & the number of valid detections.
+        Returns a structured array (DETECTION_DTYPE) with the boxes as [x1, y1, x2, y2] in pixels.
+        """
+        count = min(num_detections, len(detection_scores))
+        scores = detection_scores[:count].astype(np.float32)
+        class_ids = detection_classes[:count].astype(np.int32)
+        # per class thresholds & allow / deny lists are all folded into one lookup table
+        lookup = self.score_thresholds[np.clip(class_ids, 0, len(self.score_thresholds) - 1)]
+        keep = scores > lookup
+        boxes = detection_boxes[:count][keep]
+        detections = np.empty(int(keep.sum()), dtype=DETECTION_DTYPE)
+        # Scale boxes to original image size, [y1, x1, y2, x2] -> [x1, y1, x2, y2]
+        detections["box"] = boxes[:, [1, 0, 3, 2]] * np.array([original_width, original_height, original_width, original_height], dtype=np.float32)
+        detections["score"] = scores[keep]
+        detections["class_id"] = class_ids[keep]
+        if self.nms_iou is not None and len(detections) > 1:
+            detections = detections[nms(detections["box"], detections["score"], detections["class_id"], self.nms_iou)]
+        return detections
+
+    def read_image(self, image_path, save_output=False, preview_size=None):
+        """Returns (image, original (width, height)), the saved output keeps the full resolution"""
+        if save_output or not self.reduced_decode:
+            return decode_image(image_path)
+        # large enough for the model input & for the preview
+        target = max(300, preview_size or 0)
+        return decode_image(image_path, (target, target))
+
+    def draw_detections(self, img, detections, original_size=None):
+        # draws the structured detections (in `original_size` coordinates) on the given BGR image
+        original_width = img.shape[1]
         if original_width >= 4000:
             text_size = 2.0
             thickness = 4
@@ -96,10 +303,13 @@ class OnnxDetect():
             thickness = 3
         elif original_width >= 2500:
             text_size = 1.5
+            thickness = 3
         elif original_width >= 2000:
             text_size = 1.2
+            thickness = 2
         elif original_width >= 1500:
             text_size = 1.0
+            thickness = 2
         elif original_width >= 800:
             text_size = 0.8
             thickness = 2
@@ -107,20 +317,148 @@ class OnnxDetect():
             text_size = 0.5
             thickness = 1
 
-        # Resize to 300x300 for model input, keep as RGB uint8
-        img_resized = cv2.resize(img, (300, 300))
-        img_resized = cv2.cvtColor(img_resized, cv2.COLOR_BGR2RGB)  # Convert BGR to RGB
+        boxes = detections["box"]
+        if original_size is not None and original_size != (img.shape[1], img.shape[0]):
+            boxes = boxes * np.array([img.shape[1] / original_size[0], img.shape[0] / original_size[1]] * 2, dtype=np.float32)
+        boxes = boxes.astype(np.int32)
+        for (x1, y1, x2, y2), score, class_id in zip(boxes.tolist(), detections["score"].tolist(), detections["class_id"].tolist()):
+            label = coco_labels.get(class_id, 'unknown')
+            percent = int(score*100)
+            # Draw rectangle and label
+            cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            cv2.putText(img, f"{label}: {percent}%", (x1, y1 - 7), cv2.FONT_HERSHEY_SIMPLEX, text_size, (0, 255, 0), thickness)
+        return img
+
+    def draw_preview(self, img, detections, original_size=None, preview_size=None):
+        """Annotated copy of the image with its longer side downscaled to `preview_size` pixels"""
+        height, width = img.shape[:2]
+        scale = min(1.0, preview_size / max(width, height)) if preview_size else 1.0
+        if scale < 1.0:
+            preview = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+        else:
+            preview = img.copy()
+        return self.draw_detections(preview, detections, original_size or (width, height))
 
-        # Add batch dimension: shape (1, 300, 300, 3), keep uint8
-        img_data = np.expand_dims(img_resized, axis=0).astype(np.uint8)
-        print(f"Input data shape: {img_data.shape}, type: {img_data.dtype}")
+    def save_detections(self, source, detections, dest_path):
+        """
+        Writes the full resolution annotated image of a result to `dest_path`.
+        `source` is the image path (decoded again at full size) or the BGR frame itself.
+        """
+        if isinstance(source, str):
+            img = cv2.imread(source)
+            if img is None:
+                raise ValueError(f"Could not load image at {source}")
+        else:
+            img = source.copy()
+        if not cv2.imwrite(dest_path, self.draw_detections(img, detections)):
+            raise ValueError(f"Could not write the image to {dest_path}")
+        return dest_path
+
+    def output_path(self, image_path):
+        """Path of the annotated image of `image_path` in save_dir"""
+        folder = self.save_dir
+        if self.input_root:
+            folder = os.path.normpath(os.path.join(folder, os.path.relpath(os.path.dirname(image_path), self.input_root)))
+            os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, f"op-{os.path.basename(image_path)}")
+
+    def detection_result(self, img, image_path, detections, save_output, final_result, original_size=None, preview_size=None, source=None, timer=None):
+        final_result['detections'] = detections
+        final_result['status'] = True
+        if preview_size:
+            # delivered in memory, the annotated image is only written when the user downloads it
+            with stage(timer, "render"):
+                final_result['image'] = self.draw_preview(img, detections, original_size, preview_size)
+            final_result['source'] = source if source is not None else img
+            final_result['filename'] = f"op-{os.path.basename(image_path)}"
+        if save_output:
+            op_img_path = self.output_path(image_path)
+            with stage(timer, "render"):
+                # the frame kept as the source of the download must stay without boxes
+                annotated = self.draw_detections(img.copy() if final_result.get('source') is img else img, detections, original_size)
+            with stage(timer, "save"):
+                cv2.imwrite(op_img_path, annotated)
+            final_result['message'] = op_img_path
+        else:
+            final_result['message'] = f"{len(detections)} objects detected"
+        if timer is not None:
+            final_result['timings'] = timer.result()
+        return final_result
+
+    def cache_key(self, image_path, tiling=None):
+        if self.cache is None or self.model_path is None:
+            return None
+        params = {
+            "task": "detect",
+            "input_size": 300,
+            "reduced_decode": self.reduced_decode,
+            "thresholds": self.score_thresholds.tolist(),
+            "nms_iou": self.nms_iou,
+        }
+        if tiling:
+            # the tiled detections depend on the tile layout & the merge, not on the decode size
+            params["tiling"] = tiling
+            del params["reduced_decode"]
+        return self.cache.key(image_path, self.model_path, params)
+
+    def run_detect(self, image_path, callback=None, caller=None, save_output=True, preview_size=None):
+        timer = StageTimer("detect")
+        with stage(timer, "cache"):
+            cache_key = self.cache_key(image_path)
+            cached = self.cache.get(cache_key) if cache_key else None
+        if cached is not None and not save_output and not preview_size:
+            # nothing to draw, the cached detections are the whole result
+            final_result = {"status": False, "message": "Initial load", "caller": caller}
+            self.detection_result(None, image_path, cached["detections"], False, final_result, timer=timer)
+            if callback:
+                Clock.schedule_once(lambda dt: callback(final_result))
+                return
+            return final_result
+
+        # Load the image
+        with stage(timer, "decode"):
+            img, original_size = self.read_image(image_path, save_output, preview_size)
+        if img is None:
+            print(f"Error: Could not load image at {image_path}")
+            final_result = {"status": False, "message": "Initial load", "caller": caller, "detections": np.empty(0, dtype=DETECTION_DTYPE)}
+            final_result['message'] = f"Error: Could not load image at {image_path}"
+            final_result['timings'] = timer.result()
+            return final_result
+        if cached is not None:
+            final_result = {"status": False, "message": "Initial load", "caller": caller}
+            self.detection_result(img, image_path, cached["detections"], save_output, final_result, original_size, preview_size, image_path, timer)
+            if callback:
+                Clock.schedule_once(lambda dt: callback(final_result))
+                return
+            return final_result
+        return self.run_detect_array(img, image_path, callback, caller, save_output, original_size, preview_size, source=image_path, cache_key=cache_key, timer=timer)
+
+    def run_detect_array(self, img, image_path="frame.png", callback=None, caller=None, save_output=True,
+            original_size=None, preview_size=None, source=None, cache_key=None, timer=None):
+        """
+        Same as `run_detect` for an already decoded BGR image (e.g. a camera frame), `image_path` names the output.
+        `original_size` (width, height) is the size the boxes are scaled to when the image was decoded reduced.
+        With `preview_size` the result also carries the annotated `image` (longer side at most that many pixels),
+        the `source` to save the full resolution output from (the path, else the frame) & its `filename`.
+        The detections are stored in the result cache under `cache_key`, if one is given.
+        The result `timings` hold the ms of every stage, `timer` continues the one of `run_detect`.
+        """
+        timer = timer or StageTimer("detect")
+        final_result = {"status": False, "message": "Initial load", "caller": caller, "detections": np.empty(0, dtype=DETECTION_DTYPE)}
+        sess = self.sess
+        if sess is None:
+            final_result['message'] = "Onnx session was not initialized! Check if model has been downloaded."
+            final_result['timings'] = timer.result()
+            return final_result
+        original_width, original_height = original_size or (img.shape[1], img.shape[0])
 
         # Run inference
         try:
-            results = self.sess.run(self.output_names, {self.input_name: img_data})
+            results = self.detect_outputs(sess, img, timer)
         except Exception as e:
             print(f"Inference error: {e}")
             final_result['message'] = f"Inference error: {e}"
+            final_result['timings'] = timer.result()
             return final_result
 
         # Parse outputs
@@ -135,38 +473,184 @@ class OnnxDetect():
         else:
             print(f"Error: Unexpected num_detections shape {num_detections.shape}")
             final_result['message'] = f"Error: Unexpected num_detections shape {num_detections.shape}"
+            final_result['timings'] = timer.result()
             return final_result
 
-        # Prepare original image for drawing (convert to RGB then back to BGR for OpenCV)
-        output_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)  # Convert original image to RGB
-        output_img = cv2.cvtColor(output_img, cv2.COLOR_RGB2BGR)  # Convert back to BGR
-
         # Filter detections by score threshold and draw boxes on original image
-        threshold = 0.5
-        for i in range(min(num_detections, len(detection_scores))):
-            score = detection_scores[i]
-            if score > threshold:
-                class_id = int(detection_classes[i])
-                label = coco_labels.get(class_id, 'unknown')
-                box = detection_boxes[i]
-
-                # Scale boxes to original image size
-                y1 = int(box[0] * original_height)
-                x1 = int(box[1] * original_width)
-                y2 = int(box[2] * original_height)
-                x2 = int(box[3] * original_width)
-
-                percent = int(score*100)
-                # Draw rectangle and label
-                cv2.rectangle(output_img, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                cv2.putText(output_img, f"{label}: {percent}%", (x1, y1 - 7), cv2.FONT_HERSHEY_SIMPLEX, text_size, (0, 255, 0), thickness)
-
-        # Save or display
-        cv2.imwrite(op_img_path, output_img)
-        final_result['status'] = True
-        final_result['message'] = op_img_path
+        with stage(timer, "postprocess"):
+            detections = self.postprocess(detection_boxes, detection_classes, detection_scores, num_detections, original_width, original_height)
+        if cache_key and self.cache is not None:
+            with stage(timer, "cache"):
+                self.cache.put(cache_key, {"detections": detections})
+        self.detection_result(img, image_path, detections, save_output, final_result, original_size, preview_size, source, timer)
+
+        if callback:
+            Clock.schedule_once(lambda dt: callback(final_result))
+        else:
+            return final_result
+
+    def detect_tiles(self, sess, img, tiles, batch_size=8, workers=1):
+        """
+        Detections of the (N, 4) pixel boxes `tiles` of the image, in image coordinates. The tiles are cut as views,
+        resized straight into the batch, `batch_size` of them per `sess.run` & up to `workers` runs at once.
+        Returns (detections, one {"box", "preprocess_ms", "inference_ms", "postprocess_ms"} per tile), the
+        inference time of a batch is shared by its tiles.
+        """
+        def run_tiles(indices):
+            batch = np.empty((len(indices), 300, 300, 3), dtype=np.uint8)
+            resized = np.empty((300, 300, 3), dtype=np.uint8)
+            infos = []
+            for row, i in enumerate(indices):
+                start = time.perf_counter()
+                x1, y1, x2, y2 = tiles[i].tolist()
+                cv2.resize(img[y1:y2, x1:x2], (300, 300), dst=resized)
+                cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=batch[row])
+                infos.append({"box": [x1, y1, x2, y2], "preprocess_ms": (time.perf_counter() - start) * 1000})
+            start = time.perf_counter()
+            results = run_batched(sess, self.output_names, self.input_name, batch)
+            inference_ms = (time.perf_counter() - start) * 1000 / len(indices)
+            num_detections = results[3].reshape(-1)
+            parts = []
+            for row, info in enumerate(infos):
+                start = time.perf_counter()
+                x1, y1, x2, y2 = info["box"]
+                detections = self.postprocess(results[0][row], results[1][row], results[2][row], int(num_detections[row]), x2 - x1, y2 - y1)
+                detections["box"] += np.array([x1, y1, x1, y1], dtype=np.float32)
+                parts.append(detections)
+                info["inference_ms"] = inference_ms
+                info["postprocess_ms"] = (time.perf_counter() - start) * 1000
+            return parts, infos
+
+        batches = list(chunks(list(range(len(tiles))), batch_size))
+        if workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="detect-tiles") as executor:
+                outputs = list(executor.map(run_tiles, batches))
+        else:
+            outputs = [run_tiles(indices) for indices in batches]
+        parts = [part for batch_parts, _ in outputs for part in batch_parts]
+        infos = [{name: round(value, 3) if name != "box" else value for name, value in info.items()} for _, batch_infos in outputs for info in batch_infos]
+        detections = np.concatenate(parts) if parts else np.empty(0, dtype=DETECTION_DTYPE)
+        return detections, infos
+
+    def run_detect_tiled(self, image_path, callback=None, caller=None, save_output=True, preview_size=None,
+            tile_size=600, overlap=0.2, batch_size=8, workers=1, global_pass=True, merge_iou=0.5):
+        """
+        Same as `run_detect` on overlapping `tile_size` pixel tiles of the full resolution image, so the small
+        objects of a large photo are not lost in the 300x300 model input. With `global_pass` the whole image is
+        detected too (the objects larger than a tile). The boxes of all tiles are merged with a cross tile NMS,
+        matching by intersection over the smaller box above `merge_iou`.
+        The result also carries `tiles`: the box & the timings of every tile.
+        """
+        tiling = {"tile_size": tile_size, "overlap": overlap, "global_pass": global_pass, "merge_iou": merge_iou}
+        timer = StageTimer("detect")
+        final_result = {"status": False, "message": "Initial load", "caller": caller, "detections": np.empty(0, dtype=DETECTION_DTYPE), "tiles": []}
+        with stage(timer, "cache"):
+            cache_key = self.cache_key(image_path, tiling)
+            cached = self.cache.get(cache_key) if cache_key else None
+        if cached is not None and not save_output and not preview_size:
+            self.detection_result(None, image_path, cached["detections"], False, final_result, timer=timer)
+            if callback:
+                Clock.schedule_once(lambda dt: callback(final_result))
+                return
+            return final_result
+
+        # the tiles need the full resolution
+        with stage(timer, "decode"):
+            img, original_size = decode_image(image_path)
+        if img is None:
+            print(f"Error: Could not load image at {image_path}")
+            final_result['message'] = f"Error: Could not load image at {image_path}"
+            final_result['timings'] = timer.result()
+            return final_result
+        if cached is not None:
+            detections = cached["detections"]
+        else:
+            sess = self.sess
+            if sess is None:
+                final_result['message'] = "Onnx session was not initialized! Check if model has been downloaded."
+                final_result['timings'] = timer.result()
+                return final_result
+            try:
+                parts = []
+                if global_pass:
+                    results = self.detect_outputs(sess, img, timer)
+                    with stage(timer, "postprocess"):
+                        parts.append(self.postprocess(results[0][0], results[1][0], results[2][0], int(results[3].item()), *original_size))
+                tiles = tile_grid(original_size[0], original_size[1], tile_size, overlap)
+                with stage(timer, "tiles"):
+                    tile_detections, final_result["tiles"] = self.detect_tiles(sess, img, tiles, batch_size, workers)
+                parts.append(tile_detections)
+            except Exception as e:
+                print(f"Inference error: {e}")
+                final_result['message'] = f"Inference error: {e}"
+                final_result['timings'] = timer.result()
+                return final_result
+            with stage(timer, "merge"):
+                detections = np.concatenate(parts)
+                if len(detections) > 1:
+                    detections = detections[nms(detections["box"], detections["score"], detections["class_id"], merge_iou, match="ios")]
+            if cache_key and self.cache is not None:
+                with stage(timer, "cache"):
+                    self.cache.put(cache_key, {"detections": detections})
+        self.detection_result(img, image_path, detections, save_output, final_result, original_size, preview_size, image_path, timer)
 
         if callback:
             Clock.schedule_once(lambda dt: callback(final_result))
         else:
             return final_result
+
+    def run_detect_video(self, video_path, output_path=None, ndjson_path=None, stride=1, target_fps=None, queue_size=8, progress=None, tracker=None):
+        """
+        Detects the objects of a video file with separate decode, inference & encode threads, see `video_detect.py`.
+        Writes the annotated video to `output_path` & one line of detections per frame to `ndjson_path`, returns the stats.
+        With a `tracker.Tracker` the detector runs only when the tracker asks for it.
+        """
+        from video_detect import VideoDetector
+        return VideoDetector(self, stride, target_fps, queue_size, tracker).run(video_path, output_path, ndjson_path, progress)
+
+    def run_detect_batch(self, image_paths, batch_size=8, caller=None, save_output=False):
+        """
+        Detect objects on many images with one `sess.run` per `batch_size` images.
+        Returns one result dict (same as `run_detect`) per image path, in the same order.
+        """
+        final_results = [{"status": False, "message": "Initial load", "caller": caller, "detections": np.empty(0, dtype=DETECTION_DTYPE)} for _ in image_paths]
+        sess = self.sess
+        if sess is None:
+            for final_result in final_results:
+                final_result['message'] = "Onnx session was not initialized! Check if model has been downloaded."
+            return final_results
+
+        cache_keys = {}
+        for chunk in chunks(list(range(len(image_paths))), batch_size):
+            images = {}
+            tensors = []
+            for i in chunk:
+                cache_keys[i] = self.cache_key(image_paths[i])
+                cached = self.cache.get(cache_keys[i]) if cache_keys[i] and not save_output else None
+                if cached is not None:
+                    self.detection_result(None, image_paths[i], cached["detections"], False, final_results[i])
+                    continue
+                img, original_size = self.read_image(image_paths[i], save_output)
+                if img is None:
+                    final_results[i]['message'] = f"Error: Could not load image at {image_paths[i]}"
+                    continue
+                images[i] = (img, original_size)
+                tensors.append(self.preprocess_array(img))
+            if not tensors:
+                continue
+            try:
+                results = run_batched(sess, self.output_names, self.input_name, np.stack(tensors))
+            except Exception as e:
+                print(f"Inference error: {e}")
+                for i in images:
+                    final_results[i]['message'] = f"Inference error: {e}"
+                continue
+            num_detections = results[3].reshape(-1)
+            for row, (i, (img, original_size)) in enumerate(images.items()):
+                original_width, original_height = original_size
+                detections = self.postprocess(results[0][row], results[1][row], results[2][row], int(num_detections[row]), original_width, original_height)
+                if cache_keys[i] and self.cache is not None:
+                    self.cache.put(cache_keys[i], {"detections": detections})
+                self.detection_result(img, image_paths[i], detections, save_output, final_results[i], original_size)
+            images.clear()
+        return final_results
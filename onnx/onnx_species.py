@@ -1,9 +1,17 @@
 import cv2
 import numpy as np
-from onnxruntime import InferenceSession
 from kivy.clock import Clock
 
+from image_decode import decode_image
+from inference_utils import IOBuffers, chunks, fixed_batch_size, run_batched, static_shape
+from model_downloader import DownloadError
+from model_manifest import fetch_model, input_image_size, model_file_path, selected_variant
+from session_registry import default_registry
+from tracing import StageTimer, stage
+from taxonomy import TaxonomyIndex
+
 import os, sys
+from threading import Lock
 
 # Determine the base path for your application's resources
 if getattr(sys, 'frozen', False):
@@ -15,20 +23,46 @@ else:
 models_dir = os.path.join(base_path, "model_files")
 save_path = os.path.join(base_path, 'outputs')
 label_file_path = os.path.join(base_path, 'spicesNet_labels_v401a.txtset')
+blank_class = 2246 # the `blank` label, i.e. nothing on the image
 
 
 class OnnxSpecies():
-    def __init__(self, save_dir=save_path, model_dir=models_dir):
+    def __init__(self, save_dir=save_path, model_dir=models_dir, registry=None, cache=None, min_confidence=0.5, reuse_buffers=True, reduced_decode=True):
         self.model_flag = False
-        self.sess = None
+        self.model_path = None
+        # single image runs go through preallocated, IOBinding bound buffers
+        self.reuse_buffers = reuse_buffers
+        # large JPEGs are decoded at 1/2, 1/4 or 1/8 of their size when that still covers the input
+        self.reduced_decode = reduced_decode
+        self.buffers = None
+        self.buffer_lock = Lock()
+        self.resized_buf = np.empty((480, 480, 3), dtype=np.uint8)
+        self.rgb_buf = np.empty((480, 480, 3), dtype=np.uint8)
+        self.registry = registry or default_registry
+        # optional ResultCache, a hit skips the decode & the inference
+        self.cache = cache
         self.save_dir = save_dir
         self.model_dir = model_dir
         with open(label_file_path, 'r') as f:
             self.labels = [line.strip() for line in f.readlines()]
+        self.taxonomy = TaxonomyIndex(self.labels)
+        # below this the result falls back to the best supported genus / family / order / class
+        self.min_confidence = min_confidence
+
+    @property
+    def sess(self):
+        # fetched from the registry on every use, so an unloaded session gets loaded again
+        if self.model_path is None:
+            return None
+        try:
+            return self.registry.get(self.model_path)
+        except Exception as e:
+            print(f"Error loading model: {e}")
+            return None
 
     def start_species_session(self, model_name="spicesNet_v401a.onnx"):
         model_path = os.path.join(self.model_dir, model_name)
-        download_path = os.path.join(self.model_dir, "spicesNet_v401a.onnx")
+        download_path = model_file_path("species", self.model_dir)
         if os.path.exists(download_path):
             model_path = download_path
             self.model_flag = True
@@ -38,74 +72,225 @@ class OnnxSpecies():
             model_path = download_path
             print(f"The onnx model: {model_path} does not exist! Downloading it now...")
             # try to download the file from github as a backup
-            downlaod_url = "https://github.com/daslearning-org/vision-ai/releases/download/vOnnxModels/spicesNet_v401a.onnx"
-            import requests
             try:
-                with requests.get(downlaod_url, stream=True) as req:
-                    req.raise_for_status()
-                    with open(download_path, 'wb') as f:
-                        for chunk in req.iter_content(chunk_size=8192):
-                            f.write(chunk)
+                fetch_model("species", self.model_dir)
                 print(f"Onnx file downloaded successfully to: {download_path} 🎉")
                 self.model_flag = True
-            except requests.exceptions.RequestException as e:
+            except DownloadError as e:
                 print(f"Error downloading the onnx file: {e} 😞")
 
         if self.model_flag:
             try:
-                self.sess = InferenceSession(model_path)
+                # e.g. the INT8 model registered by `quantize_models.py`
+                self.model_path = selected_variant(model_path)
+                sess = self.registry.get(self.model_path)
                 # Get input and output names
-                self.input_name = self.sess.get_inputs()[0].name
-                #print(self.sess.get_inputs()[0].shape)
+                self.input_name = sess.get_inputs()[0].name
+                self.output_name = sess.get_outputs()[0].name
+                self.buffers = None
                 return True
             except Exception as e:
                 print(f"Error loading model: {e}")
         return False
 
-    def preprocess_image(self, image_path):
-        img = cv2.imread(image_path)
+    def preprocess_array(self, img):
         img = cv2.resize(img, (480, 480))
         img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         img = img.astype(np.float32) / 255.0
+        return img  # (480, 480, 3)
+
+    def preprocess_into(self, img, out):
+        """Same as `preprocess_array`, written into `out` (480, 480, 3) without temporary arrays"""
+        cv2.resize(img, (480, 480), dst=self.resized_buf)
+        cv2.cvtColor(self.resized_buf, cv2.COLOR_BGR2RGB, dst=self.rgb_buf)
+        np.divide(self.rgb_buf, np.float32(255.0), out=out)
+        return out
+
+    def make_buffers(self, sess):
+        batch_size = fixed_batch_size(sess) or 1
+        return IOBuffers(
+            {self.input_name: np.zeros((batch_size, 480, 480, 3), dtype=np.float32)},
+            {self.output_name: np.zeros(static_shape(sess.get_outputs()[0].shape, batch_size), dtype=np.float32)},
+        )
+
+    def read_image(self, image_path):
+        img, _ = decode_image(image_path, (480, 480) if self.reduced_decode else None)
+        if img is None:
+            raise ValueError(f"Could not load image at {image_path}")
+        return img
+
+    def preprocess_image(self, image_path):
+        img = self.preprocess_array(self.read_image(image_path))
         img = np.expand_dims(img, axis=0)  # (1, 480, 480, 3)
         return img
 
-    def postprocess_logits(self, logits, labels):
+    def softmax(self, logits):
         exp_logits = np.exp(logits - np.max(logits, axis=1, keepdims=True))
-        probabilities = exp_logits / np.sum(exp_logits, axis=1, keepdims=True)
-        predicted_class = np.argmax(probabilities, axis=1)[0]
-        confidence = probabilities[0, predicted_class]
-        return predicted_class, confidence, labels[predicted_class]
+        return exp_logits / np.sum(exp_logits, axis=1, keepdims=True)
+
+    def species_probabilities(self, sess, img, timer=None):
+        """Softmax probabilities (1, labels) of a single BGR image"""
+        if not self.reuse_buffers:
+            with stage(timer, "preprocess"):
+                img_data = np.expand_dims(self.preprocess_array(img), axis=0)
+            with stage(timer, "inference"):
+                outputs = sess.run([self.output_name], {self.input_name: img_data})
+            with stage(timer, "postprocess"):
+                return self.softmax(outputs[0])
+        with self.buffer_lock:
+            if self.buffers is None:
+                self.buffers = self.make_buffers(sess)
+            with stage(timer, "preprocess"):
+                # only the first row is used, the others are padding of a fixed batch model
+                self.preprocess_into(img, self.buffers.inputs[self.input_name][0])
+            with stage(timer, "inference"):
+                outputs = self.buffers.run(sess)
+            with stage(timer, "postprocess"):
+                return self.softmax(outputs[0][:1])
+
+    def species_crops(self, sess, crops, timer=None):
+        """Softmax probabilities (N, labels) of many BGR images (e.g. views of detected boxes) with one batched run"""
+        batch = np.empty((len(crops), 480, 480, 3), dtype=np.float32)
+        with stage(timer, "preprocess"):
+            # the crops are only copied by the resize into their row of the batch
+            with self.buffer_lock:
+                for row, crop in enumerate(crops):
+                    self.preprocess_into(crop, batch[row])
+        with stage(timer, "inference"):
+            outputs = run_batched(sess, [self.output_name], self.input_name, batch)
+        with stage(timer, "postprocess"):
+            return self.softmax(outputs[0])
+
+    def warm_up(self):
+        """Runs the species model once on a blank image to allocate its buffers ahead of the first request"""
+        sess = self.sess
+        if sess is None:
+            return False
+        width, height = input_image_size("species")
+        self.species_probabilities(sess, np.zeros((height, width, 3), dtype=np.uint8))
+        return True
+
+    def species_result(self, probabilities, best, final_result):
+        # probabilities of a single image (labels,) & its best supported rank from the taxonomy
+        predicted_class = int(np.argmax(probabilities))
+        confidence = float(probabilities[predicted_class])
+        species_name = self.taxonomy.display_name(predicted_class)
+        best_rank, best_group, best_score = best
+        prediction = {
+            "label": species_name,
+            "index": predicted_class,
+            "score": round(confidence, 4),
+            "taxonomy": self.taxonomy.taxonomy_path(predicted_class),
+            "best_rank": best_rank,
+            "best_label": self.taxonomy.group_name(best_rank, best_group),
+            "best_score": round(best_score, 4),
+        }
+        final_result["predictions"].append(prediction)
+
+        # create the return label
+        if predicted_class == blank_class:
+            label = "The image does not contain any object that falls into the list!"
+        else:
+            label = f"Species: [b][color=#2574f5]{species_name}[/color][/b] \n"
+            label = label + f"Confidence: [b][color=#2574f5]{confidence*100:.2f}% [/color][/b] \n"
+            if prediction["taxonomy"]:
+                label = label + f"Taxonomy: {' > '.join(prediction['taxonomy'])} \n"
+            if best_rank != "label":
+                label = label + f"Most likely {best_rank}: [b][color=#2574f5]{prediction['best_label']}[/color][/b] "
+                label = label + f"([b][color=#2574f5]{best_score*100:.2f}%[/color][/b])"
+        final_result["message"] = label.rstrip()
+        final_result["status"] = True
+        return final_result
+
+    def cache_key(self, image_path):
+        if self.cache is None or self.model_path is None:
+            return None
+        params = {"task": "species", "input_size": 480, "reduced_decode": self.reduced_decode, "min_confidence": self.min_confidence}
+        return self.cache.key(image_path, self.model_path, params)
+
+    def cache_result(self, cache_key, final_result):
+        if self.cache is not None and final_result["status"]:
+            self.cache.put(cache_key, {name: final_result[name] for name in ("status", "message", "predictions")})
 
     def run_species(self, image_path, callback=None, caller=None):
-        final_result = {"status": False, "message": "Initial load", "caller": caller}
-        if self.sess is None:
+        timer = StageTimer("species")
+        final_result = {"status": False, "message": "Initial load", "caller": caller, "predictions": []}
+        with stage(timer, "cache"):
+            cache_key = self.cache_key(image_path)
+            cached = self.cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            # same image, model & parameters as before
+            final_result.update(cached)
+            final_result["timings"] = timer.result()
+            if callback:
+                Clock.schedule_once(lambda dt: callback(final_result))
+                return
+            return final_result
+
+        sess = self.sess
+        if sess is None:
             final_result['message'] = "Onnx session was not initialized! Check if model has been downloaded."
+            final_result['timings'] = timer.result()
             return final_result
-        # Load and preprocess the image
-        image_filename = image_path.split("/")[-1]
 
         try:
-            img = self.preprocess_image(image_path)
-
             # run the classification
-            outputs = self.sess.run(None, {self.input_name: img})
-            predicted_class, confidence, predicted_label = self.postprocess_logits(outputs[0], self.labels)
-            confidence = confidence*100
-
-            # create the return label
-            if int(predicted_class) == 2246:
-                label = "The image does not contain any object that falls into the list!"
-            else:
-                label = f"Species: [b][color=#2574f5]{predicted_label[37:]}[/color][/b] \n"
-                label = label + f"Confidence: [b][color=#2574f5]{confidence:.2f}% [/color][/b]"
-            final_result["message"] = label
-            final_result["status"] = True
+            with stage(timer, "decode"):
+                img = self.read_image(image_path)
+            probabilities = self.species_probabilities(sess, img, timer)
+            with stage(timer, "postprocess"):
+                best = self.taxonomy.best_supported(probabilities, self.min_confidence)
+                self.species_result(probabilities[0], best[0], final_result)
+            with stage(timer, "cache"):
+                self.cache_result(cache_key, final_result)
         except Exception as e:
             print(f"Classification error: {e}")
             final_result["message"] = f"Classification error: {e}"
 
+        final_result["timings"] = timer.result()
         if callback:
             Clock.schedule_once(lambda dt: callback(final_result))
         else:
             return final_result
+
+    def run_species_batch(self, image_paths, batch_size=8, caller=None):
+        """
+        Identify the species on many images with one `sess.run` per `batch_size` images.
+        Returns one result dict (same as `run_species`) per image path, in the same order.
+        """
+        final_results = [{"status": False, "message": "Initial load", "caller": caller, "predictions": []} for _ in image_paths]
+        sess = self.sess
+        if sess is None:
+            for final_result in final_results:
+                final_result['message'] = "Onnx session was not initialized! Check if model has been downloaded."
+            return final_results
+
+        cache_keys = {}
+        for chunk in chunks(list(range(len(image_paths))), batch_size):
+            tensors = []
+            loaded = []
+            for i in chunk:
+                cache_keys[i] = self.cache_key(image_paths[i])
+                cached = self.cache.get(cache_keys[i]) if cache_keys[i] else None
+                if cached is not None:
+                    final_results[i].update(cached)
+                    continue
+                try:
+                    tensors.append(self.preprocess_array(self.read_image(image_paths[i])))
+                    loaded.append(i)
+                except Exception as e:
+                    final_results[i]["message"] = f"Classification error: {e}"
+            if not loaded:
+                continue
+            try:
+                outputs = run_batched(sess, None, self.input_name, np.stack(tensors))
+                probabilities = self.softmax(outputs[0])
+                best = self.taxonomy.best_supported(probabilities, self.min_confidence)
+                for row, i in enumerate(loaded):
+                    self.species_result(probabilities[row], best[row], final_results[i])
+                    self.cache_result(cache_keys[i], final_results[i])
+            except Exception as e:
+                print(f"Classification error: {e}")
+                for i in loaded:
+                    final_results[i]["message"] = f"Classification error: {e}"
+        return final_results
@@ -0,0 +1,253 @@
+"""
+Builds INT8 variants of the models with `onnxruntime.quantization` & compares them with the FP32 model.
+
+Run it from the `onnx` folder, for example:
+    python quantize_models.py classify species --model-dir model_files --images /path/to/photos --select auto
+
+For every model:
+- dynamic: the weights are stored as INT8, the activations are quantized at run time
+- static: weights & activations are INT8 (QDQ format), the activation ranges are calibrated on
+  `--calib-count` images of the folder, pre-processed exactly like the app does
+Both variants are written next to the model (`<name>.int8-dynamic.onnx`, `<name>.int8-static.onnx`) and
+compared with the FP32 model on `--eval-count` other images of the folder: file size, session load time,
+median latency & how often the top-1 / top-5 results agree with the FP32 ones.
+With `--select` the chosen variant is registered in `model_variants.json`, the `Onnx*` classes load it
+instead of the FP32 file from then on (`--select fp32` goes back to the original model).
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import onnxruntime as ort
+from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from batch import TASKS, find_images
+from image_decode import decode_image
+from model_manifest import MODELS, model_file_path, register_variant, unregister_variant
+
+MODES = ["dynamic", "static"]
+SELECT_CHOICES = ["auto", "fp32"] + MODES
+
+
+def variant_path(model_path, mode):
+    stem, ext = os.path.splitext(model_path)
+    return f"{stem}.int8-{mode}{ext}"
+
+
+def model_input(engine, task, img):
+    """The model input of one BGR image, the same pre-processing as the app"""
+    tensor = engine.preprocess_array(img)
+    return np.expand_dims(tensor, axis=0).astype(np.uint8 if task == "detect" else np.float32)
+
+
+class ImageReader(CalibrationDataReader):
+    """Feeds the calibration images one by one to `quantize_static`"""
+    def __init__(self, engine, task, images):
+        self.engine = engine
+        self.task = task
+        self.images = iter(images)
+
+    def get_next(self):
+        img = next(self.images, None)
+        if img is None:
+            return None
+        return {self.engine.input_name: model_input(self.engine, self.task, img)}
+
+
+def load_engine(task, model_dir):
+    module_name, class_name, starter, _ = TASKS[task]
+    module = __import__(module_name)
+    # the variants have the same inputs & outputs, so the bound buffers of the engine serve all of them
+    engine = getattr(module, class_name)(model_dir=model_dir, save_dir=model_dir)
+    if not getattr(engine, starter)():
+        raise RuntimeError(f"Could not start the {task} session from: {model_dir}")
+    return engine
+
+
+def read_images(image_paths):
+    images = []
+    for path in image_paths:
+        img, _ = decode_image(path)
+        if img is None:
+            print(f"Skipping {path}: the image could not be read")
+            continue
+        images.append(img)
+    return images
+
+
+def quantize(task, model_path, mode, calib_images=None, engine=None):
+    """Writes the INT8 variant of the model, returns its path"""
+    out_path = variant_path(model_path, mode)
+    prep_path = f"{os.path.splitext(model_path)[0]}.prep.onnx"
+    try:
+        # shape inference & graph optimization first, the quantizer finds more nodes to quantize
+        quant_pre_process(model_path, prep_path, skip_symbolic_shape=True)
+        source = prep_path
+    except Exception as e:
+        print(f"Pre-processing failed, quantizing the original graph: {e}")
+        source = model_path
+    try:
+        if mode == "dynamic":
+            quantize_dynamic(source, out_path, weight_type=QuantType.QUInt8)
+        else:
+            quantize_static(
+                source,
+                out_path,
+                ImageReader(engine, task, calib_images),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True,
+                calibrate_method=CalibrationMethod.MinMax,
+            )
+    finally:
+        if os.path.exists(prep_path):
+            os.remove(prep_path)
+    return out_path
+
+
+def top_labels(engine, task, sess, img, k=5):
+    """Best `k` labels (class ids) of one image, highest score first"""
+    if task == "detect":
+        boxes, classes, scores, num = engine.detect_outputs(sess, img)
+        count = int(num[0])
+        order = np.argsort(scores[0][:count])[::-1]
+        return [int(cls) for cls in classes[0][:count][order][:k]]
+    if task == "classify":
+        probabilities = engine.classify_probabilities(sess, img)[0]
+    else:
+        probabilities = engine.species_probabilities(sess, img)[0]
+    return [int(idx) for idx in np.argsort(probabilities)[::-1][:k]]
+
+
+def evaluate(engine, task, path, images, reference=None, warmup=2):
+    """Size, load time, median latency & labels of a model file, agreement with the `reference` labels"""
+    start = time.perf_counter()
+    sess = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    load_ms = (time.perf_counter() - start) * 1000
+    for img in images[:warmup]:
+        top_labels(engine, task, sess, img)
+    latencies = []
+    labels = []
+    for img in images:
+        start = time.perf_counter()
+        labels.append(top_labels(engine, task, sess, img))
+        latencies.append((time.perf_counter() - start) * 1000)
+    result = {
+        "file": os.path.basename(path),
+        "size_mb": round(os.path.getsize(path) / (1024 * 1024), 2),
+        "load_ms": round(load_ms, 1),
+        "latency_ms": round(float(np.median(latencies)), 2) if latencies else None,
+        "labels": labels,
+    }
+    if reference is not None:
+        pairs = [(ref, got) for ref, got in zip(reference, labels) if ref]
+        # top-1: same best label, top-5: the FP32 best label is among the 5 best of the variant
+        result["top1"] = round(sum(got[:1] == ref[:1] for ref, got in pairs) / len(pairs), 4) if pairs else None
+        result["top5"] = round(sum(ref[0] in got for ref, got in pairs) / len(pairs), 4) if pairs else None
+    return result
+
+
+def pick_variant(results, min_top1):
+    """Fastest variant which agrees with FP32 at least `min_top1` of the time, None to keep FP32"""
+    good = [item for item in results[1:] if item.get("top1") is not None and item["top1"] >= min_top1]
+    if not good:
+        return None
+    return min(good, key=lambda item: (item["latency_ms"], item["size_mb"]))
+
+
+def print_table(results):
+    print(f"  {'variant':<40} {'size MB':>8} {'load ms':>8} {'latency ms':>11} {'top-1':>6} {'top-5':>6}")
+    for item in results:
+        top1 = "-" if item.get("top1") is None else f"{item['top1']:.3f}"
+        top5 = "-" if item.get("top5") is None else f"{item['top5']:.3f}"
+        print(f"  {item['file']:<40} {item['size_mb']:>8} {item['load_ms']:>8} {item['latency_ms']:>11} {top1:>6} {top5:>6}")
+
+
+def process_model(task, model_dir, image_paths, modes, calib_count, eval_count, select, min_top1):
+    model_path = model_file_path(task, model_dir)
+    if not os.path.exists(model_path):
+        print(f"Skipping {task}: {model_path} is not downloaded")
+        return None
+    engine = load_engine(task, model_dir)
+    calib_paths = image_paths[:calib_count]
+    # evaluate on other images than the calibration ones when the folder has enough of them
+    eval_paths = image_paths[calib_count:calib_count + eval_count] or image_paths[:eval_count]
+    calib_images = read_images(calib_paths)
+    eval_images = read_images(eval_paths)
+
+    print(f"{MODELS[task]['name']}: calibrating on {len(calib_images)}, evaluating on {len(eval_images)} images")
+    reference = evaluate(engine, task, model_path, eval_images)
+    results = [reference]
+    for mode in modes:
+        if mode == "static" and not calib_images:
+            print("  static: no calibration images, skipped")
+            continue
+        try:
+            start = time.perf_counter()
+            path = quantize(task, model_path, mode, calib_images, engine)
+            print(f"  {mode}: written {os.path.basename(path)} in {time.perf_counter() - start:.1f} s")
+            item = evaluate(engine, task, path, eval_images, reference["labels"])
+            item["mode"] = mode
+            results.append(item)
+        except Exception as e:
+            print(f"  {mode}: quantization failed: {e}")
+    print_table(results)
+
+    chosen = None
+    if select == "auto":
+        chosen = pick_variant(results, min_top1)
+        if chosen is None:
+            print(f"  no variant reaches a top-1 agreement of {min_top1}, keeping FP32")
+    elif select in MODES:
+        chosen = next((item for item in results[1:] if item["mode"] == select), None)
+        if chosen is None:
+            print(f"  the {select} variant could not be built, keeping the current selection")
+            return results
+    if select == "fp32" or (select == "auto" and chosen is None):
+        unregister_variant(model_path)
+        print(f"  {task} uses the FP32 model")
+    elif chosen is not None:
+        info = {name: chosen[name] for name in ("mode", "size_mb", "latency_ms", "top1", "top5")}
+        info["fp32_latency_ms"] = reference["latency_ms"]
+        info["fp32_size_mb"] = reference["size_mb"]
+        info["onnxruntime"] = ort.__version__
+        register_variant(model_path, os.path.join(model_dir, chosen["file"]), info)
+        print(f"  {task} uses {chosen['file']} from now on")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="INT8 quantization of the models with an accuracy & speed comparison")
+    parser.add_argument("tasks", nargs="*", help=f"models to quantize (default: all of {', '.join(MODELS)})")
+    parser.add_argument("--model-dir", default="model_files", help="folder with the onnx models")
+    parser.add_argument("--images", required=True, help="folder of sample images for the calibration & the comparison")
+    parser.add_argument("--modes", nargs="+", default=MODES, help=f"variants to build, of: {', '.join(MODES)}")
+    parser.add_argument("--calib-count", type=int, default=64, help="calibration images for the static variant")
+    parser.add_argument("--eval-count", type=int, default=100, help="images compared with the FP32 model")
+    parser.add_argument("--select", default=None, help=f"register a variant: {', '.join(SELECT_CHOICES)} (default: only report)")
+    parser.add_argument("--min-top1", type=float, default=0.95, help="top-1 agreement needed by `--select auto`")
+    args = parser.parse_args(argv)
+    tasks = args.tasks or list(MODELS)
+    for name in tasks:
+        if name not in MODELS:
+            parser.error(f"unknown model `{name}`, use: {', '.join(MODELS)}")
+    for mode in args.modes:
+        if mode not in MODES:
+            parser.error(f"unknown mode `{mode}`, use: {', '.join(MODES)}")
+    if args.select is not None and args.select not in SELECT_CHOICES:
+        parser.error(f"unknown selection `{args.select}`, use: {', '.join(SELECT_CHOICES)}")
+
+    image_paths = list(find_images(args.images))
+    if not image_paths:
+        parser.error(f"no images found in {args.images}")
+    for task in tasks:
+        process_model(task, args.model_dir, image_paths, args.modes, args.calib_count, args.eval_count, args.select, args.min_top1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import io
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from threading import Lock
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    fields TEXT NOT NULL,
+    arrays BLOB,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+"""
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache():
+    """
+    Persistent cache of the model results in a SQLite file, keyed by the content of the image,
+    the model file & the parameters which change the result (input size, thresholds ...).
+    Result values which are numpy arrays (e.g. the detections) are stored as `npz`, the rest as json.
+    The least recently used results are evicted above `max_entries`.
+    A broken cache never fails the inference: errors are printed & counted, the lookup is a miss.
+    """
+    def __init__(self, db_path, max_entries=20000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.lock = Lock()
+        # shared by the worker threads, every use holds the lock
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL") # batch worker processes share the file
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.entries = self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        self.model_hashes = {} # path: (size, mtime_ns, sha256)
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "errors": 0}
+
+    def error(self, e):
+        print(f"Result cache error: {e}")
+        with self.lock:
+            self.counters["errors"] += 1
+
+    def model_hash(self, model_path):
+        """Hash of a model file, computed again only when its size or modification time changes"""
+        model_path = os.path.abspath(model_path)
+        stat = os.stat(model_path)
+        cached = self.model_hashes.get(model_path)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime_ns, sha256 FROM file_hashes WHERE path = ?", (model_path,)).fetchone()
+        if row and tuple(row[:2]) == (stat.st_size, stat.st_mtime_ns):
+            sha256 = row[2]
+        else:
+            sha256 = file_sha256(model_path)
+            with self.lock:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                    (model_path, stat.st_size, stat.st_mtime_ns, sha256),
+                )
+                self.conn.commit()
+        self.model_hashes[model_path] = (stat.st_size, stat.st_mtime_ns, sha256)
+        return sha256
+
+    def key(self, image_path, model_path, params):
+        """Cache key of an image, None when the image can't be read (the engine reports that error)"""
+        try:
+            image_hash = file_sha256(image_path)
+        except OSError:
+            return None
+        try:
+            model_hash = self.model_hash(model_path)
+        except (OSError, sqlite3.Error) as e:
+            self.error(e)
+            return None
+        params = json.dumps(params, sort_keys=True)
+        return hashlib.sha256(f"{image_hash}:{model_hash}:{params}".encode()).hexdigest()
+
+    def get(self, key):
+        """The stored result dict or None"""
+        if key is None:
+            return None
+        try:
+            with self.lock:
+                row = self.conn.execute("SELECT fields, arrays FROM results WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.counters["misses"] += 1
+                    return None
+                self.counters["hits"] += 1
+                self.conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.conn.commit()
+            result = json.loads(row[0])
+            if row[1] is not None:
+                with np.load(io.BytesIO(row[1]), allow_pickle=False) as arrays:
+                    result.update({name: arrays[name] for name in arrays.files})
+            return result
+        except (sqlite3.Error, ValueError, OSError) as e:
+            self.error(e)
+            return None
+
+    def put(self, key, result):
+        if key is None:
+            return
+        fields = {name: value for name, value in result.items() if not isinstance(value, np.ndarray)}
+        arrays = {name: value for name, value in result.items() if isinstance(value, np.ndarray)}
+        try:
+            blob = None
+            if arrays:
+                buffer = io.BytesIO()
+                np.savez(buffer, **arrays)
+                blob = buffer.getvalue()
+            values = (json.dumps(fields), blob, time.time(), key)
+            with self.lock:
+                inserted = self.conn.execute(
+                    "INSERT OR IGNORE INTO results (fields, arrays, last_used, key) VALUES (?, ?, ?, ?)", values,
+                ).rowcount
+                if not inserted:
+                    # a new result for a known key (e.g. two workers on the same image) is not a new entry
+                    self.conn.execute("UPDATE results SET fields = ?, arrays = ?, last_used = ? WHERE key = ?", values)
+                self.conn.commit()
+                self.counters["stores"] += 1
+                self.entries += inserted
+                if self.entries > self.max_entries:
+                    self.evict()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self.error(e)
+
+    def evict(self):
+        # called with the lock held, the count is exact again afterwards (other processes may write too)
+        self.entries = self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        excess = self.entries - self.max_entries
+        if excess <= 0:
+            return
+        # make some room at once instead of evicting on every store
+        excess += self.max_entries // 10
+        deleted = self.conn.execute(
+            "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used LIMIT ?)",
+            (excess,),
+        ).rowcount
+        self.conn.commit()
+        self.counters["evictions"] += deleted
+        self.entries -= deleted
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM results")
+            self.conn.commit()
+            self.entries = 0
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["entries"] = self.entries
+            stats["max_entries"] = self.max_entries
+        return stats
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -21,8 +21,16 @@ Builder.load_string('''
         #    resolution: (640, 480)
         #    play: False
 
+    MDLabel: # live detection counters
+        id: live_stats
+        text: ""
+        halign: "center"
+        font_style: "Caption"
+        size_hint_y: None
+        height: dp(18)
+
     MDGridLayout: # buttons
-        cols: 2
+        cols: 3
         size_hint_y: 0.1
         spacing: dp(4)
         padding: 14, 0, 14, 0 # left, top, right, bottom
@@ -34,9 +42,19 @@ Builder.load_string('''
             font_size: sp(18)
             md_bg_color: 'orange'
             pos_hint: {"center_x": .5, "center_y": .5}
-            size_hint_x: 0.7
+            size_hint_x: 0.5
             on_release: app.capture_n_onnx_detect()
 
+        MDFillRoundFlatIconButton:
+            id: btn_live
+            text: "Live"
+            icon: "play"
+            font_size: sp(18)
+            md_bg_color: '#2574f5'
+            pos_hint: {"center_x": .5, "center_y": .5}
+            size_hint_x: 0.2
+            on_release: app.toggle_live_detect()
+
         MDFillRoundFlatIconButton:
             id: btn_reset_cam
             text: "Reset"
@@ -34,6 +34,16 @@ Builder.load_string('''
                         on_release: app.show_delete_alert()
                         IconLeftWidget:
                             icon: "broom"
+                    OneLineIconListItem:
+                        text: "Download & prepare all models"
+                        on_release: app.prefetch_models()
+                        IconLeftWidget:
+                            icon: "download-multiple"
+                    OneLineIconListItem:
+                        text: "Clear cached results"
+                        on_release: app.clear_result_cache()
+                        IconLeftWidget:
+                            icon: "database-remove"
                     OneLineAvatarIconListItem:
                         text: "Preview in Image Selection!"
                         IconLeftWidget:
@@ -44,6 +54,26 @@ Builder.load_string('''
                             on_release: app.img_preview_on()
                             theme_text_color: "Custom"
                             text_color: "gray"
+                    OneLineAvatarIconListItem:
+                        text: "Tiled detection for large photos"
+                        IconLeftWidget:
+                            icon: "grid"
+                        IconRightWidget:
+                            id: tiled_detect_switch
+                            icon: "toggle-switch-off"
+                            on_release: app.tiled_detect_on()
+                            theme_text_color: "Custom"
+                            text_color: "gray"
+                    OneLineAvatarIconListItem:
+                        text: "Save raw camera captures"
+                        IconLeftWidget:
+                            icon: "camera-burst"
+                        IconRightWidget:
+                            id: cam_save_switch
+                            icon: "toggle-switch-off"
+                            on_release: app.cam_save_on()
+                            theme_text_color: "Custom"
+                            text_color: "gray"
 
         AccordionItem:
             title: "Help & Support"
@@ -0,0 +1,159 @@
+import os
+import time
+from threading import Lock, Thread, Event
+from collections import OrderedDict
+
+from onnxruntime import InferenceSession
+
+from model_cache import cached_session, copy_options
+from session_tuner import load_session_options
+
+
+class SessionRegistry():
+    """
+    Keeps the onnx sessions of all the models in one place.
+    Sessions are loaded on the first request, the least recently used ones are unloaded when the
+    memory budget is exceeded & the ones nobody used for `idle_timeout` seconds are unloaded by a
+    background thread. The next request transparently loads the model again.
+    With `optimized_cache` the sessions are created from the optimized models of `model_cache.py`.
+    `max_threads` caps the intra op threads of every session, e.g. for several processes sharing the cores.
+    """
+    def __init__(self, memory_budget_mb=512, idle_timeout=600, memory_factor=1.5, check_interval=30, optimized_cache=True, max_threads=None):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.idle_timeout = idle_timeout
+        self.memory_factor = memory_factor # session memory is roughly the model file size times this
+        self.check_interval = check_interval
+        self.optimized_cache = optimized_cache
+        self.max_threads = max_threads
+        self.load_times = {} # model file: {"load_ms", "source"} of its last load
+        self.sessions = OrderedDict() # model_path: {"sess", "size", "last_used"}, least recently used first
+        self.lock = Lock()
+        self.load_locks = {}
+        self.counters = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0, "idle_unloads": 0, "load_errors": 0}
+        self.idle_thread = None
+        self.stop_event = Event()
+
+    def configure(self, memory_budget_mb=None, idle_timeout=None):
+        with self.lock:
+            if memory_budget_mb is not None:
+                self.memory_budget = memory_budget_mb * 1024 * 1024
+            if idle_timeout is not None:
+                self.idle_timeout = idle_timeout
+        self.evict()
+
+    def estimate_size(self, model_path):
+        return int(os.path.getsize(model_path) * self.memory_factor)
+
+    def memory_used(self):
+        with self.lock:
+            return sum(entry["size"] for entry in self.sessions.values())
+
+    def session_options(self, model_path):
+        """The tuned options of this host (if `session_tuner.py` was run for the model) within `max_threads`"""
+        options = load_session_options(model_path)
+        if self.max_threads:
+            options = copy_options(options)
+            # 0 is onnxruntime's default, one thread per core
+            if not 0 < options.intra_op_num_threads <= self.max_threads:
+                options.intra_op_num_threads = self.max_threads
+        return options
+
+    def get(self, model_path, create_session=None):
+        """Returns the session of the model, loading it when it is not resident"""
+        model_path = os.path.abspath(model_path)
+        with self.lock:
+            entry = self.sessions.get(model_path)
+            if entry is not None:
+                self.counters["hits"] += 1
+                entry["last_used"] = time.monotonic()
+                self.sessions.move_to_end(model_path)
+                return entry["sess"]
+            self.counters["misses"] += 1
+            load_lock = self.load_locks.setdefault(model_path, Lock())
+
+        # load outside of the main lock, so other models stay available meanwhile
+        with load_lock:
+            with self.lock:
+                entry = self.sessions.get(model_path)
+                if entry is not None:
+                    # loaded by another thread while we were waiting
+                    entry["last_used"] = time.monotonic()
+                    self.sessions.move_to_end(model_path)
+                    return entry["sess"]
+            size = self.estimate_size(model_path)
+            self.evict(needed=size)
+            load_stats = {"source": "model"}
+            start = time.perf_counter()
+            try:
+                if create_session:
+                    sess = create_session(model_path)
+                elif self.optimized_cache:
+                    sess = cached_session(model_path, self.session_options(model_path), stats=load_stats)
+                else:
+                    sess = InferenceSession(model_path, sess_options=self.session_options(model_path))
+            except Exception:
+                with self.lock:
+                    self.counters["load_errors"] += 1
+                raise
+            load_stats["load_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            print(f"Onnx session of {os.path.basename(model_path)} created in {load_stats['load_ms']} ms, source: {load_stats['source']}")
+            with self.lock:
+                self.sessions[model_path] = {"sess": sess, "size": size, "last_used": time.monotonic()}
+                self.load_times[os.path.basename(model_path)] = load_stats
+                self.counters["loads"] += 1
+            self.start_idle_thread()
+            return sess
+
+    def evict(self, needed=0):
+        """Unload the least recently used sessions until `needed` more bytes fit in the budget"""
+        with self.lock:
+            used = sum(entry["size"] for entry in self.sessions.values())
+            for model_path in list(self.sessions.keys()):
+                if used + needed <= self.memory_budget:
+                    break
+                used -= self.sessions.pop(model_path)["size"]
+                self.counters["evictions"] += 1
+                print(f"Unloaded onnx session to stay in memory budget: {os.path.basename(model_path)}")
+
+    def unload(self, model_path):
+        with self.lock:
+            return self.sessions.pop(os.path.abspath(model_path), None) is not None
+
+    def unload_idle(self):
+        if not self.idle_timeout:
+            return
+        now = time.monotonic()
+        with self.lock:
+            for model_path, entry in list(self.sessions.items()):
+                if now - entry["last_used"] >= self.idle_timeout:
+                    del self.sessions[model_path]
+                    self.counters["idle_unloads"] += 1
+                    print(f"Unloaded idle onnx session: {os.path.basename(model_path)}")
+
+    def idle_loop(self):
+        while not self.stop_event.wait(self.check_interval):
+            self.unload_idle()
+
+    def start_idle_thread(self):
+        if self.idle_thread is None or not self.idle_thread.is_alive():
+            self.stop_event.clear()
+            self.idle_thread = Thread(target=self.idle_loop, daemon=True)
+            self.idle_thread.start()
+
+    def clear(self):
+        self.stop_event.set()
+        with self.lock:
+            self.sessions.clear()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["resident"] = [os.path.basename(path) for path in self.sessions]
+            stats["memory_used_mb"] = round(sum(entry["size"] for entry in self.sessions.values()) / (1024 * 1024), 1)
+            stats["memory_budget_mb"] = round(self.memory_budget / (1024 * 1024), 1)
+            stats["load_times"] = dict(self.load_times)
+        return stats
+
+
+# shared by all the Onnx* classes
+default_registry = SessionRegistry()
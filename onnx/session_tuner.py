@@ -0,0 +1,200 @@
+"""
+Finds the fastest onnxruntime SessionOptions for each model on this machine.
+
+Run it from the `onnx` folder, for example:
+    python session_tuner.py model_files/ssd_mobilenet_v1_10.onnx model_files/resnet18-v1-7.onnx
+
+Every model is benchmarked over a grid of intra / inter op threads, execution mode & graph
+optimization level with synthetic inputs. The fastest setting is saved per host & per model
+to `session_profile.json` next to the model files & gets applied whenever a session is created.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+from itertools import product
+
+import numpy as np
+import onnxruntime as ort
+
+PROFILE_FILE = "session_profile.json"
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+OPTIMIZATION_LEVELS = {
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+ORT_DTYPES = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(double)": np.float64,
+    "tensor(uint8)": np.uint8,
+    "tensor(int8)": np.int8,
+    "tensor(int32)": np.int32,
+    "tensor(int64)": np.int64,
+    "tensor(bool)": np.bool_,
+}
+
+
+def host_key():
+    return f"{socket.gethostname()}-{platform.machine()}-{os.cpu_count()}cpu"
+
+
+def model_key(model_path):
+    # the size tells a re-downloaded or quantized file with the same name apart
+    return f"{os.path.basename(model_path)}:{os.path.getsize(model_path)}"
+
+
+def profile_path(model_path):
+    return os.path.join(os.path.dirname(os.path.abspath(model_path)), PROFILE_FILE)
+
+
+def synthetic_inputs(sess, batch_size=1, default_dim=300):
+    """Random inputs matching the model input spec, unknown dims use `batch_size` / `default_dim`"""
+    rng = np.random.default_rng(0)
+    feeds = {}
+    for model_input in sess.get_inputs():
+        shape = []
+        for i, dim in enumerate(model_input.shape):
+            if isinstance(dim, int) and dim > 0:
+                shape.append(dim)
+            else:
+                shape.append(batch_size if i == 0 else default_dim)
+        dtype = ORT_DTYPES.get(model_input.type, np.float32)
+        if np.issubdtype(dtype, np.integer):
+            feeds[model_input.name] = rng.integers(0, 255, size=shape).astype(dtype)
+        else:
+            feeds[model_input.name] = rng.random(shape, dtype=np.float32).astype(dtype)
+    return feeds
+
+
+def build_options(config):
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = config["intra_op_num_threads"]
+    options.inter_op_num_threads = config["inter_op_num_threads"]
+    options.execution_mode = EXECUTION_MODES[config["execution_mode"]]
+    options.graph_optimization_level = OPTIMIZATION_LEVELS[config["graph_optimization_level"]]
+    return options
+
+
+def config_grid(max_threads=None):
+    max_threads = max_threads or os.cpu_count() or 1
+    threads = sorted({1, max_threads} | {2 ** i for i in range(1, 8) if 2 ** i < max_threads})
+    grid = []
+    for intra, mode, level in product(threads, EXECUTION_MODES, OPTIMIZATION_LEVELS):
+        # inter op threads only matter when the operators run in parallel
+        inter_options = [1, 2, 4] if mode == "parallel" else [1]
+        for inter in inter_options:
+            if inter > max_threads:
+                continue
+            grid.append({
+                "intra_op_num_threads": intra,
+                "inter_op_num_threads": inter,
+                "execution_mode": mode,
+                "graph_optimization_level": level,
+            })
+    return grid
+
+
+def benchmark_config(model_path, config, feeds=None, warmup=2, runs=10):
+    """Returns (median latency in ms, feeds) of the model with the given config"""
+    sess = ort.InferenceSession(model_path, sess_options=build_options(config), providers=["CPUExecutionProvider"])
+    if feeds is None:
+        feeds = synthetic_inputs(sess)
+    for _ in range(warmup):
+        sess.run(None, feeds)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        sess.run(None, feeds)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings)), feeds
+
+
+def tune_model(model_path, warmup=2, runs=10, max_threads=None, verbose=True):
+    feeds = None
+    results = []
+    for config in config_grid(max_threads):
+        latency, feeds = benchmark_config(model_path, config, feeds, warmup, runs)
+        results.append((latency, config))
+        if verbose:
+            print(f"  {latency:8.2f} ms  {config}")
+    results.sort(key=lambda item: item[0])
+    best_latency, best_config = results[0]
+    default_latency, feeds = benchmark_config(model_path, default_config(), feeds, warmup, runs)
+    return {
+        "config": best_config,
+        "latency_ms": round(best_latency, 3),
+        "default_latency_ms": round(default_latency, 3),
+        "tuned_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "onnxruntime": ort.__version__,
+    }
+
+
+def default_config():
+    defaults = ort.SessionOptions()
+    return {
+        "intra_op_num_threads": defaults.intra_op_num_threads,
+        "inter_op_num_threads": defaults.inter_op_num_threads,
+        "execution_mode": "sequential",
+        "graph_optimization_level": "all",
+    }
+
+
+def read_profile(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_tuning(model_path, tuning):
+    path = profile_path(model_path)
+    profile = read_profile(path)
+    profile.setdefault(host_key(), {})[model_key(model_path)] = tuning
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_session_options(model_path):
+    """SessionOptions saved for this model on this host, None when it was never tuned"""
+    try:
+        profile = read_profile(profile_path(model_path))
+        tuning = profile.get(host_key(), {}).get(model_key(model_path))
+        if tuning:
+            return build_options(tuning["config"])
+    except Exception as e:
+        print(f"Could not apply the session profile for {model_path}: {e}")
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune onnxruntime session options for this machine")
+    parser.add_argument("models", nargs="+", help="onnx model files")
+    parser.add_argument("--runs", type=int, default=10, help="timed runs per setting")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed runs per setting")
+    parser.add_argument("--max-threads", type=int, help="largest thread count to try (default: cpu count)")
+    args = parser.parse_args(argv)
+
+    for model_path in args.models:
+        print(f"Tuning {model_path} on {host_key()}")
+        tuning = tune_model(model_path, args.warmup, args.runs, args.max_threads)
+        path = save_tuning(model_path, tuning)
+        print(f"Best: {tuning['latency_ms']} ms (default {tuning['default_latency_ms']} ms) with {tuning['config']}")
+        print(f"Saved to: {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
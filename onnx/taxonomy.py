@@ -0,0 +1,129 @@
+import numpy as np
+
+# rank name: column in the label file (uuid;class;order;family;genus;species;common name),
+# which is also the length of the taxonomic path up to that rank
+RANK_COLUMNS = {
+    "class": 1,
+    "order": 2,
+    "family": 3,
+    "genus": 4,
+    "species": 5,
+}
+# from the most specific to the most general
+RANKS = ["species", "genus", "family", "order", "class"]
+
+
+class TaxonomyIndex():
+    """
+    Array backed taxonomy of the spicesNet labels, built once when the labels are loaded.
+
+    The labels are sorted by their taxonomic path, so every group of every rank is one contiguous
+    segment of the sorted labels. Rolling the label probabilities up to a rank is then a single
+    `np.add.reduceat` over the segment offsets, for one image or a whole batch.
+    """
+    def __init__(self, label_lines):
+        rows = [line.strip().split(";") for line in label_lines if line.strip()]
+        self.size = len(rows)
+        self.uuids = [row[0] for row in rows]
+        self.common_names = [row[6] if len(row) > 6 else "" for row in rows]
+        self.paths = [tuple(row[1:6]) for row in rows]
+
+        # label positions sorted by taxonomic path (ties keep the file order)
+        self.order = np.array(sorted(range(self.size), key=lambda i: (self.paths[i], i)), dtype=np.int64)
+
+        self.offsets = {} # rank: start of each group in the sorted labels
+        self.group_ids = {} # rank: group id of each label (in file order)
+        self.group_names = {} # rank: name of each group
+        self.group_valid = {} # rank: False when the group has no name at this rank (e.g. "blank" at genus)
+        self.group_paths = {} # rank: taxonomic path of each group
+        for rank, depth in RANK_COLUMNS.items():
+            offsets = []
+            names = []
+            paths = []
+            group_ids = np.empty(self.size, dtype=np.int32)
+            previous = None
+            for position, label in enumerate(self.order):
+                prefix = self.paths[label][:depth]
+                if prefix != previous:
+                    offsets.append(position)
+                    if rank == "species" and prefix[-1]:
+                        names.append(" ".join(prefix[-2:])) # genus & epithet
+                    else:
+                        names.append(prefix[-1])
+                    paths.append(prefix)
+                    previous = prefix
+                group_ids[label] = len(offsets) - 1
+            self.offsets[rank] = np.array(offsets, dtype=np.int64)
+            self.group_ids[rank] = group_ids
+            self.group_names[rank] = names
+            self.group_valid[rank] = np.array([name != "" for name in names], dtype=bool)
+            self.group_paths[rank] = paths
+
+    @classmethod
+    def from_file(cls, label_file_path):
+        with open(label_file_path, 'r') as f:
+            return cls(f.readlines())
+
+    def display_name(self, index):
+        """Common name of a label, falls back to the most specific taxon"""
+        if self.common_names[index]:
+            return self.common_names[index]
+        taxa = [taxon for taxon in self.paths[index] if taxon]
+        return taxa[-1] if taxa else self.uuids[index]
+
+    def taxonomy_path(self, index):
+        return [taxon for taxon in self.paths[index] if taxon]
+
+    def rollup(self, probabilities, rank):
+        """
+        Sum the label probabilities (..., labels) up to the groups of the rank (..., groups).
+        `rank="label"` returns the probabilities unchanged.
+        """
+        if rank == "label":
+            return probabilities
+        probabilities = np.asarray(probabilities)
+        sorted_probs = np.take(probabilities, self.order, axis=-1)
+        return np.add.reduceat(sorted_probs, self.offsets[rank], axis=-1)
+
+    def rollup_all(self, probabilities):
+        return {rank: self.rollup(probabilities, rank) for rank in RANKS}
+
+    def group_name(self, rank, group):
+        if rank == "label":
+            return self.display_name(group)
+        return self.group_names[rank][group]
+
+    def topk(self, probabilities, k=5, rank="label"):
+        """
+        Ranked top-k of one image (labels,) or a batch (N, labels) at the given rank.
+        Returns (indices, scores) with shape (k,) or (N, k), groups without a name at the rank are skipped.
+        """
+        scores = self.rollup(probabilities, rank)
+        if rank != "label":
+            scores = np.where(self.group_valid[rank], scores, -1.0)
+        k = min(k, scores.shape[-1])
+        top = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+        top_scores = np.take_along_axis(scores, top, axis=-1)
+        ranking = np.argsort(-top_scores, axis=-1)
+        return np.take_along_axis(top, ranking, axis=-1), np.take_along_axis(top_scores, ranking, axis=-1)
+
+    def best_supported(self, probabilities, threshold=0.5, ranks=("label",) + tuple(RANKS)):
+        """
+        For every image pick the most specific rank whose best group reaches the threshold.
+        Returns a list of (rank, group index, score), the first rank is used when none reaches it.
+        """
+        probabilities = np.atleast_2d(probabilities)
+        best_indices = []
+        best_scores = []
+        for rank in ranks:
+            indices, scores = self.topk(probabilities, k=1, rank=rank)
+            best_indices.append(indices[:, 0])
+            best_scores.append(scores[:, 0])
+        best_indices = np.stack(best_indices) # (ranks, N)
+        best_scores = np.stack(best_scores)
+        reached = best_scores >= threshold
+        rank_positions = np.where(reached.any(axis=0), reached.argmax(axis=0), 0)
+        return [
+            (ranks[position], int(best_indices[position, i]), float(best_scores[position, i]))
+            for i, position in enumerate(rank_positions)
+        ]
@@ -0,0 +1,87 @@
+"""
+Memory a steady state single image inference allocates per call, on the synthetic models of
+`benchmarks/fixtures.py` (needs `pip install onnx`, nothing is downloaded).
+
+Run it from the `onnx` folder:
+    python -m pytest tests/test_alloc_budget.py -s
+
+Every engine runs the same in-memory image with & without the reusable buffers, the peak of the
+traced allocations of each call after the warm up must stay within BUDGET_KB with the buffers.
+tracemalloc only sees the allocations made through Python (numpy arrays included), not the native
+allocations of onnxruntime (its arena, the tensors of the graph), those are not part of the budget.
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import numpy as np
+import pytest
+
+from model_manifest import is_available
+from session_registry import SessionRegistry
+
+BUDGET_KB = 64
+WARMUP = 3
+RUNS = 10
+ENGINES = {
+    # name: (module, class, session starter, single image runner)
+    "detect": ("onnx_detect", "OnnxDetect", "start_detect_session", "detect_outputs"),
+    "classify": ("onnx_classify", "OnnxClassify", "start_classify_session", "classify_probabilities"),
+    "species": ("onnx_species", "OnnxSpecies", "start_species_session", "species_probabilities"),
+}
+
+
+@pytest.fixture(scope="module")
+def model_dir(tmp_path_factory):
+    from fixtures import write_models
+
+    folder = str(tmp_path_factory.mktemp("models"))
+    write_models(folder)
+    return folder
+
+
+def call_peak(fn, runs):
+    """Largest peak of traced allocations (bytes) over `runs` calls"""
+    peaks = []
+    for _ in range(runs):
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - start)
+    return max(peaks)
+
+
+def measure(name, model_dir, img, reuse_buffers):
+    module_name, class_name, starter, runner = ENGINES[name]
+    engine = getattr(__import__(module_name), class_name)(save_dir=model_dir, model_dir=model_dir, registry=SessionRegistry(), reuse_buffers=reuse_buffers)
+    assert getattr(engine, starter)(), f"Could not start the {name} session from {model_dir}"
+    sess = engine.sess
+    run = lambda: getattr(engine, runner)(sess, img)
+    for _ in range(WARMUP):
+        run()
+    tracemalloc.start()
+    try:
+        return call_peak(run, RUNS)
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize("name", list(ENGINES))
+def test_allocation_budget(name, model_dir, monkeypatch):
+    if not is_available(name, model_dir):
+        pytest.fail(f"The synthetic {name} model is missing in {model_dir}")
+
+    def no_download(task, folder, progress=None):
+        raise AssertionError(f"The test tried to download the {task} model")
+
+    # a missing fixture fails the test instead of fetching the real model
+    monkeypatch.setattr(__import__(ENGINES[name][0]), "fetch_model", no_download)
+    img = np.random.default_rng(0).integers(0, 255, size=(480, 640, 3), dtype=np.uint8)
+    allocating = measure(name, model_dir, img, reuse_buffers=False) / 1024
+    buffered = measure(name, model_dir, img, reuse_buffers=True) / 1024
+    print(f"\n{name:9s} allocating: {allocating:10.1f} KB/call  buffers: {buffered:8.1f} KB/call (python & numpy only, not onnxruntime)")
+    assert buffered <= BUDGET_KB, f"{name} allocates {buffered:.1f} KB per call with the buffers, the budget is {BUDGET_KB} KB"
+    assert buffered < allocating
@@ -0,0 +1,54 @@
+"""
+`InferenceWorker` queue bookkeeping: cancelled jobs call `on_cancel` instead of running & every job,
+run or dropped, is marked done for `queue.join()`.
+
+Run it from the `onnx` folder:
+    python -m pytest tests
+"""
+from threading import Event
+
+from inference_worker import InferenceWorker
+
+
+def test_cancel_calls_on_cancel():
+    worker = InferenceWorker("test", max_queue=4)
+    gate = Event()
+    ran = []
+    dropped = []
+    # the first job holds the worker thread, the next ones wait in the queue
+    blocker = worker.submit(gate.wait, 5)
+    while worker.queue_depth():
+        pass
+    jobs = [worker.submit(ran.append, i, tag="screen", on_cancel=lambda i=i: dropped.append(i)) for i in range(3)]
+    kept = worker.submit(ran.append, "kept", tag="other", on_cancel=lambda: dropped.append("kept"))
+
+    assert worker.cancel(tag="screen") == 3
+    assert sorted(dropped) == [0, 1, 2]
+    assert all(job.done.is_set() for job in jobs)
+    gate.set()
+    worker.queue.join()
+
+    assert blocker.done.is_set() and kept.done.is_set()
+    assert ran == ["kept"]
+    assert sorted(dropped) == [0, 1, 2]
+    stats = worker.stats()
+    assert stats["cancelled"] == 3 and stats["completed"] == 2 and stats["queue_depth"] == 0
+    worker.shutdown()
+
+
+def test_cancelled_job_skipped_by_worker():
+    worker = InferenceWorker("test", max_queue=4)
+    gate = Event()
+    dropped = []
+    worker.submit(gate.wait, 5)
+    while worker.queue_depth():
+        pass
+    # cancelled on the job itself, it stays queued until the worker reaches it
+    job = worker.submit(dropped.append, "ran", on_cancel=lambda: dropped.append("dropped"))
+    job.cancel()
+    gate.set()
+    worker.queue.join()
+
+    assert job.done.is_set()
+    assert dropped == ["dropped"]
+    worker.shutdown()
@@ -0,0 +1,187 @@
+"""
+`ModelDownloader` against a local HTTP server: parallel ranges, resume, servers without range support,
+hash & size checks and a retry after a failed attempt.
+
+Run it from the `onnx` folder:
+    python -m pytest tests
+"""
+import os
+import json
+import hashlib
+from threading import Thread, Lock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from model_downloader import PART_SUFFIX, STATE_SUFFIX, DownloadError, ModelDownloader
+
+PAYLOAD = os.urandom(1024 * 1024 + 123)
+SEGMENT = 256 * 1024
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Serves `server.payload` at /model.onnx, with or without HTTP ranges"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.ranges_seen.append(self.headers.get("Range"))
+            if server.fail_next:
+                server.fail_next -= 1
+                self.send_error(503)
+                return
+        if self.path != "/model.onnx":
+            self.send_error(404)
+            return
+        payload = server.payload
+        start, end = 0, len(payload) - 1
+        requested = self.headers.get("Range")
+        if server.ranges and requested:
+            first, last = requested.split("=", 1)[1].split("-")
+            start = int(first)
+            end = int(last) if last else len(payload) - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(payload)}")
+        else:
+            # a server without range support answers with the whole file
+            self.send_response(200)
+        body = payload[start:end + 1]
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", server.etag)
+        self.end_headers()
+        if server.cut_after is not None and len(body) > 1:
+            # the connection drops after `cut_after` bytes of every transfer (not the 1 byte probe)
+            self.wfile.write(body[:server.cut_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    httpd.daemon_threads = True
+    httpd.payload = PAYLOAD
+    httpd.etag = '"v1"'
+    httpd.ranges = True
+    httpd.cut_after = None
+    httpd.fail_next = 0
+    httpd.ranges_seen = []
+    httpd.lock = Lock()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/model.onnx"
+    thread = Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def downloader(server, dest, **kwargs):
+    kwargs.setdefault("segments", 4)
+    kwargs.setdefault("min_segment_size", SEGMENT)
+    kwargs.setdefault("chunk_size", 16 * 1024)
+    kwargs.setdefault("timeout", 5)
+    return ModelDownloader(server.url, str(dest), **kwargs)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_parallel_ranges(server, tmp_path):
+    dest = tmp_path / "model.onnx"
+    progress = []
+    sha256 = hashlib.sha256(PAYLOAD).hexdigest()
+    path = downloader(server, dest, sha256=sha256, size=len(PAYLOAD), progress=lambda done, total: progress.append((done, total))).run()
+
+    assert read(path) == PAYLOAD
+    assert not os.path.exists(str(dest) + PART_SUFFIX)
+    assert not os.path.exists(str(dest) + STATE_SUFFIX)
+    # the probe & one request per segment
+    assert server.ranges_seen[0] == "bytes=0-0"
+    assert len(server.ranges_seen) == 5
+    assert progress[-1] == (len(PAYLOAD), len(PAYLOAD))
+
+
+def test_resume_after_interruption(server, tmp_path):
+    dest = tmp_path / "model.onnx"
+    server.cut_after = 40 * 1024
+    with pytest.raises(DownloadError):
+        downloader(server, dest).run()
+    assert not dest.exists()
+    with open(str(dest) + STATE_SUFFIX, "r") as f:
+        state = json.load(f)
+    done = sum(segment["done"] for segment in state["segments"])
+    assert 0 < done < len(PAYLOAD)
+
+    server.cut_after = None
+    server.ranges_seen.clear()
+    path = downloader(server, dest, sha256=hashlib.sha256(PAYLOAD).hexdigest()).run()
+
+    assert read(path) == PAYLOAD
+    # every segment continues at the bytes saved for it instead of starting over
+    starts = sorted(int(value.split("=")[1].split("-")[0]) for value in server.ranges_seen[1:])
+    assert starts == sorted(segment["start"] + segment["done"] for segment in state["segments"])
+
+
+def test_server_without_ranges(server, tmp_path):
+    dest = tmp_path / "model.onnx"
+    server.ranges = False
+    path = downloader(server, dest, size=len(PAYLOAD)).run()
+
+    assert read(path) == PAYLOAD
+    # the 200 of the probe means one plain stream, no range requests
+    assert server.ranges_seen == ["bytes=0-0", None]
+
+
+def test_resume_falls_back_when_ranges_stop(server, tmp_path):
+    dest = tmp_path / "model.onnx"
+    server.cut_after = 40 * 1024
+    with pytest.raises(DownloadError):
+        downloader(server, dest).run()
+
+    # the server answers 200 instead of 206 now, the partial file can't be continued
+    server.cut_after = None
+    server.ranges = False
+    path = downloader(server, dest, sha256=hashlib.sha256(PAYLOAD).hexdigest()).run()
+    assert read(path) == PAYLOAD
+
+
+def test_hash_mismatch(server, tmp_path):
+    dest = tmp_path / "model.onnx"
+    with pytest.raises(DownloadError, match="SHA-256 mismatch"):
+        downloader(server, dest, sha256="0" * 64).run()
+    # a corrupt file is neither taken as the model nor kept for a resume
+    assert not dest.exists()
+    assert not os.path.exists(str(dest) + PART_SUFFIX)
+    assert not os.path.exists(str(dest) + STATE_SUFFIX)
+
+
+def test_size_mismatch(server, tmp_path):
+    dest = tmp_path / "model.onnx"
+    with pytest.raises(DownloadError, match="expected"):
+        downloader(server, dest, size=len(PAYLOAD) + 1).run()
+    assert not dest.exists()
+
+
+def test_retry_after_server_error(server, tmp_path):
+    dest = tmp_path / "model.onnx"
+    server.fail_next = 1
+    with pytest.raises(DownloadError, match="Could not reach"):
+        downloader(server, dest).run()
+    assert not dest.exists()
+
+    path = downloader(server, dest, sha256=hashlib.sha256(PAYLOAD).hexdigest()).run()
+    assert read(path) == PAYLOAD
+
+
+def test_missing_file(server, tmp_path):
+    server.url = server.url.replace("model.onnx", "missing.onnx")
+    with pytest.raises(DownloadError):
+        downloader(server, tmp_path / "model.onnx").run()
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import itertools
+import threading
+from contextlib import contextmanager, nullcontext
+
+
+def stage(timer, name):
+    """`timer.stage(name)` or nothing when there is no timer"""
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+class StageTimer():
+    """
+    Time spent in each stage of one request (decode, preprocess, inference ...), in ms.
+    Every stage is also a span of the tracer when tracing is on.
+    """
+    def __init__(self, category="inference", tracer=None):
+        self.category = category
+        self.tracer = tracer or default_tracer
+        self.started = time.perf_counter()
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            with self.tracer.span(name, self.category):
+                yield
+        finally:
+            # a stage may run more than once (e.g. a retry), its times add up
+            self.timings[name] = self.timings.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def result(self):
+        """{stage: ms, ..., "total": ms} for the `timings` of a result"""
+        timings = {name: round(ms, 3) for name, ms in self.timings.items()}
+        timings["total"] = round((time.perf_counter() - self.started) * 1000, 3)
+        return timings
+
+
+class Tracer():
+    """
+    Collects spans in the Chrome trace event format, open the written file in `chrome://tracing` or
+    https://ui.perfetto.dev. Spans are complete ("X") events on the thread which ran them, a request is
+    followed from the UI thread to the worker & back with flow events sharing one id.
+    Disabled, a span costs one attribute check.
+    """
+    def __init__(self, max_events=200000):
+        self.enabled = False
+        self.path = None
+        self.max_events = max_events
+        self.events = []
+        self.threads = set()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.origin = time.perf_counter()
+        self.dropped = 0
+
+    def start(self, path=None):
+        """Start recording, `stop()` writes the trace to `path`"""
+        with self.lock:
+            self.events = []
+            self.threads = set()
+            self.dropped = 0
+            self.origin = time.perf_counter()
+            self.path = path
+            self.enabled = True
+
+    def stop(self):
+        """Stop recording & write the trace when a path was given, returns the path"""
+        self.enabled = False
+        if self.path:
+            return self.write(self.path)
+        return None
+
+    def new_flow(self):
+        return next(self.ids) if self.enabled else None
+
+    def now_us(self):
+        return (time.perf_counter() - self.origin) * 1e6
+
+    def add(self, event):
+        thread = threading.current_thread()
+        event["pid"] = os.getpid()
+        event["tid"] = thread.ident
+        with self.lock:
+            if len(self.events) >= self.max_events:
+                self.dropped += 1
+                return
+            if thread.ident not in self.threads:
+                self.threads.add(thread.ident)
+                self.events.append({"name": "thread_name", "ph": "M", "pid": event["pid"], "tid": thread.ident, "args": {"name": thread.name}})
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, category="app", flow=None, flow_phase=None, **args):
+        """
+        Records the block as a span. With a `flow` id the span is linked to the other spans of the request:
+        flow_phase "s" starts the flow, "t" is a step & "f" ends it.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = self.now_us()
+        if flow is not None and flow_phase:
+            flow_event = {"name": "request", "cat": "flow", "ph": flow_phase, "id": flow, "ts": start}
+            if flow_phase == "f":
+                # bind to the enclosing span instead of the next one
+                flow_event["bp"] = "e"
+            self.add(flow_event)
+        try:
+            yield
+        finally:
+            event = {"name": name, "cat": category, "ph": "X", "ts": start, "dur": self.now_us() - start}
+            if args:
+                event["args"] = args
+            self.add(event)
+
+    def wrap_callback(self, callback, flow, name="callback"):
+        """The callback as a span ending the flow of its request, it runs on the UI thread"""
+        if flow is None:
+            return callback
+        def traced(result):
+            with self.span(name, "ui", flow=flow, flow_phase="f"):
+                return callback(result)
+        return traced
+
+    def write(self, path):
+        with self.lock:
+            trace = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+            if self.dropped:
+                trace["otherData"] = {"dropped_events": self.dropped}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(trace, f)
+        os.replace(tmp_path, path)
+        return path
+
+
+# shared by the app & the engines
+default_tracer = Tracer()
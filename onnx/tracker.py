@@ -0,0 +1,185 @@
+import numpy as np
+
+from onnx_detect import DETECTION_DTYPE
+
+# a detection with the id of the track it belongs to
+TRACK_DTYPE = np.dtype(DETECTION_DTYPE.descr + [("track_id", np.int32)])
+
+# constant velocity model of SORT, state [cx, cy, area, aspect, d cx, d cy, d area], measured [cx, cy, area, aspect]
+F = np.eye(7, dtype=np.float64)
+F[0, 4] = F[1, 5] = F[2, 6] = 1.0
+Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001])
+R = np.diag([1.0, 1.0, 10.0, 10.0])
+P0 = np.diag([10.0, 10.0, 10.0, 10.0, 10000.0, 10000.0, 10000.0])
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """IoU of every [x1, y1, x2, y2] box of `boxes_a` (N, 4) with every box of `boxes_b` (M, 4), shape (N, M)"""
+    a = boxes_a[:, None, :]
+    b = boxes_b[None, :, :]
+    width = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    height = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    intersection = width * height
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return intersection / np.maximum(area_a + area_b - intersection, 1e-9)
+
+
+def boxes_to_z(boxes):
+    """[x1, y1, x2, y2] (N, 4) -> [cx, cy, area, aspect] (N, 4)"""
+    width = np.maximum(boxes[:, 2] - boxes[:, 0], 1e-3)
+    height = np.maximum(boxes[:, 3] - boxes[:, 1], 1e-3)
+    return np.stack([boxes[:, 0] + width / 2, boxes[:, 1] + height / 2, width * height, width / height], axis=1)
+
+
+def x_to_boxes(x):
+    """States (N, 7) -> [x1, y1, x2, y2] (N, 4)"""
+    area = np.maximum(x[:, 2], 1e-3)
+    aspect = np.maximum(x[:, 3], 1e-3)
+    width = np.sqrt(area * aspect)
+    height = area / width
+    return np.stack([x[:, 0] - width / 2, x[:, 1] - height / 2, x[:, 0] + width / 2, x[:, 1] + height / 2], axis=1)
+
+
+def greedy_match(iou, threshold):
+    """(track, detection) index pairs, best IoU first, every track & detection used once"""
+    rows, cols = np.nonzero(iou >= threshold)
+    if rows.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    order = np.argsort(-iou[rows, cols], kind="stable")
+    used_rows, used_cols = set(), set()
+    matched_rows, matched_cols = [], []
+    for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        matched_rows.append(row)
+        matched_cols.append(col)
+    return np.array(matched_rows, dtype=np.int64), np.array(matched_cols, dtype=np.int64)
+
+
+class Tracker():
+    """
+    SORT style multi object tracker: a Kalman filter per track (all tracks in one array), matched with the
+    detections by IoU of the same class. Between two detections the tracks are only moved forward, so the
+    detector runs on a schedule instead of on every frame:
+    - every `detect_every` frames
+    - earlier when the confidence of a track (its last score, times `decay` per frame without a detection)
+      falls below `min_confidence`
+    A track is dropped after `max_misses` detections without a match.
+    """
+    def __init__(self, detect_every=5, iou_threshold=0.3, max_misses=2, min_confidence=0.3, decay=0.95):
+        self.detect_every = detect_every
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.min_confidence = min_confidence
+        self.decay = decay
+        self.next_id = 1
+        self.frames = 0
+        self.detections_run = 0
+        self.since_detection = None
+        self.x = np.empty((0, 7), dtype=np.float64)
+        self.p = np.empty((0, 7, 7), dtype=np.float64)
+        self.ids = np.empty(0, dtype=np.int32)
+        self.scores = np.empty(0, dtype=np.float32)
+        self.class_ids = np.empty(0, dtype=np.int32)
+        self.misses = np.empty(0, dtype=np.int32)
+        self.since_update = np.empty(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def confidences(self):
+        return self.scores * self.decay ** self.since_update
+
+    def needs_detection(self):
+        if self.since_detection is None or self.since_detection + 1 >= self.detect_every:
+            return True
+        return bool(len(self) and self.confidences().min() < self.min_confidence)
+
+    def predict(self):
+        """Moves every track one frame forward"""
+        if not len(self):
+            return
+        # a shrinking box must not reach a negative area
+        shrinking = self.x[:, 2] + self.x[:, 6] <= 0
+        self.x[shrinking, 6] = 0.0
+        self.x = self.x @ F.T
+        self.p = F @ self.p @ F.T + Q
+        self.since_update += 1
+
+    def update(self, detections):
+        """Matches the detections (DETECTION_DTYPE) of the current frame with the predicted tracks"""
+        boxes = detections["box"].astype(np.float64)
+        class_ids = detections["class_id"]
+        if len(self) and len(detections):
+            iou = iou_matrix(x_to_boxes(self.x), boxes)
+            iou[self.class_ids[:, None] != class_ids[None, :]] = 0.0
+            rows, cols = greedy_match(iou, self.iou_threshold)
+        else:
+            rows = cols = np.empty(0, dtype=np.int64)
+
+        if rows.size:
+            # Kalman update of the matched tracks, all at once
+            x, p = self.x[rows], self.p[rows]
+            innovation = boxes_to_z(boxes[cols]) - x[:, :4]
+            s = p[:, :4, :4] + R
+            gain = p[:, :, :4] @ np.linalg.inv(s)
+            self.x[rows] = x + (gain @ innovation[:, :, None])[:, :, 0]
+            self.p[rows] = p - gain @ p[:, :4, :]
+            self.scores[rows] = detections["score"][cols]
+            self.since_update[rows] = 0
+            self.misses[rows] = 0
+        unmatched = np.ones(len(self), dtype=bool)
+        unmatched[rows] = False
+        self.misses[unmatched] += 1
+
+        keep = self.misses <= self.max_misses
+        self.x, self.p = self.x[keep], self.p[keep]
+        self.ids, self.scores, self.class_ids = self.ids[keep], self.scores[keep], self.class_ids[keep]
+        self.misses, self.since_update = self.misses[keep], self.since_update[keep]
+
+        new = np.ones(len(detections), dtype=bool)
+        new[cols] = False
+        if new.any():
+            count = int(new.sum())
+            x = np.zeros((count, 7), dtype=np.float64)
+            x[:, :4] = boxes_to_z(boxes[new])
+            self.x = np.concatenate([self.x, x])
+            self.p = np.concatenate([self.p, np.repeat(P0[None], count, axis=0)])
+            self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + count, dtype=np.int32)])
+            self.next_id += count
+            self.scores = np.concatenate([self.scores, detections["score"][new]])
+            self.class_ids = np.concatenate([self.class_ids, class_ids[new]])
+            self.misses = np.concatenate([self.misses, np.zeros(count, dtype=np.int32)])
+            self.since_update = np.concatenate([self.since_update, np.zeros(count, dtype=np.int32)])
+
+    def tracks(self):
+        """The tracks as TRACK_DTYPE, the score is the decayed confidence"""
+        tracks = np.empty(len(self), dtype=TRACK_DTYPE)
+        tracks["box"] = x_to_boxes(self.x)
+        tracks["score"] = self.confidences()
+        tracks["class_id"] = self.class_ids
+        tracks["track_id"] = self.ids
+        return tracks
+
+    def step(self, detect):
+        """
+        One frame: the tracks are moved forward & `detect()` (returning DETECTION_DTYPE detections) runs
+        when it is due. Returns (tracks, whether the detector ran).
+        """
+        self.frames += 1
+        self.predict()
+        detected = self.needs_detection()
+        if detected:
+            self.update(detect())
+            self.detections_run += 1
+            self.since_detection = 0
+        else:
+            self.since_detection += 1
+        # only the tracks seen by the last detection, the missed ones are kept to be matched again
+        return self.tracks()[self.misses == 0], detected
+
+    def reset(self):
+        self.__init__(self.detect_every, self.iou_threshold, self.max_misses, self.min_confidence, self.decay)
@@ -0,0 +1,263 @@
+"""
+Object detection over video files (camera traps, dashcams ...) with `OnnxDetect`.
+
+Run it from the `onnx` folder, for example:
+    python video_detect.py /path/to/clip.mp4 -o clip-detect.mp4 --fps 5
+    python video_detect.py /path/to/clip.avi --no-video --stride 10 # detections only
+
+Decode, inference & encode run on their own threads joined by bounded queues, so a long video never
+holds more than a few frames in memory. Only every `--stride`-th frame (or enough frames for `--fps`)
+is decoded, the skipped frames are only grabbed. The annotated video has the frame rate of the decoded
+frames & a `.ndjson` file gets one line of detections per frame. With `--track N` the detector only runs
+on every N-th decoded frame (earlier when a track gets uncertain), the tracker of `tracker.py` moves the
+boxes in between & gives every object an id.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+
+import cv2
+
+from onnx_detect import OnnxDetect, detections_to_list, models_dir
+
+# fourcc per output container, mp4v is available in every opencv build
+FOURCC = {".avi": "XVID"}
+DEFAULT_FOURCC = "mp4v"
+
+
+class VideoError(Exception):
+    pass
+
+
+def frame_stride(source_fps, target_fps=None, stride=1):
+    """Every how many frames one is detected, `target_fps` wins over `stride` when the source rate is known"""
+    if target_fps and source_fps and source_fps > 0:
+        return max(1, round(source_fps / target_fps))
+    return max(1, int(stride))
+
+
+class VideoDetector():
+    """
+    Detects the objects of a video file frame by frame:
+    reader thread (grab / decode) -> queue -> inference (calling thread) -> queue -> writer thread (draw, encode & NDJSON).
+    """
+    def __init__(self, detector, stride=1, target_fps=None, queue_size=8, tracker=None):
+        self.detector = detector
+        # optional `Tracker`, the detector then only runs when the tracker asks for it
+        self.tracker = tracker
+        self.stride = stride
+        self.target_fps = target_fps
+        self.queue_size = queue_size
+        self.stop_event = Event()
+        self.errors = []
+        self.busy = {"decode": 0.0, "detect": 0.0, "encode": 0.0}
+
+    def put(self, queue, item):
+        # a blocked put gives up once the pipeline is stopped, so no thread waits forever
+        while not self.stop_event.is_set():
+            try:
+                queue.put(item, timeout=0.2)
+                return True
+            except Full:
+                continue
+        return False
+
+    def get(self, queue):
+        while True:
+            try:
+                return queue.get(timeout=0.2)
+            except Empty:
+                if self.stop_event.is_set():
+                    return None
+
+    def fail(self, stage, error):
+        print(f"Video {stage} error: {error}")
+        self.errors.append(f"{stage}: {error}")
+        self.stop_event.set()
+
+    def read_frames(self, capture, stride, frames_out):
+        """Reader thread: decodes every `stride`-th frame, the others are grabbed without decoding"""
+        try:
+            index = 0
+            while not self.stop_event.is_set():
+                start = time.perf_counter()
+                if index % stride:
+                    if not capture.grab():
+                        break
+                    index += 1
+                    self.busy["decode"] += time.perf_counter() - start
+                    continue
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                timestamp_ms = capture.get(cv2.CAP_PROP_POS_MSEC)
+                self.busy["decode"] += time.perf_counter() - start
+                if not self.put(frames_out, (index, timestamp_ms, frame)):
+                    break
+                index += 1
+        except Exception as e:
+            self.fail("decode", e)
+        finally:
+            self.put(frames_out, None)
+
+    def detect_frame(self, frame):
+        result = self.detector.run_detect_array(frame, save_output=False)
+        if not result["status"]:
+            raise VideoError(result["message"])
+        return result["detections"]
+
+    def write_frames(self, results_in, writer, ndjson):
+        """Writer thread: draws & encodes the frames, one NDJSON line each"""
+        try:
+            while True:
+                item = self.get(results_in)
+                if item is None:
+                    break
+                index, timestamp_ms, frame, detections, detected = item
+                start = time.perf_counter()
+                if writer is not None:
+                    # the frame is not used anymore, it is drawn on in place
+                    writer.write(self.detector.draw_detections(frame, detections))
+                if ndjson is not None:
+                    row = {"frame": index, "time_ms": round(timestamp_ms, 1), "detected": detected, "detections": detections_to_list(detections)}
+                    ndjson.write(json.dumps(row) + "\n")
+                self.busy["encode"] += time.perf_counter() - start
+        except Exception as e:
+            self.fail("encode", e)
+
+    def run(self, video_path, output_path=None, ndjson_path=None, progress=None):
+        """
+        Detects the objects of the video, writes the annotated video to `output_path` & the detections to
+        `ndjson_path` (each optional). `progress(frames done, frames of the video)` is called every 25 frames.
+        Returns the stats: frames processed & detected, seconds, fps (processed frames per second) & detect_fps
+        (detector runs per second), busy seconds per stage.
+        """
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            raise VideoError(f"Could not open the video: {video_path}")
+        source_fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+        total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        stride = frame_stride(source_fps, self.target_fps, self.stride)
+
+        writer = None
+        if output_path:
+            fourcc = FOURCC.get(os.path.splitext(output_path)[1].lower(), DEFAULT_FOURCC)
+            output_fps = source_fps / stride if source_fps > 0 else 25.0 / stride
+            writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), output_fps, size)
+            if not writer.isOpened():
+                capture.release()
+                raise VideoError(f"Could not write the video: {output_path}")
+        ndjson = open(ndjson_path, "w") if ndjson_path else None
+
+        frames_in = Queue(maxsize=self.queue_size)
+        results_out = Queue(maxsize=self.queue_size)
+        reader = Thread(target=self.read_frames, args=(capture, stride, frames_in), name="video-decode", daemon=True)
+        encoder = Thread(target=self.write_frames, args=(results_out, writer, ndjson), name="video-encode", daemon=True)
+        start = time.perf_counter()
+        reader.start()
+        encoder.start()
+        processed = detected = 0
+        try:
+            while True:
+                item = self.get(frames_in)
+                if item is None:
+                    break
+                index, timestamp_ms, frame = item
+                detect_start = time.perf_counter()
+                try:
+                    if self.tracker is not None:
+                        detections, ran = self.tracker.step(lambda: self.detect_frame(frame))
+                    else:
+                        detections, ran = self.detect_frame(frame), True
+                except VideoError as e:
+                    self.fail("detect", e)
+                    break
+                self.busy["detect"] += time.perf_counter() - detect_start
+                if not self.put(results_out, (index, timestamp_ms, frame, detections, ran)):
+                    break
+                processed += 1
+                detected += ran
+                if progress and processed % 25 == 0:
+                    progress(index + 1, total_frames)
+        finally:
+            self.put(results_out, None)
+            # the reader may still wait on a full queue when the inference stopped early
+            self.stop_event.set()
+            reader.join()
+            encoder.join()
+            capture.release()
+            if writer is not None:
+                writer.release()
+            if ndjson is not None:
+                ndjson.close()
+        seconds = time.perf_counter() - start
+        return {
+            "video": video_path,
+            "source_fps": round(source_fps, 2),
+            "stride": stride,
+            "frames": processed,
+            "frames_detected": detected,
+            "seconds": round(seconds, 3),
+            # frames per second of wall time, the rate the whole pipeline keeps up
+            "fps": round(processed / seconds, 2) if seconds > 0 else 0.0,
+            "detect_fps": round(detected / seconds, 2) if seconds > 0 else 0.0,
+            "busy_seconds": {name: round(value, 3) for name, value in self.busy.items()},
+            "errors": self.errors,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect the objects of a video file")
+    parser.add_argument("video", help="input video, e.g. .mp4 or .avi")
+    parser.add_argument("-o", "--output", help="annotated output video (default: <video>-detect.mp4)")
+    parser.add_argument("--ndjson", help="per frame detections (default: next to the output video)")
+    parser.add_argument("--no-video", action="store_true", help="only write the detections")
+    parser.add_argument("--stride", type=int, default=1, help="detect every n-th frame")
+    parser.add_argument("--fps", type=float, help="detect about this many frames per second of video (overrides --stride)")
+    parser.add_argument("--track", type=int, metavar="N", help="track the objects & detect only every N-th decoded frame")
+    parser.add_argument("--queue-size", type=int, default=8, help="frames waiting between the decode, inference & encode threads")
+    parser.add_argument("--model-dir", default=models_dir, help="directory of the onnx model files")
+    parser.add_argument("--threshold", type=float, default=0.5, help="minimum detection score")
+    parser.add_argument("--nms-iou", type=float, help="suppress overlapping boxes of the same class above this IoU")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.video):
+        parser.error(f"Video does not exist: {args.video}")
+    if args.stride < 1:
+        parser.error("--stride must be at least 1")
+    if args.fps is not None and args.fps <= 0:
+        parser.error("--fps must be positive")
+    if args.track is not None and args.track < 1:
+        parser.error("--track must be at least 1")
+    stem = os.path.splitext(args.video)[0]
+    output_path = None if args.no_video else (args.output or f"{stem}-detect.mp4")
+    ndjson_path = args.ndjson or f"{os.path.splitext(output_path or args.video)[0]}.ndjson"
+
+    detector = OnnxDetect(model_dir=args.model_dir, threshold=args.threshold, nms_iou=args.nms_iou)
+    if not detector.start_detect_session():
+        print(f"Could not start the detection session from: {args.model_dir}")
+        return 1
+    tracker = None
+    if args.track:
+        from tracker import Tracker
+        tracker = Tracker(detect_every=args.track)
+    stats = detector.run_detect_video(
+        args.video, output_path, ndjson_path, stride=args.stride, target_fps=args.fps, queue_size=args.queue_size, tracker=tracker,
+        progress=lambda done, total: print(f"Frame {done}/{total or '?'}"),
+    )
+    busy = ", ".join(f"{name} {value:.1f} s" for name, value in stats["busy_seconds"].items())
+    print(f"{stats['frames']} frames in {stats['seconds']:.1f} s: {stats['fps']:.1f} FPS (every {stats['stride']}. frame, busy: {busy})")
+    print(f"The detector ran on {stats['frames_detected']} of them: {stats['detect_fps']:.1f} detections per second")
+    if output_path:
+        print(f"Video written to: {output_path}")
+    print(f"Detections written to: {ndjson_path}")
+    return 1 if stats["errors"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())